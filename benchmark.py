@@ -0,0 +1,817 @@
+"""
+Hermetic benchmark of the installation orchestration in install.py.
+
+archinstall (the Installer, SysCommand, the disk and mirror functions) is replaced
+by recording stand-ins that sleep for a configurable latency instead of touching
+disks or the network. Every profile in profiles/ is installed twice: once with the
+latencies, which gives the critical path through the installation, and once
+without, which leaves the Python overhead of install.py itself.
+
+	python benchmark.py [profiles/desktop.json ...] [--latency-scale 0.5] [--latency makepkg=3] [--arg aur-build-workers=4] [--resume] [--reconcile] [--image]
+
+With --downloads, the segmented downloader is benchmarked instead, against local mirrors
+that support ranged requests and are throttled to the given rates:
+
+	python benchmark.py --downloads 32 --mirror-rates 8,8,8,0.5
+
+See benchmark.sh for the end-to-end benchmark on a loop device.
+"""
+import argparse
+import collections
+import fnmatch
+import glob
+import hashlib
+import http.server
+import importlib.util
+import json
+import os
+import re
+import shlex
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import types
+from unittest import mock
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds each kind of operation takes, before scaling.
+default_latencies = {
+	'pacstrap': 1.0,
+	'pacstrap-package': 0.005,
+	'pacman': 0.5,
+	'sync': 0.3,
+	'sync-check': 0.05,
+	'download': 2.0,
+	'makepkg': 1.0,
+	'git': 0.1,
+	'mkfs': 0.2,
+	'mount': 0.02,
+	'tar': 1.0,
+	'command': 0.01,
+	'installer': 0.05,
+	'mirror-probe': 0.2,
+	'aur-rpc': 0.3,
+	'disks': 0.05
+}
+
+# What the archinstall profiles would add with add_additional_packages().
+profile_packages = {
+	'gnome': ['gnome', 'gnome-tweaks', 'gdm', 'xorg-server', 'xorg-xinit'],
+	'kde': ['plasma-meta', 'konsole', 'kate', 'dolphin', 'sddm', 'xorg-server', 'xorg-xinit'],
+	'xfce4': ['xfce4', 'xfce4-goodies', 'lightdm', 'lightdm-gtk-greeter', 'xorg-server', 'xorg-xinit']
+}
+
+class Recorder:
+	"""
+	Counts the calls made to the stand-ins and sleeps for their latency.
+	"""
+	def __init__(self, latencies, scale: float):
+		self.latencies = latencies
+		self.scale = scale
+		self.calls = collections.Counter()
+		self.transactions = []
+		self.simulated = 0
+		self.lock = threading.Lock()
+
+	def call(self, kind: str, extra: float = 0):
+		latency = (self.latencies.get(kind, 0) + extra) * self.scale
+		with self.lock:
+			self.calls[kind] += 1
+			self.simulated += latency
+		if latency:
+			time.sleep(latency)
+
+	def transaction(self, via: str, packages):
+		with self.lock:
+			self.transactions.append({'via': via, 'packages': len(packages)})
+
+def chroot_command(cmd: str):
+	"""
+	Splits an arch-chroot command line into the target and the command run inside it, without any `su - user -c`.
+	"""
+	target, _, inner = cmd[len('/usr/bin/arch-chroot '):].partition(' ')
+	if match := re.match(r'^su - \S+ -c "(.*)"$', inner):
+		inner = match.group(1)
+	return target, inner
+
+def write_file(path: str, data: str = ''):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, 'w') as file:
+		file.write(data)
+
+def record_installed(target: str, packages):
+	"""
+	Adds the packages to the target's local pacman database, the way install.py reads it back.
+	"""
+	for package in packages:
+		write_file(f'{target}/var/lib/pacman/local/{package}-1.0-1/desc', f'%NAME%\n{package}\n\n%VERSION%\n1.0-1\n')
+		write_file(f'{target}/usr/bin/{package}')
+
+def strap(recorder: Recorder, target: str, packages):
+	"""
+	What pacstrap leaves behind: the packages, and with the base system, the files install.py edits after it is in place.
+	"""
+	recorder.transaction('pacstrap', packages)
+	recorder.call('pacstrap', extra=len(packages) * recorder.latencies.get('pacstrap-package', 0))
+	if 'base' in packages:
+		os.makedirs(f'{target}/etc', exist_ok=True)
+		with open(f'{target}/etc/pacman.conf', 'w') as pacman_conf:
+			pacman_conf.write('[options]\n#Color\n#ParallelDownloads = 5\n\n#[multilib]\n#Include = /etc/pacman.d/mirrorlist\n')
+		with open(f'{target}/etc/makepkg.conf', 'w') as makepkg_conf:
+			makepkg_conf.write('CARCH="x86_64"\nCFLAGS="-march=x86-64 -O2 -pipe"\n#MAKEFLAGS="-j2"\n')
+		for path in ('sudoers', 'passwd'):
+			open(f'{target}/etc/{path}', 'a').close()
+		write_file(f'{target}/usr/bin/pacman')
+	record_installed(target, packages)
+
+def stand_in_archinstall(recorder: Recorder, config, arguments, workspace: str):
+	"""
+	Builds the archinstall package (and the submodules install.py imports from) out of stand-ins.
+	"""
+	archinstall = types.ModuleType('archinstall')
+	archinstall.arguments = {**config, **arguments}
+	archinstall.storage = {'LOG_PATH': f'{workspace}/log', 'LOG_FILE': 'install.log', 'MOUNT_POINT': f'{workspace}/mnt'}
+
+	class RequirementError(Exception):
+		pass
+
+	class SysCallError(Exception):
+		pass
+
+	class UnknownFilesystemFormat(Exception):
+		pass
+
+	class JSON(json.JSONEncoder):
+		def default(self, obj):
+			return str(obj)
+
+	def log(*args, **kwargs):
+		if arguments.get('verbose', False):
+			print(*args)
+
+	class SysCommand:
+		def __init__(self, cmd: str, *args, **kwargs):
+			self.cmd = cmd
+			self.exit_code = 0
+			self.output = b''
+			inner = cmd
+			if cmd.startswith('/usr/bin/arch-chroot '):
+				target, inner = chroot_command(cmd)
+				self.chroot(target, inner)
+			elif cmd.startswith('/usr/bin/pacstrap '):
+				arguments = re.sub(r'-C \S+ |-U ', '', cmd).split()[1:]
+				strap(recorder, arguments[0], [os.path.basename(argument).rsplit('-', 3)[0] if '/' in argument else argument for argument in arguments[1:] if not argument.startswith('-')])
+				return
+			elif cmd.startswith('/usr/bin/tar '):
+				self.tar(cmd)
+			recorder.call(self.kind(inner))
+			if 'systemctl show' in inner:
+				self.output = b'0\n'
+			elif 'findmnt' in inner:
+				self.output = b'ext4\n'
+
+		@staticmethod
+		def kind(cmd: str):
+			# The program that runs, past any `cd <dir> &&` and environment assignments in front of it.
+			program = re.sub(r'^(cd \S+ && )?(\w+=\S+ )*', '', cmd).split(' ', 1)[0].rsplit('/', 1)[-1]
+			if program == 'pacman':
+				if re.search(r' -S\S*y', cmd):
+					return 'download' if re.search(r' -S\S*w', cmd) else 'sync'
+				if re.search(r' -[SU]\b', cmd):
+					recorder.transaction('pacman', cmd.split())
+					return 'pacman'
+			elif program.startswith('mkfs'):
+				return 'mkfs'
+			elif program in ('mount', 'umount'):
+				return 'mount'
+			elif program in ('makepkg', 'git', 'tar'):
+				return program
+			return 'command'
+
+		@staticmethod
+		def tar(cmd: str):
+			# Golden images are archived and extracted for real, uncompressed, with the excludes applied the way tar does.
+			arguments = shlex.split(cmd)
+			directory = arguments[arguments.index('-C') + 1]
+			excludes = [argument[len('--exclude='):] for argument in arguments if argument.startswith('--exclude=')]
+			if '-cpf' in arguments:
+				def exclude(member):
+					return None if any(fnmatch.fnmatch(member.name, pattern) for pattern in excludes) else member
+
+				with tarfile.open(arguments[arguments.index('-cpf') + 1], 'w') as archive:
+					archive.add(directory, arcname='.', filter=exclude)
+			elif '-xpf' in arguments:
+				with tarfile.open(arguments[arguments.index('-xpf') + 1], 'r') as archive:
+					archive.extractall(directory)
+
+		def chroot(self, target: str, cmd: str):
+			# Leave behind what the real commands would, for install.py to find.
+			if match := re.match(r'^mkdir -p (\S+)$', cmd):
+				os.makedirs(f'{target}{match.group(1)}', exist_ok=True)
+			elif match := re.match(r'^git clone .* (\S+)$', cmd):
+				os.makedirs(f'{target}{match.group(1)}/.git', exist_ok=True)
+				with open(f'{target}{match.group(1)}/.git/HEAD', 'w') as head:
+					head.write(hashlib.sha1(match.group(1).encode()).hexdigest() + '\n')
+			elif match := re.match(r'^cd (\S+) && PKGDEST=(\S+) makepkg', cmd):
+				write_file(f'{target}{match.group(2)}/{os.path.basename(match.group(1))}-1.0-1-x86_64.pkg.tar.zst')
+			elif match := re.match(r'^/usr/bin/pacman -U .*?((?: /\S+)+)$', cmd):
+				record_installed(target, [os.path.basename(path).rsplit('-', 3)[0] for path in match.group(1).split()])
+			elif match := re.match(r'^/usr/bin/pacman -S .*?((?: [\w@.+-]+)+)$', cmd):
+				record_installed(target, [package for package in match.group(1).split() if not package.startswith('-')])
+			elif match := re.match(r'^/usr/bin/useradd .*? (\S+)$', cmd):
+				os.makedirs(f'{target}/home/{match.group(1)}', exist_ok=True)
+				with open(f'{target}/etc/passwd', 'a') as passwd:
+					passwd.write(f'{match.group(1)}:x:999:999::/home/{match.group(1)}:/bin/bash\n')
+			elif match := re.match(r'^/usr/bin/userdel -r (\S+)$', cmd):
+				shutil.rmtree(f'{target}/home/{match.group(1)}', ignore_errors=True)
+				with open(f'{target}/etc/passwd', 'r') as passwd:
+					lines = [line for line in passwd if line.split(':', 1)[0] != match.group(1)]
+				with open(f'{target}/etc/passwd', 'w') as passwd:
+					passwd.writelines(lines)
+			elif match := re.match(r'^/usr/bin/pacman -R\S* .*?((?: [\w@.+-]+)+)$', cmd):
+				for package in match.group(1).split():
+					shutil.rmtree(f'{target}/var/lib/pacman/local/{package}-1.0-1', ignore_errors=True)
+
+		def decode(self, *args):
+			return self.output.decode()
+
+		def contains(self, text: str):
+			return text in self.decode()
+
+	class Partition:
+		def __init__(self, path: str, mountpoint: str, filesystem: str):
+			self.path = path
+			self.target_mountpoint = mountpoint
+			self.filesystem = filesystem
+			self.encrypted = False
+			self.allow_formatting = True
+
+		def __str__(self):
+			return self.path
+
+		def safe_to_format(self):
+			return self.allow_formatting
+
+		def filesystem_supported(self):
+			return True
+
+		def format(self, filesystem=None, *args, **kwargs):
+			recorder.call('mkfs')
+			self.filesystem = filesystem or self.filesystem
+			return True
+
+		def encrypt(self, *args, **kwargs):
+			recorder.call('mkfs')
+
+		def mount(self, target: str, options: str = ''):
+			recorder.call('mount')
+			os.makedirs(target, exist_ok=True)
+			return True
+
+	class BlockDevice:
+		def __init__(self, path: str):
+			self.path = path
+			# As left behind by an earlier installation.
+			self.partitions = [Partition(f'{path}p1', '/boot', 'vfat'), Partition(f'{path}p2', '/', 'ext4')]
+			self.keep_partitions = True
+			self.encryption_password = None
+
+		def __str__(self):
+			return self.path
+
+		def __iter__(self):
+			return iter(self.partitions)
+
+		def has_partitions(self):
+			return bool(self.partitions)
+
+	class Disks(dict):
+		def __missing__(self, path):
+			return self.setdefault(path, BlockDevice(path))
+
+	class Filesystem:
+		def __init__(self, blockdevice: BlockDevice, mode):
+			self.blockdevice = blockdevice
+
+		def __enter__(self):
+			return self
+
+		def __exit__(self, *args):
+			return False
+
+		def use_entire_disk(self, root_filesystem_type='ext4'):
+			recorder.call('command')
+			self.blockdevice.partitions = [
+				Partition(f'{self.blockdevice.path}p1', '/boot', 'vfat'),
+				Partition(f'{self.blockdevice.path}p2', '/', root_filesystem_type)
+			]
+
+		def find_partition(self, mountpoint: str):
+			return next(partition for partition in self.blockdevice.partitions if partition.target_mountpoint == mountpoint)
+
+	class Profile:
+		def __init__(self, installer=None, path: str = None):
+			self.namespace = os.path.splitext(os.path.basename(path))[0]
+			self.packages = profile_packages.get(self.namespace, [])
+
+		def __str__(self):
+			return f'Profile({self.namespace})'
+
+		def has_prep_function(self):
+			return False
+
+		def has_post_install(self):
+			return False
+
+	class Installer:
+		def __init__(self, target: str, *, kernels='linux', **kwargs):
+			self.target = target
+			self.kernels = kernels if type(kernels) is list else [kernels]
+			self.helper_flags = {'base': False, 'bootloader': False}
+
+		def __enter__(self):
+			return self
+
+		def __exit__(self, *args):
+			if not args[0]:
+				self.genfstab()
+			return False
+
+		def log(self, *args, **kwargs):
+			log(*args, **kwargs)
+
+		def pacstrap(self, *packages, **kwargs):
+			if len(packages) == 1 and type(packages[0]) in (list, tuple):
+				packages = packages[0]
+			# The Installer syncs the live medium's databases first (pacman -Syy), which costs a sync.
+			recorder.call('sync')
+			strap(recorder, self.target, packages)
+			return True
+
+		def add_additional_packages(self, *packages, **kwargs):
+			return self.pacstrap(*packages)
+
+		def minimal_installation(self):
+			self.pacstrap(['base', 'base-devel', 'linux-firmware'] + self.kernels)
+			self.helper_flags['base'] = True
+			return True
+
+		def arch_chroot(self, cmd: str, runas=None):
+			if runas:
+				cmd = f'su - {runas} -c "{cmd}"'
+			return SysCommand(f'/usr/bin/arch-chroot {self.target} {cmd}')
+
+		def install_profile(self, profile):
+			recorder.call('installer')
+			return self.add_additional_packages(profile.packages)
+
+		def user_create(self, user: str, password=None, groups=None, sudo=False):
+			recorder.call('installer')
+			os.makedirs(f'{self.target}/home/{user}', exist_ok=True)
+			with open(f'{self.target}/etc/passwd', 'a') as passwd:
+				passwd.write(f'{user}:x:1000:1000::/home/{user}:/bin/bash\n')
+
+		def enable_service(self, *services):
+			for service in services:
+				recorder.call('installer')
+				write_file(f"{self.target}/etc/systemd/system/multi-user.target.wants/{service if '.' in service else service + '.service'}")
+
+		def set_locale(self, *args, **kwargs):
+			recorder.call('installer')
+			write_file(f'{self.target}/etc/locale.conf')
+
+		def set_hostname(self, hostname: str, *args, **kwargs):
+			recorder.call('installer')
+			write_file(f'{self.target}/etc/hostname', hostname)
+
+		def set_timezone(self, *args, **kwargs):
+			recorder.call('installer')
+			write_file(f'{self.target}/etc/localtime')
+
+		def add_bootloader(self, bootloader: str = 'systemd-bootctl'):
+			recorder.call('installer')
+			write_file(f"{self.target}{'/boot/grub/grub.cfg' if bootloader == 'grub-install' else '/boot/loader/loader.conf'}")
+			self.helper_flags['bootloader'] = bootloader
+
+		def mkinitcpio(self, *flags):
+			recorder.call('installer', extra=recorder.latencies.get('pacman', 0))
+
+		def drop_to_shell(self):
+			pass
+
+		def __getattr__(self, name: str):
+			# set_mirrors, activate_ntp, genfstab and the like only cost their latency.
+			if name.startswith('_'):
+				raise AttributeError(name)
+
+			def method(*args, **kwargs):
+				recorder.call('installer')
+				return True
+			return method
+
+	class Mirrors(dict):
+		def __missing__(self, region):
+			return self.setdefault(region, {f'https://mirror{number}.example.org/archlinux/$repo/os/$arch': True for number in range(20)})
+
+	def all_disks(*args, **kwargs):
+		recorder.call('disks')
+		return Disks()
+
+	def list_mirrors(*args, **kwargs):
+		recorder.call('mirror-probe')
+		return Mirrors()
+
+	def check_mirror_reachable(*args, **kwargs):
+		recorder.call('mirror-probe')
+		return True
+
+	def run_custom_user_commands(commands, installation, *args, **kwargs):
+		for command in commands:
+			installation.arch_chroot(command)
+
+	def unexpected_prompt(*args, **kwargs):
+		raise RequirementError('The benchmark runs unattended, but install.py tried to prompt')
+
+	archinstall.__dict__.update({
+		'RequirementError': RequirementError,
+		'SysCallError': SysCallError,
+		'UnknownFilesystemFormat': UnknownFilesystemFormat,
+		'JSON': JSON,
+		'log': log,
+		'Installer': Installer,
+		'Profile': Profile,
+		'Filesystem': Filesystem,
+		'GPT': 'gpt',
+		'MBR': 'msdos',
+		'luks2': None,
+		'all_disks': all_disks,
+		'disk_layouts': lambda: {},
+		'list_mirrors': list_mirrors,
+		'use_mirrors': lambda *args, **kwargs: recorder.call('command'),
+		'service_state': lambda service: 'dead',
+		'set_keyboard_language': lambda language: True,
+		'validate_package_list': lambda packages: True,
+		'do_countdown': lambda: True,
+		'select_disk': unexpected_prompt,
+		'select_kernel': unexpected_prompt,
+		'ask_for_audio_selection': unexpected_prompt,
+		'ask_to_configure_network': unexpected_prompt,
+		'ask_for_a_timezone': unexpected_prompt,
+		'generic_select': unexpected_prompt
+	})
+
+	modules = {
+		'archinstall': archinstall,
+		'archinstall.lib': types.ModuleType('archinstall.lib'),
+		'archinstall.lib.general': types.ModuleType('archinstall.lib.general'),
+		'archinstall.lib.hardware': types.ModuleType('archinstall.lib.hardware'),
+		'archinstall.lib.installer': types.ModuleType('archinstall.lib.installer'),
+		'archinstall.lib.networking': types.ModuleType('archinstall.lib.networking'),
+		'archinstall.lib.profiles': types.ModuleType('archinstall.lib.profiles'),
+		'archinstall.lib.user_interaction': types.ModuleType('archinstall.lib.user_interaction')
+	}
+	modules['archinstall.lib.general'].__dict__.update({'run_custom_user_commands': run_custom_user_commands, 'SysCommand': SysCommand})
+	modules['archinstall.lib.hardware'].has_uefi = lambda: True
+	modules['archinstall.lib.installer'].Installer = Installer
+	modules['archinstall.lib.networking'].check_mirror_reachable = check_mirror_reachable
+	modules['archinstall.lib.profiles'].Profile = Profile
+	modules['archinstall.lib.user_interaction'].get_password = unexpected_prompt
+	return modules
+
+def load_install(recorder: Recorder, config, arguments, workspace: str, keep=()):
+	"""
+	Imports a fresh copy of install.py against the stand-ins, and swaps out its functions that talk to the network
+	(apart from the ones named in keep).
+	"""
+	sys.modules.update(stand_in_archinstall(recorder, config, arguments, workspace))
+	spec = importlib.util.spec_from_file_location('install', os.path.join(here, 'install.py'))
+	install = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(install)
+
+	def probe_mirror(url: str, timeout: float = 5):
+		recorder.call('mirror-probe')
+		score = int(hashlib.sha1(url.encode()).hexdigest()[:4], 16) / 65536
+		return {'url': url, 'latency': score / 10, 'throughput': 1024 ** 2 / (score + 0.1), 'score': score}
+
+	def aur_info(*packages):
+		recorder.call('aur-rpc')
+		# Everything asked for is in the AUR, except for the repository packages the AUR packages depend on.
+		info = {}
+		for package in packages:
+			if package in repo_dependencies:
+				continue
+			info[package] = {
+				'Name': package,
+				'PackageBase': package,
+				'Version': '1.0-1',
+				'Depends': ['glibc'],
+				'MakeDepends': ['git'] if package.endswith('-git') else (['go'] if package == 'yay' else []),
+				'CheckDepends': []
+			}
+		return info
+
+	def load_package_index(refresh: bool = False):
+		packages = set(config.get('packages', None) or []) | set(profile_packages.get(config.get('profile', None), []))
+		return {'repo': packages | repo_dependencies, 'aur': set(config.get('aur-packages', None) or [])}
+
+	def private_pacman_config():
+		root = os.path.dirname(install.archinstall.arguments['package-cache'])
+		os.makedirs(f'{root}/prefetch/db/local', exist_ok=True)
+		with open(f'{root}/prefetch/pacman.conf', 'w') as config_file:
+			config_file.write('[options]\n\n' + ''.join(f'[{repository}]\nInclude = /etc/pacman.d/mirrorlist\n\n' for repository in ('core', 'extra', 'community', 'multilib')))
+		return f'{root}/prefetch/pacman.conf', f'{root}/prefetch/db'
+
+	def mirror_lastsync(mirror: str):
+		recorder.call('sync-check')
+		return 1
+
+	def fetch_sync_database(url: str, path: str):
+		# The mirror never changes, so a database that was downloaded once stays up to date.
+		if os.path.isfile(path):
+			recorder.call('sync-check')
+			return False
+		recorder.call('sync')
+		tarfile.open(path, 'w:gz').close()
+		return True
+
+	repo_dependencies = {'glibc', 'git', 'go'}
+	stand_ins = {
+		'stream_command': lambda cmd, name: install.SysCommand(cmd),
+		'probe_mirror': probe_mirror,
+		'aur_info': aur_info,
+		'load_package_index': load_package_index,
+		'private_pacman_config': private_pacman_config,
+		'mirror_lastsync': mirror_lastsync,
+		'fetch_sync_database': fetch_sync_database
+	}
+	for name, function in stand_ins.items():
+		if name not in keep:
+			setattr(install, name, function)
+	return install
+
+def run(profile_path: str, latencies, scale: float, arguments, workspace: str, changes=None):
+	"""
+	Installs one profile against the stand-ins, with everything (the target, caches and logs) in the workspace,
+	and returns what it cost. The changes are applied on top of the profile.
+	"""
+	with open(profile_path, 'r') as profile_file:
+		config = json.load(profile_file)
+	for key, value in (changes or {}).items():
+		config[key] = (config.get(key, None) or []) + value if type(value) is list else value
+
+	recorder = Recorder(latencies, scale)
+	os.makedirs(f'{workspace}/log', exist_ok=True)
+	arguments = {
+		'silent': True,
+		'package-cache': f'{workspace}/cache/pkg',
+		'aur-cache': f'{workspace}/cache/aur',
+		'ccache': f'{workspace}/cache/ccache',
+		'mirror-cache': f'{workspace}/cache/mirrors.json',
+		**arguments
+	}
+	if arguments.get('image-cache', False) is True:
+		arguments['image-cache'] = f'{workspace}/cache/images'
+	install = load_install(recorder, config, arguments, workspace)
+
+	started = time.perf_counter()
+	cpu = time.process_time()
+	error = None
+	try:
+		with mock.patch('os.getuid', return_value=0), mock.patch('sys.argv', ['install.py', f'--config={profile_path}']):
+			install.main()
+	except SystemExit as err:
+		error = repr(err) if err.code else None
+	except Exception as err:
+		error = repr(err)
+	wall = time.perf_counter() - started
+	cpu = time.process_time() - cpu
+
+	steps = {event['name']: event['dur'] / 1000000 for event in install.trace_events if event['ph'] == 'X' and event['cat'] == 'step'}
+	return {
+		'wall': wall,
+		'cpu': cpu,
+		'simulated': recorder.simulated,
+		'calls': dict(recorder.calls),
+		'transactions': recorder.transactions,
+		'first_disk_write': install.preflight_results.get('first_disk_write', None),
+		'steps': steps,
+		'error': error
+	}
+
+reconcile_changes = {'packages': ['jellyfin-server'], 'aur-packages': ['jellyfin-media-player']}
+
+def print_result(timed, overhead=None):
+	print(f"  critical path:     {timed['wall']:8.2f}s  ({timed['simulated']:.2f}s of simulated work, {timed['simulated'] / max(timed['wall'], 0.000001):.1f}x overlap)")
+	if overhead:
+		print(f"  python overhead:   {overhead['wall']:8.2f}s  ({overhead['cpu']:.2f}s cpu)")
+	if timed['first_disk_write'] is not None:
+		print(f"  first disk write:  {timed['first_disk_write']:8.2f}s")
+	vias = collections.Counter(transaction['via'] for transaction in timed['transactions'])
+	print(f"  pacman transactions: {len(timed['transactions'])} ({', '.join(f'{count} via {via}' for via, count in vias.items())})")
+	print(f"  calls: {', '.join(f'{kind} {count}' for kind, count in sorted(timed['calls'].items(), key=lambda item: -item[1]))}")
+	for step, duration in sorted(timed['steps'].items(), key=lambda item: -item[1])[:8]:
+		print(f'    {step:<40} {duration:8.2f}s')
+
+def serve_mirror(blob: bytes, rate: float, delay: float = 0):
+	"""
+	Starts a local mirror that serves the blob at any path, throttled to the rate (in bytes per second per connection),
+	answering every request after the delay and with support for ranged requests. Returns the server, which runs
+	until it is shut down and counts the requests it got.
+	"""
+	class Handler(http.server.BaseHTTPRequestHandler):
+		def do_GET(self):
+			self.server.requests += 1
+			time.sleep(delay)
+			start, end = 0, len(blob) - 1
+			if match := re.match(r'^bytes=(\d+)-(\d*)$', self.headers.get('Range', '')):
+				start, end = int(match.group(1)), min(int(match.group(2) or end), end)
+				self.send_response(206)
+				self.send_header('Content-Range', f'bytes {start}-{end}/{len(blob)}')
+			else:
+				self.send_response(200)
+			self.send_header('Content-Length', str(end + 1 - start))
+			self.end_headers()
+
+			started = time.perf_counter()
+			sent = 0
+			try:
+				for offset in range(start, end + 1, 64 * 1024):
+					self.wfile.write(blob[offset:min(offset + 64 * 1024, end + 1)])
+					sent += min(64 * 1024, end + 1 - offset)
+					if (ahead := sent / rate - (time.perf_counter() - started)) > 0:
+						time.sleep(ahead)
+			except (BrokenPipeError, ConnectionResetError):
+				pass
+
+		def log_message(self, *args):
+			pass
+
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	server.daemon_threads = True
+	server.requests = 0
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+def benchmark_downloads(size: int, rates, arguments, workspace: str):
+	"""
+	Downloads the same file from the first mirror in one piece, and in segments from all of them.
+	"""
+	blob = os.urandom(size)
+	sha256 = hashlib.sha256(blob).hexdigest()
+	servers = [serve_mirror(blob, rate) for rate in rates]
+	urls = [f'http://127.0.0.1:{server.server_address[1]}/extra/os/x86_64/large-1.0-1-x86_64.pkg.tar.zst' for server in servers]
+	install = load_install(Recorder(default_latencies, 0), {}, {'silent': True, **arguments}, workspace)
+
+	results = {}
+	try:
+		for name, download in (('single', lambda destination: install.download_file(urls[0], destination, sha256)), ('segmented', lambda destination: install.segmented_download(urls, destination, size, sha256))):
+			started = time.perf_counter()
+			error = None
+			try:
+				download(destination := f'{workspace}/{name}.pkg.tar.zst')
+			except Exception as err:
+				error = repr(err)
+			results[name] = {'wall': time.perf_counter() - started, 'error': error, 'verified': not error and install.file_sha256(destination) == sha256}
+	finally:
+		for server in servers:
+			server.shutdown()
+
+	print(f"{size / 1024 ** 2:.0f} MiB from mirrors at {', '.join(f'{rate / 1024 ** 2:g}' for rate in rates)} MiB/s")
+	for name, result in results.items():
+		if result['error']:
+			print(f"  {name:<10} failed: {result['error']}")
+		else:
+			print(f"  {name:<10} {result['wall']:8.2f}s  {size / result['wall'] / 1024 ** 2:6.1f} MiB/s  {'verified' if result['verified'] else 'CHECKSUM MISMATCH'}")
+	return results
+
+def benchmark_mirrors(delays, arguments, workspace: str):
+	"""
+	Ranks local mirrors that answer after the given delays with the real probe_mirror() and rank_mirrors(),
+	checking that they come out fastest first and that mirrors slower than the probe timeout are left out.
+	Then checks that ranked_mirrors() probes once, answers from its cache until the TTL runs out, and probes again after.
+	"""
+	servers = [serve_mirror(b'\0' * 16 * 1024, 64 * 1024 ** 2, delay) for delay in delays]
+	urls = [f'http://127.0.0.1:{server.server_address[1]}/$repo/os/$arch' for server in servers]
+	by_delay = [url for _, url in sorted(zip(delays, urls))]
+	timeout = 1.0
+	responsive = [url for delay, url in sorted(zip(delays, urls)) if delay < timeout]
+	install = load_install(Recorder(default_latencies, 0), {}, {'silent': True, 'mirror-cache': f'{workspace}/mirrors.json', **arguments}, workspace, keep=('probe_mirror',))
+
+	def requests():
+		return sum(server.requests for server in servers)
+
+	results = {}
+	try:
+		started = time.perf_counter()
+		ranked = [result['url'] for result in install.rank_mirrors(urls, timeout=timeout)]
+		results['ranked'] = {'wall': time.perf_counter() - started, 'verified': ranked == responsive, 'order': ranked}
+
+		mirrors = {url: True for url in reversed(responsive)}
+		for name, ttl in (('probed', 3600), ('cached', 3600), ('expired', 0)):
+			install.archinstall.arguments['mirror-cache-ttl'] = ttl
+			before = requests()
+			started = time.perf_counter()
+			order = list(install.ranked_mirrors('Local', mirrors))
+			probes = requests() - before
+			results[name] = {'wall': time.perf_counter() - started, 'verified': order == responsive and (probes == 0) == (name == 'cached'), 'order': order, 'requests': probes}
+	finally:
+		for server in servers:
+			server.shutdown()
+
+	print(f"{len(delays)} mirrors answering after {', '.join(f'{delay:g}' for delay in delays)}s, probed with a {timeout:g}s timeout")
+	for name, result in results.items():
+		outcome = 'fastest first' if result['verified'] else f"WRONG: {', '.join(str(by_delay.index(url)) for url in result['order'])}"
+		requested = f"  {result['requests']} requests" if 'requests' in result else ''
+		print(f"  {name:<10} {result['wall']:8.2f}s  {outcome}{requested}")
+	return results
+
+def parse_assignments(assignments, convert=str):
+	parsed = {}
+	for assignment in assignments:
+		key, _, value = assignment.partition('=')
+		parsed[key] = convert(value) if value else True
+	return parsed
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmarks the orchestration of install.py against recording stand-ins of archinstall.')
+	parser.add_argument('profiles', nargs='*', default=sorted(glob.glob(os.path.join(here, 'profiles', '*.json'))))
+	parser.add_argument('--latency-scale', type=float, default=1.0, help='multiplies every latency')
+	parser.add_argument('--latency', action='append', default=[], metavar='KIND=SECONDS', help=f"overrides a latency, one of: {', '.join(default_latencies)}")
+	parser.add_argument('--arg', action='append', default=[], metavar='KEY[=VALUE]', help='passes an argument to install.py, for example aur-build-workers=4')
+	parser.add_argument('--resume', action='store_true', help='also resumes every installation once it completed, which should skip all of it')
+	parser.add_argument('--reconcile', action='store_true', help='also reconciles every installation with its profile plus one repository and one AUR package')
+	parser.add_argument('--image', action='store_true', help='also installs every profile again on an empty target, from the golden image the first install captured')
+	parser.add_argument('--downloads', type=float, metavar='MIB', help='benchmarks the segmented downloader with a file of this size instead')
+	parser.add_argument('--mirror-rates', default='8,8,8,0.5', metavar='MIB/S,...', help='the throttled rate of every local mirror for --downloads, best ranked first')
+	parser.add_argument('--mirrors', action='store_true', help='tests the mirror ranking and its cache against local mirrors instead')
+	parser.add_argument('--mirror-delays', default='0.05,0.15,0.3,1.5', metavar='SECONDS,...', help='how long every local mirror takes to answer for --mirrors')
+	parser.add_argument('--output', help='also writes the results as JSON to this file')
+	parser.add_argument('--verbose', action='store_true', help="shows install.py's log output")
+	options = parser.parse_args()
+
+	latencies = {**default_latencies, **parse_assignments(options.latency, float)}
+	arguments = parse_assignments(options.arg)
+	if options.verbose:
+		arguments['verbose'] = True
+	if options.image:
+		arguments.setdefault('image-cache', True)
+
+	if options.mirrors:
+		with tempfile.TemporaryDirectory(prefix='archinstall-benchmark-') as workspace:
+			results = benchmark_mirrors([float(delay) for delay in options.mirror_delays.split(',')], arguments, workspace)
+		if options.output:
+			with open(options.output, 'w') as output:
+				json.dump(results, output, indent=4)
+		return all(result['verified'] for result in results.values())
+
+	if options.downloads:
+		with tempfile.TemporaryDirectory(prefix='archinstall-benchmark-') as workspace:
+			results = benchmark_downloads(int(options.downloads * 1024 ** 2), [float(rate) * 1024 ** 2 for rate in options.mirror_rates.split(',')], arguments, workspace)
+		if options.output:
+			with open(options.output, 'w') as output:
+				json.dump(results, output, indent=4)
+		return all(result['verified'] for result in results.values())
+
+	results = {}
+	for profile_path in options.profiles:
+		name = os.path.basename(profile_path)
+		with tempfile.TemporaryDirectory(prefix='archinstall-benchmark-') as workspace:
+			results[name] = {'timed': run(profile_path, latencies, options.latency_scale, arguments, workspace)}
+			if options.resume:
+				results[name]['resumed'] = run(profile_path, latencies, options.latency_scale, {**arguments, 'resume': True}, workspace)
+			if options.reconcile:
+				results[name]['reconciled'] = run(profile_path, latencies, options.latency_scale, {**arguments, 'reconcile': True}, workspace, reconcile_changes)
+			if options.image:
+				shutil.rmtree(f'{workspace}/mnt')
+				results[name]['restored'] = run(profile_path, latencies, options.latency_scale, arguments, workspace)
+		with tempfile.TemporaryDirectory(prefix='archinstall-benchmark-') as workspace:
+			results[name]['overhead'] = run(profile_path, latencies, 0, arguments, workspace)
+
+		print(f'{name}')
+		if errors := [result['error'] for result in results[name].values() if result['error']]:
+			print(f'  failed: {errors[0]}')
+			continue
+		print_result(results[name]['timed'], results[name]['overhead'])
+		if options.resume:
+			print(f'{name}, resumed after completing')
+			print_result(results[name]['resumed'])
+		if options.reconcile:
+			print(f"{name}, reconciled with {', '.join(package for packages in reconcile_changes.values() for package in packages)} added")
+			print_result(results[name]['reconciled'])
+		if options.image:
+			print(f'{name}, installed from its golden image')
+			print_result(results[name]['restored'])
+
+	if options.output:
+		with open(options.output, 'w') as output:
+			json.dump(results, output, indent=4)
+
+	return not any(result['error'] for runs in results.values() for result in runs.values())
+
+
+if __name__ == '__main__':
+	sys.exit(0 if main() else 1)
@@ -0,0 +1,65 @@
+#!/bin/sh
+#
+# End-to-end benchmark: installs a profile onto a loop device (like test-config.sh) from a
+# local mirror, and records the time it takes until the image is bootable and how much was written to it.
+#
+#   ./benchmark.sh [profile] [mirror directory] [extra install.py arguments...]
+#
+# The mirror directory is a local copy of an Arch Linux mirror in the $repo/os/$arch layout, for example:
+#   rsync -rtlH --delete rsync://<mirror>/archlinux/{core,extra,community,multilib} /srv/mirror/
+# AUR packages are still cloned from aur.archlinux.org, unless the AUR build cache already holds them.
+# Set BOOT_TEST=1 to boot the image in qemu afterwards, as test-config.sh does.
+
+PROFILE=${1:-./profiles/desktop.json}
+MIRROR=${2:-/srv/mirror}
+PORT=${PORT:-8080}
+IMAGE=${IMAGE:-./benchimage.img}
+[ $# -gt 0 ] && shift
+[ $# -gt 0 ] && shift
+
+rm -rf "$IMAGE"
+dd if=/dev/zero of="$IMAGE" bs=1G count=0 seek=30 status=none
+LOOP=$(losetup -fP --show "$IMAGE")
+DEVICE=$(basename "$LOOP")
+
+python -m http.server "$PORT" --bind 127.0.0.1 --directory "$MIRROR" >/dev/null 2>&1 &
+SERVER=$!
+trap 'kill $SERVER 2>/dev/null; umount -R /mnt/benchmark 2>/dev/null; losetup -d $LOOP' EXIT
+
+# Sectors written to the loop device so far (field 7 of the block device stat).
+sectors_written() {
+	awk '{print $7}' "/sys/block/$DEVICE/stat"
+}
+
+WRITTEN=$(sectors_written)
+STARTED=$(date +%s.%N)
+python install.py --config "$PROFILE" --harddrive="$LOOP" --silent --no-mirror-rank \
+	--mirror-url="http://127.0.0.1:$PORT/\$repo/os/\$arch" --mount-point=/mnt/benchmark "$@"
+STATUS=$?
+sync
+FINISHED=$(date +%s.%N)
+WRITTEN=$(( $(sectors_written) - WRITTEN ))
+
+# The image is bootable when the boot partition has a boot loader and an entry to boot.
+BOOTABLE=no
+mkdir -p /mnt/benchmark-check
+if mount -o ro "${LOOP}p1" /mnt/benchmark-check 2>/dev/null; then
+	if ls /mnt/benchmark-check/loader/entries/*.conf /mnt/benchmark-check/grub/grub.cfg >/dev/null 2>&1; then
+		BOOTABLE=yes
+	fi
+	umount /mnt/benchmark-check
+fi
+
+echo "profile:              $PROFILE"
+echo "install exit code:    $STATUS"
+echo "bootable:             $BOOTABLE"
+echo "time to bootable:     $(echo "$FINISHED - $STARTED" | bc) s"
+echo "bytes written:        $(( WRITTEN * 512 )) ($(( WRITTEN * 512 / 1024 / 1024 )) MiB)"
+
+if [ "$BOOT_TEST" = "1" ]; then
+	losetup -d "$LOOP"
+	trap 'kill $SERVER 2>/dev/null' EXIT
+	qemu-system-x86_64 -enable-kvm -machine q35,accel=kvm -device intel-iommu -cpu host -m 4096 -boot order=d -drive file="$IMAGE",format=raw -drive if=pflash,format=raw,readonly,file=/usr/share/ovmf/x64/OVMF_CODE.fd -drive if=pflash,format=raw,readonly,file=/usr/share/ovmf/x64/OVMF_VARS.fd
+fi
+
+[ "$STATUS" -eq 0 ] && [ "$BOOTABLE" = "yes" ]
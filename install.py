@@ -1,26 +1,41 @@
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import difflib
+import email.utils
+import fcntl
+import functools
+import glob
+import gzip
+import hashlib
+import itertools
 import json
 import logging
 import os
+import re
+import resource
+import select
+import shlex
+import shutil
+import subprocess
+import sys
+import tarfile
+import threading
 import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 import archinstall
 from archinstall.lib.general import run_custom_user_commands, SysCommand
-from archinstall.lib.hardware import has_uefi, AVAILABLE_GFX_DRIVERS
+from archinstall.lib.hardware import has_uefi
 from archinstall.lib.installer import Installer
 from archinstall.lib.networking import check_mirror_reachable
 from archinstall.lib.profiles import Profile
 from archinstall.lib.user_interaction import get_password
 
-if archinstall.arguments.get('help'):
-	print("See `man archinstall` for help.")
-	exit(0)
-if os.getuid() != 0:
-	print("Archinstall requires root privileges to run. See --help for more.")
-	exit(1)
-
-# For support reasons, we'll log the disk layout pre installation to match against post-installation layout
-archinstall.log(f"Disk states before installing: {archinstall.disk_layouts()}", level=logging.DEBUG)
-
 keyboard_language = 'us'
 mirror_region = 'United States'
 keep_partitions = False
@@ -30,9 +45,134 @@ bootloader = 'systemd-bootctl'
 root_password = None
 username = 'echo'
 profile = 'gnome'
+aur_cache_path = '/var/cache/archinstall/aur'
+aur_cache_size = 20 * 1024 ** 3
+package_cache_path = '/var/cache/archinstall/pkg'
+package_cache_keep = 3
+partial_download_age = 3600
+mirror_cache_path = '/var/cache/archinstall/mirrors.json'
+mirror_cache_ttl = 3600
+package_index_path = '/var/cache/archinstall/package-index.json'
+package_index_ttl = 24 * 3600
+image_cache_path = '/var/cache/archinstall/images'
+image_cache_ttl = 7 * 24 * 3600
+command_log_tail = 40
+ccache_path = '/var/cache/archinstall/ccache'
+build_tmpfs_share = 0.5
+build_tmpfs_minimum = 2 * 1024 ** 3
+aur_build_user = 'aurbuild'
+governor_pressure = 10
+zram_share = 0.5
+segmented_download_minimum = 32 * 1024 ** 2
+download_segment_size = 8 * 1024 ** 2
+download_mirrors = 4
+download_slow_factor = 4
+audio_packages = {
+	'pipewire': ["pipewire", "pipewire-alsa", "pipewire-jack", "pipewire-media-session", "pipewire-pulse", "gst-plugin-pipewire", "libpulse"],
+	'pulseaudio': ["pulseaudio"]
+}
 
 print('aur-packages', archinstall.arguments.get('aur-packages', None))
 
+trace_started = time.perf_counter()
+trace_events = []
+trace_lock = threading.Lock()
+
+@contextlib.contextmanager
+def trace_step(name: str, category: str = 'step', **args):
+	"""
+	Records the wall time, CPU time and child process resource usage of a step
+	as a Chrome trace event. Child usage is process wide, so steps running
+	concurrently will see each other's children as well.
+	"""
+	started = time.perf_counter()
+	cpu = time.thread_time()
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	if category != 'command' and (progress_file := archinstall.arguments.get('progress-file', None)):
+		# Steps run concurrently, so each thread writes a file of its own before moving it into place.
+		with open(temporary := f'{progress_file}.{os.getpid()}.{threading.get_ident()}', 'w') as progress:
+			json.dump({'step': name, 'time': time.time()}, progress)
+		os.replace(temporary, progress_file)
+	try:
+		yield
+	finally:
+		finished = time.perf_counter()
+		children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+		with trace_lock:
+			trace_events.append({
+				'name': name,
+				'cat': category,
+				'ph': 'X',
+				'ts': int((started - trace_started) * 1000000),
+				'dur': int((finished - started) * 1000000),
+				'pid': os.getpid(),
+				'tid': threading.get_ident(),
+				'args': {
+					**args,
+					'thread': threading.current_thread().name,
+					'cpu_s': round(time.thread_time() - cpu, 6),
+					'children_user_s': round(children_after.ru_utime - children.ru_utime, 6),
+					'children_system_s': round(children_after.ru_stime - children.ru_stime, 6),
+					'children_maxrss_kb': children_after.ru_maxrss
+				}
+			})
+
+def traced(function):
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		with trace_step(function.__name__):
+			return function(*args, **kwargs)
+	return wrapper
+
+def trace_installer(installation: Installer):
+	"""
+	Wraps the Installer's methods so that each call shows up in the trace,
+	including the ones the Installer makes on itself (such as pacstrap).
+	"""
+	for method in ('pacstrap', 'arch_chroot', 'minimal_installation', 'set_locale', 'set_hostname', 'set_mirrors', 'add_bootloader',
+		'copy_iso_network_config', 'configure_nic', 'enable_service', 'install_profile', 'user_create', 'user_set_pw',
+		'set_timezone', 'activate_ntp', 'set_keyboard_language', 'mkinitcpio', 'genfstab'):
+		if callable(function := getattr(installation, method, None)):
+			setattr(installation, method, trace_step(f'Installer.{method}', category='installer')(function))
+
+def run_command(cmd: str, *args, **kwargs):
+	with trace_step(cmd.split(' ', 1)[0].rsplit('/', 1)[-1], category='command', cmd=cmd):
+		return SysCommand(cmd, *args, **kwargs)
+
+def write_trace(top: int = 20):
+	"""
+	Writes the recorded steps to the log directory as Chrome trace JSON
+	(loadable in chrome://tracing or Perfetto) and as a plain text summary of the slowest steps.
+	"""
+	log_path = archinstall.storage.get('LOG_PATH', '/var/log/archinstall')
+	stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{archinstall.arguments.get('hostname', None) or os.getpid()}"
+	os.makedirs(log_path, exist_ok=True)
+
+	with trace_lock:
+		events = list(trace_events)
+	threads = {(event['pid'], event['tid']): event['args']['thread'] for event in events}
+	metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}} for (pid, tid), name in threads.items()]
+	with open(f'{log_path}/install-trace-{stamp}.json', 'w') as trace_file:
+		json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, trace_file)
+
+	totals = {}
+	for event in events:
+		if event['ph'] != 'X':
+			continue
+		total = totals.setdefault((event['cat'], event['name']), {'count': 0, 'wall': 0, 'cpu': 0, 'children': 0})
+		total['count'] += 1
+		total['wall'] += event['dur'] / 1000000
+		total['cpu'] += event['args']['cpu_s']
+		total['children'] += event['args']['children_user_s'] + event['args']['children_system_s']
+
+	with open(f'{log_path}/install-trace-{stamp}.txt', 'w') as summary:
+		summary.write(f"Total wall time: {time.perf_counter() - trace_started:.1f}s\n\n")
+		summary.write(f"{'step':<50} {'calls':>6} {'wall s':>10} {'cpu s':>10} {'children s':>11}\n")
+		for (category, name), total in sorted(totals.items(), key=lambda item: item[1]['wall'], reverse=True)[:top]:
+			summary.write(f"{category + ':' + name:<50.50} {total['count']:>6} {total['wall']:>10.2f} {total['cpu']:>10.2f} {total['children']:>11.2f}\n")
+
+	archinstall.log(f'Wrote installation trace to {log_path}/install-trace-{stamp}.json', level=logging.INFO)
+
 def ask_user_questions():
 	"""
 		First, we'll ask the user for a bunch of user input.
@@ -54,20 +194,27 @@ def ask_user_questions():
 		archinstall.set_keyboard_language(archinstall.arguments['keyboard-language'])
 
 	# Set which region to download packages from during the installation
+	# A single mirror given on the command line (such as a local mirror) replaces the region's mirrors.
+	if mirror_url := archinstall.arguments.get('mirror-url', None):
+		archinstall.arguments['mirror-region'] = {'Custom': {mirror_url: True}}
+
 	if not archinstall.arguments.get('mirror-region', None):
 		while True:
 			try:
-				archinstall.arguments['mirror-region'] = {mirror_region: archinstall.list_mirrors()[mirror_region]}
+				archinstall.arguments['mirror-region'] = {mirror_region: ranked_mirrors(mirror_region, available_mirrors()[mirror_region])}
 				archinstall.log(f'Mirror region: {mirror_region}', fg='yellow')
 				break
 			except archinstall.RequirementError as e:
 				archinstall.log(e, fg="red")
+	elif type(archinstall.arguments['mirror-region']) is dict:
+		# Mirrors that are already spelled out are used as they are.
+		archinstall.log(f"Mirror region: {', '.join(archinstall.arguments['mirror-region'])}", fg='yellow')
 	else:
 		selected_region = archinstall.arguments['mirror-region']
 		archinstall.log(f'Mirror region: {selected_region}', fg='yellow')
-		archinstall.arguments['mirror-region'] = {selected_region: archinstall.list_mirrors()[selected_region]}
+		archinstall.arguments['mirror-region'] = {selected_region: ranked_mirrors(selected_region, available_mirrors()[selected_region])}
 
-	if not archinstall.arguments.get('sys-language', None) and archinstall.arguments.get('advanced', False):
+	if not archinstall.arguments.get('sys-language', None) and archinstall.arguments.get('advanced', False) and interactive():
 		archinstall.arguments['sys-language'] = input("Enter a valid locale (language) for your OS, (Default: en_US): ").strip()
 		archinstall.arguments['sys-encoding'] = input("Enter a valid system default encoding for your OS, (Default: utf-8): ").strip()
 		archinstall.log("Keep in mind that if you want multiple locales, post configuration is required.", fg="yellow")
@@ -82,10 +229,13 @@ def ask_user_questions():
 
 	# Ask which harddrive/block-device we will install to
 	archinstall.log(f'Block device: {archinstall.arguments.get("harddrive", None)}', fg='yellow')
-	if archinstall.arguments.get('harddrive', None):
-		archinstall.arguments['harddrive'] = archinstall.all_disks()[archinstall.arguments['harddrive']]
+	if archinstall.arguments.get('prefetch-only', False):
+		# Prefetching doesn't touch the disk, which may well not exist on the machine that prefetches.
+		archinstall.arguments['harddrive'] = None
+	elif archinstall.arguments.get('harddrive', None):
+		archinstall.arguments['harddrive'] = (preflight('disks') or archinstall.all_disks())[archinstall.arguments['harddrive']]
 	else:
-		archinstall.arguments['harddrive'] = archinstall.select_disk(archinstall.all_disks())
+		archinstall.arguments['harddrive'] = archinstall.select_disk(preflight('disks') or archinstall.all_disks()) if interactive() else None
 		if archinstall.arguments['harddrive'] is None:
 			archinstall.arguments['target-mount'] = archinstall.storage.get('MOUNT_POINT', '/mnt')
 
@@ -199,7 +349,7 @@ def ask_user_questions():
 	archinstall.log(f'Bootloader: ' + archinstall.arguments["bootloader"], fg='yellow')
 	# Get the hostname for the machine
 	if not archinstall.arguments.get('hostname', None):
-		archinstall.arguments['hostname'] = input('Desired hostname for the installation: ').strip(' ')
+		archinstall.arguments['hostname'] = input('Desired hostname for the installation: ').strip(' ') if interactive() else 'archlinux'
 		archinstall.log(f'Hostname: ' + archinstall.arguments["hostname"], fg='yellow')
 
 	# Ask for a root password (optional, but triggers requirement for super-user if skipped)
@@ -207,12 +357,16 @@ def ask_user_questions():
 		archinstall.arguments['!root-password'] = root_password
 
 	# Ask for additional users (super-user if root pw was not set)
-	archinstall.arguments['users'] = {}
+	# Users that come from the configuration are kept, so that config-driven runs don't prompt.
+	users = archinstall.arguments.get('users', None) or {}
+	superusers = archinstall.arguments.get('superusers', None) or {}
 	archinstall.arguments['superusers'] = {}
-	if not archinstall.arguments.get('!root-password', None):
+	if not archinstall.arguments.get('!root-password', None) and not superusers:
+		if not interactive():
+			archinstall.log('The configuration needs either a root password or a superuser.', fg='red')
+			exit(1)
 		archinstall.arguments['superusers'] = {username: {'!password': get_password(prompt=f'Password for user {username}: ')}}
 
-	users, superusers = ({}, {})
 	archinstall.arguments['users'] = users
 	archinstall.arguments['superusers'] = {**archinstall.arguments['superusers'], **superusers}
 
@@ -236,7 +390,7 @@ def ask_user_questions():
 	# Ask about audio server selection if one is not already set
 	if not archinstall.arguments.get('audio', None):
 		# only ask for audio server selection on a desktop profile
-		if str(archinstall.arguments['profile']) == 'Profile(desktop)':
+		if str(archinstall.arguments['profile']) == 'Profile(desktop)' and interactive():
 			archinstall.arguments['audio'] = archinstall.ask_for_audio_selection()
 		else:
 			# packages installed by a profile may depend on audio and something may get installed anyways, not much we can do about that.
@@ -246,39 +400,60 @@ def ask_user_questions():
 	# Ask for preferred kernel:
 	if not archinstall.arguments.get("kernels", None):
 		kernels = ["linux", "linux-lts", "linux-zen", "linux-hardened"]
-		archinstall.arguments['kernels'] = archinstall.select_kernel(kernels)
+		archinstall.arguments['kernels'] = archinstall.select_kernel(kernels) if interactive() else ['linux']
 
 	# Additional packages (with some light weight error handling for invalid package names)
+	try:
+		package_index = load_package_index(refresh=True) if archinstall.arguments.get('refresh-package-index', False) else preflight('package_index')
+	except (OSError, tarfile.TarError, ValueError) as err:
+		archinstall.log(f'Could not load the package index, falling back to online validation: {err}', level=logging.DEBUG)
+		package_index = None
 	print("Only packages such as base, base-devel, linux, linux-firmware, efibootmgr and optional profile packages are installed.")
 	print("If you desire a web browser, such as firefox or chromium, you may specify it in the following prompt.")
 	while True:
 		if not archinstall.arguments.get('packages', None):
+			if not interactive():
+				archinstall.arguments['packages'] = []
+				break
 			archinstall.arguments['packages'] = [package for package in input('Write additional packages to install (space separated, leave blank to skip): ').split(' ') if len(package)]
 
 		if len(archinstall.arguments['packages']):
 			# Verify packages that were given
 			try:
-				archinstall.log("Verifying that additional packages exist (this might take a few seconds)")
-				archinstall.validate_package_list(archinstall.arguments['packages'])
+				archinstall.log("Verifying that additional packages exist")
+				if package_index:
+					validate_packages(package_index, archinstall.arguments['packages'], 'repo')
+				else:
+					archinstall.validate_package_list(archinstall.arguments['packages'])
 				break
 			except archinstall.RequirementError as e:
 				archinstall.log(e, fg='red')
+				if not interactive():
+					exit(1)
 				archinstall.arguments['packages'] = None  # Clear the packages to trigger a new input question
 		else:
 			# no additional packages were selected, which we'll allow
 			break
 
+	# AUR packages can only come from the configuration, so a typo there ends the installation before it starts.
+	if archinstall.arguments.get('aur-packages', None) and package_index:
+		try:
+			validate_packages(package_index, archinstall.arguments['aur-packages'], 'aur')
+		except archinstall.RequirementError as e:
+			archinstall.log(e, fg='red')
+			exit(1)
+
 	# Ask or Call the helper function that asks the user to optionally configure a network.
 	if not archinstall.arguments.get('nic', None):
-		archinstall.arguments['nic'] = archinstall.ask_to_configure_network()
+		archinstall.arguments['nic'] = archinstall.ask_to_configure_network() if interactive() else {}
 		if not archinstall.arguments['nic']:
 			archinstall.log("No network configuration was selected. Network is going to be unavailable until configured manually!", fg="yellow")
 
 	if not archinstall.arguments.get('timezone', None):
-		archinstall.arguments['timezone'] = archinstall.ask_for_a_timezone()
+		archinstall.arguments['timezone'] = archinstall.ask_for_a_timezone() if interactive() else None
 
 	if archinstall.arguments['timezone']:
-		if not archinstall.arguments.get('ntp', False):
+		if not archinstall.arguments.get('ntp', False) and interactive():
 			archinstall.arguments['ntp'] = input("Would you like to use automatic time synchronization (NTP) with the default time servers? [Y/n]: ").strip().lower() in ('y', 'yes', '')
 			if archinstall.arguments['ntp']:
 				archinstall.log("Hardware time and other post-configuration steps might be required in order for NTP to work. For more information, please check the Arch wiki.", fg="yellow")
@@ -290,11 +465,11 @@ def perform_installation_steps():
 	archinstall.log("-- Guided template chosen (with below config) --", level=logging.DEBUG)
 	user_configuration = json.dumps(archinstall.arguments, indent=4, sort_keys=True, cls=archinstall.JSON)
 	archinstall.log(user_configuration, level=logging.INFO)
-	with open("/var/log/archinstall/user_configuration.json", "w") as config_file:
+	with open(os.path.join(archinstall.storage.get('LOG_PATH', '/var/log/archinstall'), 'user_configuration.json'), "w") as config_file:
 		config_file.write(user_configuration)
 	print()
 
-	if not archinstall.arguments.get('silent'):
+	if interactive():
 		input('Press Enter to continue.')
 
 	"""
@@ -302,21 +477,31 @@ def perform_installation_steps():
 		We mention the drive one last time, and count from 5 to 0.
 	"""
 
-	if archinstall.arguments.get('harddrive', None):
-		print(f" ! Formatting {archinstall.arguments['harddrive']} in ", end='')
-		archinstall.do_countdown()
+	if archinstall.arguments.get('resume', False):
+		# Resuming picks up on the partitions of the earlier run, as they are.
+		if archinstall.arguments.get('harddrive', None):
+			with trace_step('mounting'):
+				mount_existing_target()
+	elif archinstall.arguments.get('harddrive', None):
+		# Unattended runs have nobody to abort the countdown, so they skip it.
+		if not archinstall.arguments.get('silent'):
+			print(f" ! Formatting {archinstall.arguments['harddrive']} in ", end='')
+			with trace_step('countdown'):
+				archinstall.do_countdown()
 
 		"""
 			Setup the blockdevice, filesystem (and optionally encryption).
 			Once that's done, we'll hand over to perform_installation()
 		"""
 		mode = archinstall.GPT
-		if has_uefi() is False:
+		if uefi() is False:
 			mode = archinstall.MBR
 		with archinstall.Filesystem(archinstall.arguments['harddrive'], mode) as fs:
 			# Wipe the entire drive if the disk flag `keep_partitions`is False.
+			mark_first_disk_write()
 			if archinstall.arguments['harddrive'].keep_partitions is False:
-				fs.use_entire_disk(root_filesystem_type=archinstall.arguments.get('filesystem', 'btrfs'))
+				with trace_step('partitioning'):
+					fs.use_entire_disk(root_filesystem_type=archinstall.arguments.get('filesystem', 'btrfs'))
 
 			# Check if encryption is desired and mark the root partition as encrypted.
 			if archinstall.arguments.get('!encryption-password', None):
@@ -325,153 +510,759 @@ def perform_installation_steps():
 
 			# After the disk is ready, iterate the partitions and check
 			# which ones are safe to format, and format those.
+			fast = archinstall.arguments.get('fast-provisioning', False)
+			wiped = archinstall.arguments['harddrive'].keep_partitions is False
+			to_format = []
 			for partition in archinstall.arguments['harddrive']:
 				if partition.safe_to_format():
-					# Partition might be marked as encrypted due to the filesystem type crypt_LUKS
-					# But we might have omitted the encryption password question to skip encryption.
-					# In which case partition.encrypted will be true, but passwd will be false.
-					if partition.encrypted and (passwd := archinstall.arguments.get('!encryption-password', None)):
-						partition.encrypt(password=passwd)
-					else:
-						partition.format()
+					to_format.append(partition)
 				else:
 					archinstall.log(f"Did not format {partition} because .safe_to_format() returned False or .allow_formatting was False.", level=logging.DEBUG)
 
-			if archinstall.arguments.get('!encryption-password', None):
-				# First encrypt and unlock, then format the desired partition inside the encrypted part.
-				# archinstall.luks2() encrypts the partition when entering the with context manager, and
-				# unlocks the drive so that it can be used as a normal block-device within archinstall.
-				with archinstall.luks2(fs.find_partition('/'), 'luksloop', archinstall.arguments.get('!encryption-password', None)) as unlocked_device:
-					unlocked_device.format(fs.find_partition('/').filesystem)
-					unlocked_device.mount(archinstall.storage.get('MOUNT_POINT', '/mnt'))
-			else:
-				fs.find_partition('/').mount(archinstall.storage.get('MOUNT_POINT', '/mnt'))
+			# The partitions are independent of each other, so in fast provisioning mode they're formatted concurrently.
+			started = time.perf_counter()
+			with ThreadPoolExecutor(max_workers=len(to_format) if fast and to_format else 1) as pool:
+				durations = list(pool.map(lambda partition: format_partition(partition, fast, wiped), to_format))
+			fast_provisioning['format_saved'] = sum(durations) - (time.perf_counter() - started)
+
+			with trace_step('mounting'):
+				if archinstall.arguments.get('!encryption-password', None):
+					# First encrypt and unlock, then format the desired partition inside the encrypted part.
+					# archinstall.luks2() encrypts the partition when entering the with context manager, and
+					# unlocks the drive so that it can be used as a normal block-device within archinstall.
+					with archinstall.luks2(fs.find_partition('/'), luks_mapper_name(), archinstall.arguments.get('!encryption-password', None)) as unlocked_device:
+						if fast:
+							fast_format(unlocked_device, fs.find_partition('/').filesystem, wiped)
+						else:
+							unlocked_device.format(fs.find_partition('/').filesystem)
+						unlocked_device.mount(archinstall.storage.get('MOUNT_POINT', '/mnt'), options=install_mount_options(unlocked_device.filesystem) if fast else '')
+				else:
+					root = fs.find_partition('/')
+					root.mount(archinstall.storage.get('MOUNT_POINT', '/mnt'), options=install_mount_options(root.filesystem) if fast else '')
 
-			if has_uefi():
-				fs.find_partition('/boot').mount(archinstall.storage.get('MOUNT_POINT', '/mnt') + '/boot')
+				if uefi():
+					boot = fs.find_partition('/boot')
+					boot.mount(archinstall.storage.get('MOUNT_POINT', '/mnt') + '/boot', options=install_mount_options(boot.filesystem) if fast else '')
 
 	perform_installation(archinstall.storage.get('MOUNT_POINT', '/mnt'))
 
 
-def perform_installation(mountpoint):
+fast_provisioning = {}
+
+def luks_mapper_name():
 	"""
-	Performs the installation steps on a block device.
-	Only requirement is that the block devices are
-	formatted and setup prior to entering this function.
+	The device mapper name of the unlocked root partition. The installs of a fleet
+	unlock their targets side by side, so every hostname gets one of its own.
 	"""
-	with archinstall.Installer(mountpoint, kernels=archinstall.arguments.get('kernels', 'linux')) as installation:
-		# if len(mirrors):
-		# Certain services might be running that affects the system during installation.
-		# Currently, only one such service is "reflector.service" which updates /etc/pacman.d/mirrorlist
-		# We need to wait for it before we continue since we opted in to use a custom mirror/region.
-		installation.log('Waiting for automatic mirror selection (reflector) to complete.', level=logging.INFO)
-		while archinstall.service_state('reflector') not in ('dead', 'failed'):
-			time.sleep(1)
-		# Set mirrors used by pacstrap (outside of installation)
-		if archinstall.arguments.get('mirror-region', None):
-			archinstall.use_mirrors(archinstall.arguments['mirror-region'])  # Set the mirrors for the live medium
-		if installation.minimal_installation():
-			installation.set_locale(archinstall.arguments['sys-language'], archinstall.arguments['sys-encoding'].upper())
-			installation.set_hostname(archinstall.arguments['hostname'])
-			if archinstall.arguments['mirror-region'].get("mirrors", None) is not None:
-				installation.set_mirrors(archinstall.arguments['mirror-region'])  # Set the mirrors in the installation medium
-			if archinstall.arguments["bootloader"] == "grub-install" and has_uefi():
-				installation.add_additional_packages("grub")
-			installation.add_bootloader(archinstall.arguments["bootloader"])
-
-			# If user selected to copy the current ISO network configuration
-			# Perform a copy of the config
-			if archinstall.arguments.get('nic', {}) == 'Copy ISO network configuration to installation':
-				installation.copy_iso_network_config(enable_services=True)  # Sources the ISO network configuration to the install medium.
-			elif archinstall.arguments.get('nic', {}).get('NetworkManager', False):
-				installation.add_additional_packages("networkmanager")
-				installation.enable_service('NetworkManager.service')
-			# Otherwise, if a interface was selected, configure that interface
-			elif archinstall.arguments.get('nic', {}):
-				installation.configure_nic(**archinstall.arguments.get('nic', {}))
-				installation.enable_service('systemd-networkd')
-				installation.enable_service('systemd-resolved')
-
-			if archinstall.arguments.get('audio', None) is not None:
-				installation.log(f"This audio server will be used: {archinstall.arguments.get('audio', None)}", level=logging.INFO)
-				if archinstall.arguments.get('audio', None) == 'pipewire':
-					print('Installing pipewire ...')
-
-					installation.add_additional_packages(["pipewire", "pipewire-alsa", "pipewire-jack", "pipewire-media-session", "pipewire-pulse", "gst-plugin-pipewire", "libpulse"])
-				elif archinstall.arguments.get('audio', None) == 'pulseaudio':
-					print('Installing pulseaudio ...')
-					installation.add_additional_packages("pulseaudio")
-			else:
-				installation.log("No audio server will be installed.", level=logging.INFO)
-				
-			# Enabling multilib repository
-			enable_multilib(installation)
-
-			# Enabling pacman color
-			replace_in_file(installation, '/etc/pacman.conf', '#Color', 'Color')
+	return f"luks-{archinstall.arguments.get('hostname', None) or 'archinstall'}"
+
+install_mount_option_sets = {
+	'ext4': 'noatime,commit=60',
+	'btrfs': 'noatime,commit=120,compress=zstd:1',
+	'vfat': 'noatime'
+}
+production_mount_option_sets = {
+	'ext4': 'relatime,commit=5',
+	'btrfs': 'relatime,commit=30,compress=zstd:3',
+	'vfat': 'relatime'
+}
+
+def install_mount_options(filesystem: str):
+	return install_mount_option_sets.get(filesystem, '')
+
+def fast_format(partition, filesystem: str, wiped: bool):
+	"""
+	Formats a partition with lazily initialised metadata. On a disk that was just wiped,
+	the discard pass of mkfs is skipped as well. Filesystems without fast options use the regular format().
+	"""
+	if filesystem == 'ext4':
+		options = 'lazy_itable_init=1,lazy_journal_init=1' + (',nodiscard' if wiped else '')
+		run_command(f'/usr/bin/mkfs.ext4 -F -E {options} {partition.path}', peak_output=False)
+	elif filesystem == 'btrfs':
+		run_command(f"/usr/bin/mkfs.btrfs -f {'-K ' if wiped else ''}{partition.path}", peak_output=False)
+	else:
+		return partition.format(filesystem)
+	partition.filesystem = filesystem
+	return True
 
-			# Enabling pacman parallel downloads
-			replace_in_file(installation, '/etc/pacman.conf', '#ParallelDownloads = 5', 'ParallelDownloads = 5')
+def format_partition(partition, fast: bool, wiped: bool):
+	"""
+	Formats (or encrypts) a single partition and returns how long it took.
+	"""
+	started = time.perf_counter()
+	with admitted('format', str(partition)), trace_step('formatting', partition=str(partition)):
+		# Partition might be marked as encrypted due to the filesystem type crypt_LUKS
+		# But we might have omitted the encryption password question to skip encryption.
+		# In which case partition.encrypted will be true, but passwd will be false.
+		if partition.encrypted and (passwd := archinstall.arguments.get('!encryption-password', None)):
+			partition.encrypt(password=passwd)
+		elif fast:
+			fast_format(partition, partition.filesystem, wiped)
+		else:
+			partition.format()
+	return time.perf_counter() - started
 
-			# Increasing makeflags in makepkg.conf
-			set_makeflags(installation)
+@contextlib.contextmanager
+def production_mounts(installation: Installer):
+	"""
+	Remounts the target with durable options before the Installer writes the fstab,
+	when it was mounted with the throughput oriented options of fast provisioning.
+	"""
+	try:
+		yield
+	finally:
+		if archinstall.arguments.get('fast-provisioning', False):
+			for mountpoint in (f'{installation.target}/boot', installation.target):
+				if not os.path.ismount(mountpoint):
+					continue
+				filesystem = run_command(f'/usr/bin/findmnt -n -o FSTYPE {mountpoint}', peak_output=False).decode().strip()
+				if options := production_mount_option_sets.get(filesystem, None):
+					run_command(f'/usr/bin/mount -o remount,{options} {mountpoint}')
+			run_command('/usr/bin/sync')
+			if saved := fast_provisioning.get('format_saved', 0):
+				archinstall.log(f'Fast provisioning: formatting concurrently saved {saved:.1f}s', level=logging.INFO)
+
+@contextlib.contextmanager
+def fleet_slot(kind: str):
+	"""
+	Holds one of the fleet's slots of the given kind ('download' or 'build') while inside the block.
+	Slots are lock files shared by all installs of a fleet, so the caps hold across processes.
+	Outside of a fleet this does nothing.
+	"""
+	if not (slots := archinstall.arguments.get('fleet-slots', None)):
+		yield
+		return
 
-			if archinstall.arguments.get('packages', None) and archinstall.arguments.get('packages', None)[0] != '':
-				installation.add_additional_packages(archinstall.arguments.get('packages', None))
+	limit = int(archinstall.arguments.get(f'fleet-max-{kind}s', 1))
+	while True:
+		for slot in range(limit):
+			lock = open(f'{slots}/{kind}-{slot}.lock', 'w')
+			try:
+				fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				lock.close()
+				continue
+			try:
+				yield
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+				lock.close()
+			return
+		time.sleep(0.5)
+
+admission = {'running': 0, 'recent': [], 'condition': threading.Condition()}
+admission_reservations = {
+	'build': 1536 * 1024 ** 2,
+	'download': 64 * 1024 ** 2,
+	'format': 256 * 1024 ** 2
+}
+# Seconds it takes a freshly started job to grow into its reservation.
+admission_ramp = 20
+
+def meminfo(field: str):
+	with open('/proc/meminfo', 'r') as meminfo_file:
+		for line in meminfo_file:
+			if line.startswith(f'{field}:'):
+				return int(line.split()[1]) * 1024
+	return 0
+
+def memory_pressure():
+	"""
+	Returns the share of the last 10 seconds (in percent) in which some tasks were stalled on memory,
+	according to the kernel's pressure stall information. Without PSI this is 0.
+	"""
+	try:
+		with open('/proc/pressure/memory', 'r') as pressure:
+			for line in pressure:
+				if line.startswith('some '):
+					return float(dict(field.split('=', 1) for field in line.split()[1:])['avg10'])
+	except (OSError, ValueError, KeyError):
+		pass
+	return 0
+
+def memory_headroom():
+	"""
+	Returns how much memory is available, or how much room is left under the memory limit of our cgroup, whichever is smaller.
+	"""
+	headroom = meminfo('MemAvailable')
+	try:
+		with open('/proc/self/cgroup', 'r') as cgroup_file:
+			cgroup = next(line.strip().split('::', 1)[1] for line in cgroup_file if line.startswith('0::'))
+		with open(f'/sys/fs/cgroup{cgroup}/memory.max', 'r') as limit:
+			maximum = limit.read().strip()
+		if maximum != 'max':
+			with open(f'/sys/fs/cgroup{cgroup}/memory.current', 'r') as current:
+				headroom = min(headroom, int(maximum) - int(current.read().strip()))
+	except (OSError, ValueError, StopIteration):
+		pass
+	return headroom
+
+@contextlib.contextmanager
+def admitted(kind: str, name: str = ''):
+	"""
+	Holds back a parallel job ('build', 'download' or 'format') until the machine has room for it:
+	memory pressure below --governor-pressure, and enough memory for the job's reservation on top of the
+	reservations of jobs that started recently and haven't grown to their full size yet.
+	A job is always admitted when no other job is running, so the installation can't stall.
+	"""
+	if archinstall.arguments.get('no-governor', False):
+		yield
+		return
+
+	threshold = float(archinstall.arguments.get('governor-pressure', governor_pressure))
+	reservation = admission_reservations[kind]
+	waiting = None
+	with admission['condition']:
+		while True:
+			now = time.monotonic()
+			admission['recent'] = [(started, reserved) for started, reserved in admission['recent'] if now - started < admission_ramp]
+			if not admission['running']:
+				break
+			pressure = memory_pressure()
+			headroom = memory_headroom() - sum(reserved for _, reserved in admission['recent'])
+			if pressure < threshold and headroom >= reservation:
+				break
+			if waiting is None:
+				waiting = now
+				archinstall.log(f"Holding back {kind} {name}: memory pressure {pressure:.0f}%, {headroom / 1024 ** 2:.0f} MiB headroom, {admission['running']} jobs running", level=logging.INFO)
+			admission['condition'].wait(1)
+		admission['running'] += 1
+		entry = (now, reservation)
+		admission['recent'].append(entry)
+
+	if waiting is not None:
+		archinstall.log(f'Admitted {kind} {name} after {time.monotonic() - waiting:.0f}s', level=logging.DEBUG)
+	try:
+		yield
+	finally:
+		with admission['condition']:
+			admission['running'] -= 1
+			# A job that has finished no longer grows, so its reservation is given back right away.
+			if entry in admission['recent']:
+				admission['recent'].remove(entry)
+			admission['condition'].notify_all()
+
+@contextlib.contextmanager
+def zram_swap():
+	"""
+	With --zram, adds a zstd compressed swap device in memory (sized as a share of the RAM) to the live system
+	for the duration of the installation, so that a build peak gets swapped out rather than OOM killed.
+	"""
+	if not (share := archinstall.arguments.get('zram', False)):
+		yield
+		return
+
+	size = int(meminfo('MemTotal') * (zram_share if share is True else float(share)))
+	device = None
+	try:
+		run_command('/usr/bin/modprobe zram')
+		if (created := run_command(f'/usr/bin/zramctl --find --size {size} --algorithm zstd', peak_output=False)).exit_code == 0:
+			device = created.decode().strip()
+		if device and run_command(f'/usr/bin/mkswap {device}').exit_code == 0 and run_command(f'/usr/bin/swapon --priority 100 {device}').exit_code == 0:
+			archinstall.log(f'Using {size / 1024 ** 3:.1f} GiB of zram swap on {device}', level=logging.INFO)
+		else:
+			archinstall.log('Could not set up zram swap', level=logging.INFO, fg='yellow')
+	except archinstall.SysCallError as err:
+		archinstall.log(f'Could not set up zram swap: {err}', level=logging.INFO, fg='yellow')
+
+	try:
+		yield
+	finally:
+		if device:
+			try:
+				run_command(f'/usr/bin/swapoff {device}')
+				run_command(f'/usr/bin/zramctl --reset {device}')
+			except archinstall.SysCallError as err:
+				archinstall.log(f'Could not remove the zram swap on {device}: {err}', level=logging.DEBUG)
+
+def load_fleet(path: str):
+	with open(path, 'r') as fleet_file:
+		fleet = json.load(fleet_file)
+	if type(fleet) is list:
+		fleet = {'targets': fleet}
+	return fleet
+
+def print_fleet_progress(targets, started: float):
+	lines = [f"{'hostname':<20} {'device':<14} {'profile':<24} {'status':<8} {'elapsed':>8}  step"]
+	for target in targets:
+		step = ''
+		if os.path.isfile(target['progress']):
+			try:
+				with open(target['progress'], 'r') as progress:
+					step = json.load(progress)['step']
+			except (OSError, ValueError):
+				pass
+		elapsed = (target.get('finished', None) or time.time()) - started
+		lines.append(f"{target['hostname']:<20.20} {target['device']:<14.14} {os.path.basename(target['profile']):<24.24} {target['status']:<8} {elapsed:>7.0f}s  {step}")
+	if sys.stdout.isatty():
+		print('\033[H\033[J', end='')
+	print('\n'.join(lines), flush=True)
+
+def run_fleet(path: str):
+	"""
+	Installs many targets concurrently, each as its own install.py process.
+	The targets share the package cache (warmed once per profile up front), the AUR build cache,
+	and caps on the number of concurrent downloads and builds.
+	"""
+	fleet = load_fleet(path)
+	log_path = archinstall.storage.get('LOG_PATH', '/var/log/archinstall')
+	slots = fleet.get('slots', '/run/archinstall/fleet')
+	os.makedirs(f'{log_path}/fleet', exist_ok=True)
+	os.makedirs(slots, exist_ok=True)
+
+	shared = [
+		f'--fleet-slots={slots}',
+		f"--fleet-max-downloads={fleet.get('max-downloads', 2)}",
+		f"--fleet-max-builds={fleet.get('max-builds', max(1, (os.cpu_count() or 1) // 4))}",
+		f"--aur-build-workers={fleet.get('aur-build-workers', 1)}"
+	]
+	for option in ('package-cache', 'aur-cache', 'image-cache'):
+		if option in fleet:
+			shared.append(f'--{option}={fleet[option]}')
+
+	started = time.time()
+	# One shared download stage: every distinct profile is prefetched once, one after another, into the shared cache.
+	for profile_path in dict.fromkeys(target['profile'] for target in fleet['targets']):
+		archinstall.log(f'Prefetching packages for {profile_path}', level=logging.INFO)
+		with open(f'{log_path}/fleet/prefetch-{os.path.basename(profile_path)}.log', 'w') as log:
+			prefetch_run = subprocess.run([sys.executable, sys.argv[0], f'--config={profile_path}', '--silent', '--prefetch-only', *shared],
+				stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+		if prefetch_run.returncode != 0:
+			archinstall.log(f'Could not prefetch packages for {profile_path} ({prefetch_run.returncode}), its targets download them on their own. See {log.name}', level=logging.INFO, fg='yellow')
+
+	targets = []
+	for target in fleet['targets']:
+		hostname = target['hostname']
+		target = {**target, 'status': 'running', 'progress': f'{slots}/{hostname}.progress'}
+		command = [
+			sys.executable, sys.argv[0], f"--config={target['profile']}", f"--harddrive={target['device']}",
+			f'--hostname={hostname}', f'--mount-point=/mnt/fleet/{hostname}', f"--progress-file={target['progress']}",
+			'--silent', '--no-prefetch', *shared, *target.get('arguments', [])
+		]
+		with open(f'{log_path}/fleet/{hostname}.log', 'w') as log:
+			target['process'] = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+		targets.append(target)
+
+	while any(target['status'] == 'running' for target in targets):
+		for target in targets:
+			if target['status'] == 'running' and (exit_code := target['process'].poll()) is not None:
+				target['status'] = 'done' if exit_code == 0 else 'failed'
+				target['exit_code'] = exit_code
+				target['finished'] = time.time()
+		print_fleet_progress(targets, started)
+		time.sleep(2)
+
+	report = {
+		'wall_time': time.time() - started,
+		'targets': [{**{field: target.get(field, None) for field in ('hostname', 'device', 'profile', 'status', 'exit_code')}, 'duration': target['finished'] - started} for target in targets]
+	}
+	report['sum_of_durations'] = sum(target['duration'] for target in report['targets'])
+	with open(f'{log_path}/fleet/report.json', 'w') as report_file:
+		json.dump(report, report_file, indent=4)
+
+	failed = [target['hostname'] for target in targets if target['status'] != 'done']
+	archinstall.log(f"Fleet finished in {report['wall_time']:.0f}s ({report['sum_of_durations']:.0f}s of installs), {len(targets) - len(failed)} of {len(targets)} targets installed", level=logging.INFO, fg='red' if failed else 'green')
+	if failed:
+		archinstall.log(f"Failed targets (see {log_path}/fleet/<hostname>.log): {', '.join(failed)}", level=logging.INFO, fg='red')
+	return not failed
+
+journal = {}
+
+def journal_path(target: str):
+	return f'{target}/var/lib/archinstall/journal.json'
+
+def journal_steps(target: str):
+	"""
+	Returns the steps recorded in the journal on the target, if there is one.
+	"""
+	if not os.path.isfile(journal_path(target)):
+		return {}
+	with open(journal_path(target), 'r') as journal_file:
+		return json.load(journal_file)['steps']
 
-			if archinstall.arguments.get('profile', None):
-				installation.install_profile(archinstall.arguments.get('profile', None))
+def load_journal(installation: Installer, resume: bool):
+	"""
+	Starts the step journal of the installation, keeping the steps an earlier run recorded on the target.
+	Only when resuming do the recorded steps count towards what still has to run.
+	"""
+	journal.clear()
+	journal.update({'steps': journal_steps(installation.target), 'resume': resume, 'resumed_at': None})
+	if not resume:
+		return
+
+	if not os.path.isfile(journal_path(installation.target)):
+		archinstall.log(f'There is no installation to resume on {installation.target} (no {journal_path(installation.target)})', level=logging.INFO, fg='red')
+		exit(1)
+	archinstall.log(f"Resuming the installation on {installation.target}, {len(journal['steps'])} steps were recorded", level=logging.INFO)
+	reset_fstab(installation)
+
+def reset_fstab(installation: Installer):
+	"""
+	The Installer appends the generated entries to the fstab when it's done, so the ones from an earlier run go.
+	The tmpfs for /tmp that minimal_installation() added isn't generated again, so it stays.
+	"""
+	if os.path.isfile(fstab := f'{installation.target}/etc/fstab'):
+		with open(fstab, 'r') as fstab_file:
+			kept = [line for line in fstab_file if not line.strip() or line.lstrip().startswith('#') or line.split()[:2] == ['tmpfs', '/tmp']]
+		with open(fstab, 'w') as fstab_file:
+			fstab_file.writelines(kept)
 
-			for user, user_info in archinstall.arguments.get('users', {}).items():
-				installation.user_create(user, user_info["!password"], sudo=False)
+def edit_applied(target: str, path: str, before: str):
+	"""
+	Tells whether one of the configuration_edits was made: the file is there and the text it replaces is gone.
+	"""
+	if not os.path.isfile(f'{target}{path}'):
+		return False
+	with open(f'{target}{path}', 'r') as file:
+		return before not in file.read()
 
-			for superuser, user_info in archinstall.arguments.get('superusers', {}).items():
-				installation.user_create(superuser, user_info["!password"], sudo=False)
-				with open(f'{installation.target}/etc/sudoers', 'a') as sudoers:
-					sudoers.write(f'{superuser} ALL=(ALL) NOPASSWD: ALL\n')
-				installation.helper_flags['user'] = True
+def service_enabled(target: str, service: str):
+	return bool(glob.glob(f"{target}/etc/systemd/system/*.wants/{service if '.' in service else service + '.service'}"))
 
-			if timezone := archinstall.arguments.get('timezone', None):
-				installation.set_timezone(timezone)
+def step_verified(installation: Installer, entry):
+	"""
+	Checks that what a recorded step left behind is really there.
+	"""
+	if not all(os.path.lexists(f'{installation.target}{path}') for path in entry.get('files', [])):
+		return False
+	if (packages := entry.get('packages', [])) and not set(packages) <= installed_names(installation):
+		return False
+	if not set(entry.get('users', [])) <= existing_users(installation.target):
+		return False
+	if not all(service_enabled(installation.target, service) for service in entry.get('services', [])):
+		return False
+	if not all(edit_applied(installation.target, path, before) for path, before in entry.get('edits', [])):
+		return False
+	return True
+
+def step_pending(installation: Installer, step: str, independent: bool = False):
+	"""
+	Tells whether a step still has to run. When resuming, a recorded step only counts as done if it
+	checks out, and from the first step that doesn't on, every later step runs again.
+	Independent steps (the AUR package bases) are checked on their own.
+	"""
+	if not journal.get('resume', False):
+		return True
 
-			if archinstall.arguments.get('ntp', False):
-				installation.activate_ntp()
+	if step not in journal['steps'] or (journal['resumed_at'] and not independent):
+		pending = True
+	else:
+		pending = not step_verified(installation, journal['steps'][step])
 
-			if (root_pw := archinstall.arguments.get('!root-password', None)) and len(root_pw):
-				installation.user_set_pw('root', root_pw)
+	if pending and not independent and not journal['resumed_at']:
+		journal['resumed_at'] = step
+		archinstall.log(f'Resuming from step: {step}', level=logging.INFO, fg='yellow')
+	elif not pending:
+		archinstall.log(f'Skipping step, already done: {step}', level=logging.INFO)
+	return pending
 
-			# This step must be after profile installs to allow profiles to install language pre-requisits.
-			# After which, this step will set the language both for console and x11 if x11 was installed for instance.
-			installation.set_keyboard_language(archinstall.arguments['keyboard-language'])
+def step_done(installation: Installer, step: str, **checks):
+	"""
+	Records a completed step in the journal on the target, together with what step_verified() can check (files, packages, users, services, edits).
+	"""
+	journal.setdefault('steps', {})[step] = {'time': time.time(), **checks}
+	os.makedirs(os.path.dirname(path := journal_path(installation.target)), exist_ok=True)
+	with open(f'{path}.tmp', 'w') as journal_file:
+		json.dump({'version': 1, 'steps': journal['steps']}, journal_file, indent=4)
+	os.replace(f'{path}.tmp', path)
+
+def minimal_installation(installation: Installer):
+	if not step_pending(installation, 'minimal-installation'):
+		installation.helper_flags['base'] = True
+		return True
+	if installed := installation.minimal_installation():
+		step_done(installation, 'minimal-installation', files=['/usr/bin/pacman', '/etc/pacman.conf'])
+	return installed
+
+def mount_existing_target():
+	"""
+	Mounts the partitions of an earlier, unfinished installation without formatting them.
+	The boot partition is the vfat one, the root partition is the other one.
+	"""
+	mountpoint = archinstall.storage.get('MOUNT_POINT', '/mnt')
+	partitions = list(archinstall.arguments['harddrive'])
+	boot = next((partition for partition in partitions if partition.filesystem == 'vfat'), None)
+	if not (root := next((partition for partition in partitions if partition is not boot), None)):
+		archinstall.log(f"Could not find the root partition of {archinstall.arguments['harddrive']} to resume on", level=logging.INFO, fg='red')
+		exit(1)
+
+	if archinstall.arguments.get('!encryption-password', None):
+		with archinstall.luks2(root, luks_mapper_name(), archinstall.arguments.get('!encryption-password', None)) as unlocked_device:
+			unlocked_device.mount(mountpoint)
+	else:
+		root.mount(mountpoint)
+	if boot:
+		boot.mount(f'{mountpoint}/boot')
 
-			if archinstall.arguments['profile'] and archinstall.arguments['profile'].has_post_install():
-				with archinstall.arguments['profile'].load_instructions(namespace=f"{archinstall.arguments['profile'].namespace}.py") as imported:
-					if not imported._post_install():
-						archinstall.log(' * Profile\'s post configuration requirements was not fulfilled.', fg='red')
-						exit(1)
+def configuration_task(name: str, function, *args, after=(), locks=(), step: str = None, **kwargs):
+	"""
+	Declares a configuration task for run_tasks(): what it runs, the tasks it comes after,
+	the locks it holds while running (the files it writes, or `pacman` for the pacman database),
+	and the journal step it is a part of.
+	"""
+	return {'name': name, 'run': functools.partial(function, *args, **kwargs), 'after': list(after), 'locks': list(locks), 'step': step}
 
-		# If the user provided a list of services to be enabled, pass the list to the enable_service function.
-		# Note that while it's called enable_service, it can actually take a list of services and iterate it.
-		if archinstall.arguments.get('services', None):
-			installation.enable_service(*archinstall.arguments['services'])
+def run_tasks(installation: Installer, tasks, steps):
+	"""
+	Runs configuration tasks, each as soon as the tasks it comes after are done, several at a time.
+	Tasks that share a lock never run at the same time. A journal step from `steps` (with the checks
+	to record for it) is recorded as done once all of its tasks are.
+	"""
+	names = {task['name'] for task in tasks}
+	pending = list(tasks)
+	running = {}
+	held = set()
+	timings = {}
+	for step, checks in steps.items():
+		if not any(task['step'] == step for task in tasks):
+			step_done(installation, step, **checks)
+
+	def timed(task):
+		started = time.perf_counter()
+		with trace_step(task['name'], category='task'):
+			task['run']()
+		return time.perf_counter() - started
+
+	started = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=int(archinstall.arguments.get('configuration-workers', 4))) as pool:
+		while pending or running:
+			for task in list(pending):
+				if set(task['after']) & names <= set(timings) and not held & set(task['locks']):
+					pending.remove(task)
+					held.update(task['locks'])
+					running[pool.submit(timed, task)] = task
+			if not running:
+				raise archinstall.RequirementError(f"Configuration tasks can't run, they come after each other in a circle: {', '.join(task['name'] for task in pending)}")
+
+			finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in finished:
+				task = running.pop(future)
+				held.difference_update(task['locks'])
+				timings[task['name']] = future.result()
+				if task['step'] in steps and all(other['name'] in timings for other in tasks if other['step'] == task['step']):
+					step_done(installation, task['step'], **steps[task['step']])
+
+	for name, duration in timings.items():
+		archinstall.log(f'Configuration task {name} took {duration:.2f}s', level=logging.DEBUG)
+	if timings:
+		archinstall.log(f'Ran {len(timings)} configuration tasks in {time.perf_counter() - started:.1f}s ({sum(timings.values()):.1f}s one after another)', level=logging.INFO)
+
+def sudoer_line(superuser: str):
+	return f'{superuser} ALL=(ALL) NOPASSWD: ALL\n'
+
+def is_sudoer(target: str, superuser: str):
+	with open(f'{target}/etc/sudoers', 'r') as sudoers:
+		return sudoer_line(superuser) in sudoers.read()
+
+def add_sudoer(installation: Installer, superuser: str):
+	if is_sudoer(installation.target, superuser):
+		return
+	with open(f'{installation.target}/etc/sudoers', 'a') as sudoers:
+		sudoers.write(sudoer_line(superuser))
+
+def remove_sudoer(installation: Installer, superuser: str):
+	with open(f'{installation.target}/etc/sudoers', 'r') as sudoers:
+		lines = sudoers.readlines()
+	if sudoer_line(superuser) in lines:
+		with open(f'{installation.target}/etc/sudoers', 'w') as sudoers:
+			sudoers.writelines(line for line in lines if line != sudoer_line(superuser))
+
+def existing_users(target: str):
+	with open(f'{target}/etc/passwd', 'r') as passwd:
+		return {line.split(':', 1)[0] for line in passwd}
+
+def configured_users():
+	return {**archinstall.arguments.get('users', {}), **archinstall.arguments.get('superusers', {})}
+
+def create_host_users(installation: Installer):
+	"""
+	Creates the users of this host, allows the superusers in the sudoers and sets the root password.
+	This runs after the golden image was captured or restored, so none of it ends up in the image.
+	useradd and chpasswd lock /etc/passwd, so they take turns.
+	"""
+	steps = {}
+	tasks = []
+	if step_pending(installation, 'users'):
+		steps['users'] = {'users': list(archinstall.arguments.get('users', {})) + list(archinstall.arguments.get('superusers', {}))}
+		for user, user_info in archinstall.arguments.get('users', {}).items():
+			tasks.append(configuration_task(f'user {user}', installation.user_create, user, user_info["!password"], sudo=False, locks=['/etc/passwd'], step='users'))
+		for superuser, user_info in archinstall.arguments.get('superusers', {}).items():
+			tasks.append(configuration_task(f'user {superuser}', installation.user_create, superuser, user_info["!password"], sudo=False, locks=['/etc/passwd'], step='users'))
+			tasks.append(configuration_task(f'sudoers {superuser}', add_sudoer, installation, superuser, after=[f'user {superuser}'], locks=['/etc/sudoers'], step='users'))
+
+		if (root_pw := archinstall.arguments.get('!root-password', None)) and len(root_pw):
+			tasks.append(configuration_task('root password', installation.user_set_pw, 'root', root_pw, locks=['/etc/passwd'], step='users'))
+	run_tasks(installation, tasks, steps)
+
+	if superusers := list(archinstall.arguments.get('superusers', {})):
+		installation.helper_flags['user'] = True
+		if (helper := archinstall.arguments.get('aur-helper', None)) and os.path.isfile(f'{installation.target}/usr/bin/{helper}'):
+			save_aur_helper_settings(installation, superusers[0])
+
+def profile_post_install():
+	with archinstall.arguments['profile'].load_instructions(namespace=f"{archinstall.arguments['profile'].namespace}.py") as imported:
+		if not imported._post_install():
+			archinstall.log(' * Profile\'s post configuration requirements was not fulfilled.', fg='red')
+			exit(1)
 
-		# Display warning message when no AUR helper specified.
-		if archinstall.arguments.get('aur-packages', None) and not archinstall.arguments.get('aur-helper', None):
-			archinstall.log(f"No AUR helper specified. No AUR packages will be installed. Add 'aur-helper' to the config")
+@traced
+def perform_installation(mountpoint):
+	"""
+	Performs the installation steps on a block device.
+	Only requirement is that the block devices are
+	formatted and setup prior to entering this function.
+	"""
+	# The prefetched packages have to be complete before the package cache is handed to pacstrap.
+	finish_prefetch()
+
+	with archinstall.Installer(mountpoint, kernels=archinstall.arguments.get('kernels', 'linux')) as installation, package_cache(installation), production_mounts(installation):
+		trace_installer(installation)
+		# A lockfile installs the package files it pins, the sync databases are only refreshed for what it doesn't pin.
+		if lockfile:
+			pacstrap_from_lockfile(installation)
+		else:
+			pacstrap_from_shared_databases(installation)
+		# Everything the Installer downloads goes through pacstrap, which is what the fleet's download cap applies to.
+		installation.pacstrap = fleet_slot('download')(installation.pacstrap)
+		# if len(mirrors):
+		# Certain services might be running that affects the system during installation.
+		# Currently, only one such service is "reflector.service" which updates /etc/pacman.d/mirrorlist
+		# We need to wait for it before we continue since we opted in to use a custom mirror/region.
+		wait_for_reflector()
+		# Set mirrors used by pacstrap (outside of installation)
+		if archinstall.arguments.get('mirror-region', None):
+			archinstall.use_mirrors(archinstall.arguments['mirror-region'])  # Set the mirrors for the live medium
+		plan = prefetch.get('plan') or plan_transactions()
+		resume = archinstall.arguments.get('resume', False)
+		load_journal(installation, resume)
+		image = golden_image(plan) if archinstall.arguments.get('image-cache', False) and not resume else None
+		if restored := image is not None and os.path.isfile(image) and restore_golden_image(installation, image):
+			apply_host_settings(installation)
+		elif minimal_installation(installation):
+			# The locale settings and the edits of pacman.conf and makepkg.conf write different files, so they run side by side.
+			steps = {}
+			tasks = []
+			if step_pending(installation, 'locale'):
+				steps['locale'] = {'files': ['/etc/locale.conf', '/etc/hostname']}
+				tasks.append(configuration_task('locale', installation.set_locale, archinstall.arguments['sys-language'], archinstall.arguments['sys-encoding'].upper(), locks=['/etc/locale.gen'], step='locale'))
+				tasks.append(configuration_task('hostname', installation.set_hostname, archinstall.arguments['hostname'], locks=['/etc/hostname'], step='locale'))
+				if archinstall.arguments['mirror-region'].get("mirrors", None) is not None:
+					# Set the mirrors in the installation medium
+					tasks.append(configuration_task('mirrorlist', installation.set_mirrors, archinstall.arguments['mirror-region'], locks=['/etc/pacman.d/mirrorlist'], step='locale'))
+
+			if step_pending(installation, 'pacman-conf'):
+				steps['pacman-conf'] = {'edits': [(path, before) for path, before, after in configuration_edits]}
+				for path, before, after in configuration_edits:
+					tasks.append(configuration_task(f'{path}: {after.splitlines()[0]}', replace_in_file, installation, path, before, after, locks=[path], step='pacman-conf'))
+			run_tasks(installation, tasks, steps)
+
+			# Everything from the repositories goes in as one transaction, with the expensive hooks deferred to the very end.
+			defer_expensive_hooks(installation)
+			system = next(transaction for transaction in plan if transaction['name'] == 'system')
+			if step_pending(installation, 'packages'):
+				if system['packages'] and not installation.add_additional_packages(list(system['packages'])):
+					archinstall.log('Could not install the packages from the repositories, see the log above for the package at fault', fg='red')
+					exit(1)
+				step_done(installation, 'packages', packages=list(system['packages']))
+			# What's in the target's pacman database, rather than what was planned, is what later requests can skip.
+			dedupe_package_requests(installation, installed_names(installation))
+
+			if step_pending(installation, 'bootloader'):
+				installation.add_bootloader(archinstall.arguments["bootloader"])
+				step_done(installation, 'bootloader', files=['/boot/grub/grub.cfg' if archinstall.arguments["bootloader"] == 'grub-install' else '/boot/loader/loader.conf'])
+			else:
+				installation.helper_flags['bootloader'] = archinstall.arguments["bootloader"]
+
+			if step_pending(installation, 'network'):
+				services = []
+				# If user selected to copy the current ISO network configuration
+				# Perform a copy of the config
+				if archinstall.arguments.get('nic', {}) == 'Copy ISO network configuration to installation':
+					installation.copy_iso_network_config(enable_services=True)  # Sources the ISO network configuration to the install medium.
+				elif archinstall.arguments.get('nic', {}).get('NetworkManager', False):
+					installation.enable_service('NetworkManager.service')
+					services = ['NetworkManager.service']
+				# Otherwise, if a interface was selected, configure that interface
+				elif archinstall.arguments.get('nic', {}):
+					installation.configure_nic(**archinstall.arguments.get('nic', {}))
+					installation.enable_service('systemd-networkd')
+					installation.enable_service('systemd-resolved')
+					services = ['systemd-networkd', 'systemd-resolved']
+				step_done(installation, 'network', services=services)
+
+			if step_pending(installation, 'audio'):
+				if archinstall.arguments.get('audio', None) is not None:
+					installation.log(f"This audio server will be used: {archinstall.arguments.get('audio', None)}", level=logging.INFO)
+				else:
+					installation.log("No audio server will be installed.", level=logging.INFO)
+				step_done(installation, 'audio', packages=audio_packages.get(archinstall.arguments.get('audio', None), []))
 
-		# If the user provided an AUR helper to be installed, install it now.
-		# In addition, install user-defined AUR packages, if they exist.
-		if archinstall.arguments.get('aur-helper', None):
-			install_aur_helper(archinstall.arguments['aur-helper'], installation)
-			if archinstall.arguments.get('aur-packages', None):
-				install_aur_packages(installation, archinstall.arguments['aur-packages'])
+			if archinstall.arguments.get('profile', None) and step_pending(installation, 'profile'):
+				installation.install_profile(archinstall.arguments.get('profile', None))
+				step_done(installation, 'profile', packages=list(archinstall.arguments['profile'].packages or []))
+
+			# Settings and services don't depend on each other, apart from the files they share:
+			# the services systemctl enables take turns. The users and passwords of this host come
+			# after the golden image is captured, in create_host_users().
+			steps = {}
+			tasks = []
+			if step_pending(installation, 'settings'):
+				steps['settings'] = {'files': ['/etc/localtime'] if archinstall.arguments.get('timezone', None) else []}
+				if timezone := archinstall.arguments.get('timezone', None):
+					tasks.append(configuration_task('timezone', installation.set_timezone, timezone, locks=['/etc/localtime'], step='settings'))
+
+				if archinstall.arguments.get('ntp', False):
+					# activate_ntp() pacstraps ntp (which adds its user) before enabling the service.
+					tasks.append(configuration_task('ntp', installation.activate_ntp, locks=['pacman', '/etc/passwd', 'systemd'], step='settings'))
+
+				# This step must be after profile installs to allow profiles to install language pre-requisits.
+				# After which, this step will set the language both for console and x11 if x11 was installed for instance.
+				# It boots the installation with systemd-nspawn, so it runs on its own: after the other tasks, holding off the services.
+				tasks.append(configuration_task('keyboard language', installation.set_keyboard_language, archinstall.arguments['keyboard-language'], after=[task['name'] for task in tasks], locks=['/etc/vconsole.conf', 'systemd'], step='settings'))
+
+			if archinstall.arguments['profile'] and archinstall.arguments['profile'].has_post_install() and step_pending(installation, 'profile-post-install'):
+				steps['profile-post-install'] = {}
+				tasks.append(configuration_task('profile post-install', profile_post_install, after=[task['name'] for task in tasks], locks=['pacman'], step='profile-post-install'))
+
+			# If the user provided a list of services to be enabled, pass the list to the enable_service function.
+			# Note that while it's called enable_service, it can actually take a list of services and iterate it.
+			if archinstall.arguments.get('services', None) and step_pending(installation, 'services'):
+				steps['services'] = {'services': archinstall.arguments['services']}
+				tasks.append(configuration_task('services', installation.enable_service, *archinstall.arguments['services'], locks=['systemd'], step='services'))
+			run_tasks(installation, tasks, steps)
+
+		if not restored:
+			# Display warning message when no AUR helper specified.
+			if archinstall.arguments.get('aur-packages', None) and not archinstall.arguments.get('aur-helper', None):
+				archinstall.log(f"No AUR helper specified. No AUR packages will be installed. Add 'aur-helper' to the config")
+
+			# If the user provided an AUR helper to be installed, install it now.
+			# In addition, install user-defined AUR packages, if they exist.
+			# They are built by a throwaway user, as the users of this host don't exist yet.
+			if archinstall.arguments.get('aur-helper', None):
+				with build_user(installation) as user, build_environment(installation, user) as environment:
+					if step_pending(installation, 'aur-helper') and install_aur_helper(archinstall.arguments['aur-helper'], installation, user, environment):
+						step_done(installation, 'aur-helper', files=[f"/usr/bin/{archinstall.arguments['aur-helper']}"])
+					if archinstall.arguments.get('aur-packages', None):
+						aur = next(transaction for transaction in plan if transaction['name'] == 'aur')
+						install_aur_packages(installation, archinstall.arguments['aur-packages'], user=user, resolution=aur['resolution'], environment=environment)
+
+		# The initramfs of a restored image was generated on the host that captured it, so it is generated again either way.
+		run_deferred_hooks(installation)
+
+		# Everything up to here is the same for every host installed from this configuration.
+		if image and not restored:
+			capture_golden_image(installation, image)
+		create_host_users(installation)
 
 		# If the user provided custom commands to be run post-installation, execute them now.
-		if archinstall.arguments.get('custom-commands', None):
-			run_custom_user_commands(archinstall.arguments['custom-commands'], installation)
+		if archinstall.arguments.get('custom-commands', None) and step_pending(installation, 'custom-commands'):
+			with trace_step('run_custom_user_commands'):
+				run_custom_user_commands(archinstall.arguments['custom-commands'], installation)
+			step_done(installation, 'custom-commands')
 
 		installation.log("For post-installation tips, see https://wiki.archlinux.org/index.php/Installation_guide#Post-installation", fg="yellow")
-		if not archinstall.arguments.get('silent'):
+		if interactive():
 			choice = input("Would you like to chroot into the newly created installation and perform post-installation configuration? [Y/n] ")
 			if choice.lower() in ("y", ""):
 				try:
@@ -482,11 +1273,92 @@ def perform_installation(mountpoint):
 	# For support reasons, we'll log the disk layout post installation (crash or no crash)
 	archinstall.log(f"Disk states after installing: {archinstall.disk_layouts()}", level=logging.DEBUG)
 
-def enable_multilib(installation: Installer):
-	replace_in_file(installation, '/etc/pacman.conf', '#[multilib]\n#Include = /etc/pacman.d/mirrorlist', '[multilib]\nInclude = /etc/pacman.d/mirrorlist')
-
-def set_makeflags(installation: Installer, makeflags='-j$(nproc)'):
-	replace_in_file(installation, '/etc/makepkg.conf', '#MAKEFLAGS="-j2"', f'MAKEFLAGS="{makeflags}"')
+def golden_image(plan):
+	"""
+	Returns the path of the golden image for the resolved configuration, or None without an image cache. The key covers
+	everything that ends up in the image; per-host settings (hostname, users, passwords, disk layout) are left out.
+	Images of configurations that aren't pinned by a lockfile expire after the image cache TTL.
+	"""
+	if (cache := host_cache('image-cache')) is None:
+		return None
+	if lockfile:
+		resolved = {'repo': [(package['name'], package['version']) for package in lockfile['repo']], 'aur': aur_pins()}
+	else:
+		resolved = {'repo': sorted(planned_packages(plan)), 'aur': sorted(archinstall.arguments.get('aur-packages', None) or [])}
+
+	for setting in ('kernels', 'bootloader', 'audio', 'nic', 'sys-language', 'sys-encoding', 'keyboard-language', 'timezone', 'ntp', 'services', 'aur-helper', 'filesystem'):
+		resolved[setting] = archinstall.arguments.get(setting, None)
+	# The root filesystem and its encryption end up in the mkinitcpio hooks and modules (and btrfs in the packages), just not the password.
+	resolved['encryption'] = bool(archinstall.arguments.get('!encryption-password', None))
+	resolved['profile'] = str(archinstall.arguments.get('profile', None))
+
+	key = hashlib.sha256(json.dumps(resolved, sort_keys=True, cls=archinstall.JSON).encode()).hexdigest()
+	path = f'{cache}/{key}.tar.zst'
+	if not lockfile and os.path.isfile(path) and time.time() - os.path.getmtime(path) > int(archinstall.arguments.get('image-cache-ttl', image_cache_ttl)):
+		archinstall.log(f'Golden image {key[:12]} has expired', level=logging.INFO)
+		os.remove(path)
+	return path
+
+golden_image_excludes = [
+	'./etc/hostname', './etc/machine-id', './boot/loader/entries/*',
+	'./var/cache/pacman/pkg/*', './var/log/archinstall', './var/lib/archinstall', './var/tmp/*',
+	'./proc/*', './sys/*', './dev/*', './run/*', './tmp/*'
+]
+
+@traced
+def capture_golden_image(installation: Installer, path: str):
+	"""
+	Archives the installation as a zstd compressed tarball, leaving out per-host files.
+	It is captured before the users of the host are created, and the AUR build user is gone by then.
+	"""
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	excludes = ' '.join(f"--exclude='{exclude}'" for exclude in golden_image_excludes)
+	started = time.time()
+	try:
+		run_command(f"/usr/bin/tar -I 'zstd -T0 -3' --xattrs --acls --numeric-owner {excludes} -cpf {path}.part -C {installation.target} .", peak_output=False)
+	except archinstall.SysCallError as err:
+		archinstall.log(f'Could not capture golden image: {err}', level=logging.INFO, fg='yellow')
+		if os.path.isfile(f'{path}.part'):
+			os.remove(f'{path}.part')
+		return
+	os.replace(f'{path}.part', path)
+	archinstall.log(f'Captured golden image {os.path.basename(path)} ({os.path.getsize(path) / 1024 ** 2:.0f} MiB) in {time.time() - started:.0f}s', level=logging.INFO)
+
+@traced
+def restore_golden_image(installation: Installer, path: str):
+	"""
+	Extracts a golden image onto the target in one streaming pass.
+	"""
+	archinstall.log(f'Restoring golden image {os.path.basename(path)}', level=logging.INFO)
+	try:
+		run_command(f"/usr/bin/tar -I 'zstd -d -T0' --xattrs --acls --numeric-owner -xpf {path} -C {installation.target}", peak_output=False)
+	except archinstall.SysCallError as err:
+		archinstall.log(f'Could not restore golden image, installing from scratch: {err}', level=logging.INFO, fg='yellow')
+		return False
+	installation.helper_flags['base'] = True
+	return True
+
+@traced
+def apply_host_settings(installation: Installer):
+	"""
+	Applies the steps that differ from host to host on top of a restored golden image.
+	The users come afterwards, from create_host_users(), the same as on a fresh install.
+	"""
+	installation.set_hostname(archinstall.arguments['hostname'])
+	installation.add_bootloader(archinstall.arguments["bootloader"])
+	# The image's fstab has the tmpfs for /tmp, the Installer adds the entries of this host's partitions when it's done.
+	reset_fstab(installation)
+
+configuration_edits = [
+	# Enabling multilib repository
+	('/etc/pacman.conf', '#[multilib]\n#Include = /etc/pacman.d/mirrorlist', '[multilib]\nInclude = /etc/pacman.d/mirrorlist'),
+	# Enabling pacman color
+	('/etc/pacman.conf', '#Color', 'Color'),
+	# Enabling pacman parallel downloads
+	('/etc/pacman.conf', '#ParallelDownloads = 5', 'ParallelDownloads = 5'),
+	# Increasing makeflags in makepkg.conf
+	('/etc/makepkg.conf', '#MAKEFLAGS="-j2"', 'MAKEFLAGS="-j$(nproc)"')
+]
 
 def replace_in_file(installation: Installer, path: str, before: str, after: str):
 	with open(f'{installation.target}{path}', 'r') as file:
@@ -497,72 +1369,2081 @@ def replace_in_file(installation: Installer, path: str, before: str, after: str)
 	with open(f'{installation.target}{path}', 'w') as file:
 		file.write(filedata)
 
-def install_aur_helper(helper_name: str, installation: Installer):
+def network_services():
+	"""
+	Returns the services the network configuration enables.
+	"""
+	if type(nic := archinstall.arguments.get('nic', {})) is not dict or not nic:
+		return []
+	if nic.get('NetworkManager', False):
+		return ['NetworkManager.service']
+	return ['systemd-networkd', 'systemd-resolved']
+
+def reconcile_delta(target: str, plan):
+	"""
+	Compares an existing installation with the configuration. Returns what the installation is
+	missing (repository packages, new or outdated AUR packages, services, users and configuration edits)
+	and the explicitly installed packages that an earlier configuration asked for and this one doesn't.
+	"""
+	installed = {description['NAME']: description for description in local_packages(target)}
+	names = set(installed)
+	for description in installed.values():
+		names.update(strip_version(provided) for provided in description.get('PROVIDES', []))
+		names.update(description.get('GROUPS', []))
+
+	# The repository dependencies of the AUR packages are installed along with them, below.
+	delta = {'packages': [package for transaction in plan if transaction['name'] in ('base', 'system') for package in transaction['packages'] if package not in names]}
+
+	aur = next(transaction for transaction in plan if transaction['name'] == 'aur')
+	if (helper := archinstall.arguments.get('aur-helper', None)) and aur['packages'] and not aur['resolution']:
+		archinstall.log('Could not resolve the AUR packages, they are left as they are', level=logging.INFO, fg='yellow')
+	resolved, repo_dependencies = aur['resolution'] or ({}, set())
+	# A package base is built again when any of its packages is missing or older than in the AUR.
+	stale = {info['PackageBase'] for name, info in resolved.items() if name not in installed or vercmp(installed[name]['VERSION'], info['Version']) < 0}
+	delta['aur'] = ({name: info for name, info in resolved.items() if info['PackageBase'] in stale}, {dependency for dependency in repo_dependencies if dependency not in names})
+	delta['aur-helper'] = bool(helper) and not os.path.isfile(f'{target}/usr/bin/{helper}')
+
+	delta['services'] = [service for service in (archinstall.arguments.get('services', None) or []) + network_services() if not service_enabled(target, service)]
+
+	users = existing_users(target)
+	delta['users'] = [user for user in configured_users() if user not in users]
+	delta['sudoers'] = [superuser for superuser in archinstall.arguments.get('superusers', {}) if not is_sudoer(target, superuser)]
+
+	delta['configuration'] = [(path, before, after) for path, before, after in configuration_edits if os.path.isfile(f'{target}{path}') and not edit_applied(target, path, before)]
+
+	# Only what an earlier configuration asked for (according to the journal) counts as an extra. The packages the
+	# Installer adds on its own (microcode, efibootmgr, btrfs-progs), those of nested profiles and the ones installed
+	# by hand were never asked for by name, so they are left alone.
+	wanted = set(planned_packages(plan)) | set(resolved) | set(archinstall.arguments.get('aur-packages', None) or []) | {helper}
+	asked = {package for step in journal_steps(target).values() for package in step.get('packages', [])}
+
+	def aliases(description):
+		return {description['NAME']} | set(description.get('GROUPS', [])) | {strip_version(provided) for provided in description.get('PROVIDES', [])}
+
+	extras = sorted(
+		name for name, description in installed.items()
+		if description.get('REASON', '0') != '1' and not wanted & aliases(description) and asked & aliases(description)
+	)
+	repository = set()
+	if extras:
+		for sync_db in sorted(glob.glob(f'{target}/var/lib/pacman/sync/*.db')) or sync_db_files():
+			repository.update(description['NAME'] for description in read_sync_db(sync_db))
+	delta['extras'] = {name: 'repo' if name in repository else 'foreign' for name in extras}
+	return delta
+
+def print_delta(delta):
+	print('Changes to the installation:')
+	for path, before, after in delta['configuration']:
+		print(f"  edit    {path}: {after.splitlines()[0]}")
+	for package in delta['packages']:
+		print(f'  install {package}')
+	for name, info in sorted(delta['aur'][0].items()):
+		print(f"  build   {name} {info['Version']} (AUR)")
+	for user in delta['users']:
+		print(f'  add     user {user}')
+	for superuser in delta['sudoers']:
+		print(f'  allow   {superuser} in /etc/sudoers')
+	for service in delta['services']:
+		print(f'  enable  {service}')
+	for name, origin in delta['extras'].items():
+		print(f"  {'remove' if archinstall.arguments.get('reconcile-remove', False) else 'extra '}  {name} ({origin})")
+
+@traced
+def reconcile_installation():
+	"""
+	Brings an existing installation in line with the configuration by applying only what differs:
+	the missing repository packages go in as one transaction, only new or outdated AUR packages
+	are built, and with --reconcile-remove, explicit packages the configuration doesn't ask for are removed.
+	"""
+	started = time.time()
+	if archinstall.arguments.get('harddrive', None):
+		with trace_step('mounting'):
+			mount_existing_target()
+	mountpoint = archinstall.storage.get('MOUNT_POINT', '/mnt')
+	if not os.path.isdir(f'{mountpoint}/var/lib/pacman/local'):
+		archinstall.log(f'There is no installation to reconcile on {mountpoint}', level=logging.INFO, fg='red')
+		exit(1)
+
+	plan = plan_transactions()
+	delta = reconcile_delta(mountpoint, plan)
+	changes = [change for key, change in delta.items() if key not in ('aur', 'extras')] + [delta['aur'][0]]
+	if archinstall.arguments.get('reconcile-remove', False):
+		changes.append(delta['extras'])
+	if not any(changes):
+		archinstall.log(f'The installation on {mountpoint} already matches the configuration', level=logging.INFO, fg='green')
+		return
+	print_delta(delta)
+	if archinstall.arguments.get('plan', False):
+		return
+
+	with archinstall.Installer(mountpoint, kernels=archinstall.arguments.get('kernels', 'linux')) as installation, package_cache(installation):
+		trace_installer(installation)
+		pacstrap_from_shared_databases(installation)
+		# Nothing is installed from scratch, the Installer only regenerates the fstab when it's done.
+		installation.helper_flags['base'] = True
+		installation.helper_flags['bootloader'] = archinstall.arguments['bootloader']
+		reset_fstab(installation)
+		load_journal(installation, False)
+		wait_for_reflector()
+		if archinstall.arguments.get('mirror-region', None):
+			archinstall.use_mirrors(archinstall.arguments['mirror-region'])
+
+		for path, before, after in delta['configuration']:
+			replace_in_file(installation, path, before, after)
+
+		system = next(transaction for transaction in plan if transaction['name'] == 'system')
+		if delta['packages']:
+			if not installation.add_additional_packages(delta['packages']):
+				archinstall.log(f"Could not install packages: {' '.join(delta['packages'])}", level=logging.INFO, fg='red')
+				exit(1)
+			step_done(installation, 'packages', packages=list(system['packages']))
+
+		for user in delta['users']:
+			installation.user_create(user, configured_users()[user]["!password"], sudo=False)
+		for superuser in delta['sudoers']:
+			add_sudoer(installation, superuser)
+
+		if delta['services']:
+			installation.enable_service(*delta['services'])
+
+		if archinstall.arguments.get('aur-helper', None) and (delta['aur-helper'] or delta['aur'][0]):
+			with build_user(installation) as user, build_environment(installation, user) as environment:
+				if delta['aur-helper'] and install_aur_helper(archinstall.arguments['aur-helper'], installation, user, environment) and archinstall.arguments.get('superusers', {}):
+					save_aur_helper_settings(installation, list(archinstall.arguments['superusers'])[0])
+				if resolved := delta['aur'][0]:
+					requested = [package for package in archinstall.arguments.get('aur-packages', None) or [] if package in resolved]
+					install_aur_packages(installation, requested or sorted(resolved), user=user, resolution=delta['aur'], environment=environment)
+
+		if archinstall.arguments.get('reconcile-remove', False) and delta['extras']:
+			if (removal := arch_chroot(installation, f"/usr/bin/pacman -Rns --noconfirm {' '.join(delta['extras'])}")).exit_code != 0:
+				archinstall.log(f'Could not remove packages: {removal.exit_code}', level=logging.INFO, fg='red')
+
+	archinstall.log(f'Reconciled the installation on {mountpoint} in {time.time() - started:.0f}s', level=logging.INFO, fg='green')
+
+lockfile = {}
+
+def aur_pins():
+	return {base['base']: base['commit'] for base in lockfile.get('aur', [])}
+
+def load_lockfile(path: str):
+	with open(path, 'r') as lock:
+		lockfile.update(json.load(lock))
+	archinstall.log(f"Installing from lockfile {path} ({len(lockfile['repo'])} repository packages, {len(lockfile['aur'])} AUR package bases)", level=logging.INFO)
+
+@traced
+def lock_profile(path: str):
+	"""
+	Resolves the configuration into a lockfile: the full dependency closure from the
+	repositories with pinned versions, URLs and checksums, and the AUR package bases
+	with the commits their PKGBUILDs are at. Installing from the lockfile skips all resolution.
+	"""
+	config, database = private_pacman_config()
+	if archinstall.arguments.get('mirror-region', None):
+		archinstall.use_mirrors(archinstall.arguments['mirror-region'])
+	refresh_sync_databases()
+
+	plan = plan_transactions()
+	packages = planned_packages(plan)
+	repo = resolve_closure(config, database, packages)
+	describe_packages(repo)
+
+	aur = []
+	resolved, repo_dependencies = next(transaction for transaction in plan if transaction['name'] == 'aur')['resolution'] or ({}, set())
+	if helper := archinstall.arguments.get('aur-helper', None):
+		resolved = {**resolved, **aur_info(helper)}
+	bases = {}
+	for name, info in resolved.items():
+		bases.setdefault(info['PackageBase'], []).append({field: info.get(field, []) if field.endswith('Depends') else info[field] for field in ('Name', 'PackageBase', 'Version', 'Depends', 'MakeDepends', 'CheckDepends')})
+
+	def remote_head(base):
+		return base, run_command(f'/usr/bin/git ls-remote https://aur.archlinux.org/{base}.git HEAD', peak_output=False).decode().split()[0]
+
+	with ThreadPoolExecutor(max_workers=16) as pool:
+		for base, commit in pool.map(remote_head, sorted(bases)):
+			aur.append({'base': base, 'commit': commit, 'packages': bases[base]})
+
+	lock = {
+		'version': 1,
+		'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'packages': packages,
+		'aur-packages': archinstall.arguments.get('aur-packages', None) or [],
+		'aur-repo-dependencies': sorted(repo_dependencies),
+		'repo': sorted(repo, key=lambda package: package['name']),
+		'aur': aur
+	}
+	with open(path, 'w') as lock_file:
+		json.dump(lock, lock_file, indent=4)
+	archinstall.log(f'Wrote lockfile {path} ({len(repo)} repository packages, {len(aur)} AUR package bases)', level=logging.INFO)
+
+def resolve_closure(config: str, database: str, packages):
+	"""
+	Resolves packages into their complete dependency closure from the repositories,
+	with the URL and size of every package file.
+	"""
+	# Our database path has no local packages, so pacman prints the complete closure.
+	closure = run_command(f"/usr/bin/pacman -Sp --noconfirm --config {config} --dbpath {database} --print-format '%r %n %v %s %l' {' '.join(packages)}", peak_output=False)
+
+	repo = []
+	for line in closure.decode().splitlines():
+		if len(fields := line.strip().split(' ')) != 5 or '://' not in fields[4]:
+			continue
+		repo.append({
+			'repo': fields[0],
+			'name': fields[1],
+			'version': fields[2],
+			'url': fields[4],
+			'filename': urllib.parse.unquote(fields[4].rsplit('/', 1)[-1]),
+			'size': int(fields[3]),
+			'sha256': None,
+			'signature': None
+		})
+	return repo
+
+def describe_packages(repo):
+	"""
+	Fills in the checksums and signatures of the given packages from the sync databases.
+	"""
+	if not (packages := {f"{package['name']}-{package['version']}": package for package in repo}):
+		return
+	for sync_db in sync_db_files():
+		for description in read_sync_db(sync_db, set(packages)):
+			if package := packages.get(f"{description['NAME']}-{description['VERSION']}"):
+				package['sha256'] = description.get('SHA256SUM', None)
+				package['signature'] = description.get('PGPSIG', None)
+
+def download_file(url: str, destination: str, sha256: str = None):
+	"""
+	Downloads a file next to its destination and only moves it into place once its checksum matches.
+	"""
+	checksum = hashlib.sha256()
+	with urllib.request.urlopen(url, timeout=60) as response, open(f'{destination}.part', 'wb') as part:
+		while chunk := response.read(1024 * 1024):
+			checksum.update(chunk)
+			part.write(chunk)
+	if sha256 and checksum.hexdigest() != sha256:
+		os.remove(f'{destination}.part')
+		raise archinstall.RequirementError(f'Checksum mismatch for {url}')
+	os.replace(f'{destination}.part', destination)
+
+def file_sha256(path: str):
+	checksum = hashlib.sha256()
+	with open(path, 'rb') as source:
+		while chunk := source.read(1024 * 1024):
+			checksum.update(chunk)
+	return checksum.hexdigest()
+
+def mirror_templates():
+	"""
+	Returns the mirrors to download from, as URLs with $repo and $arch in them, the best ranked ones first.
+	Without a ranking or a configured region, these are the mirrors of the live medium.
+	"""
+	mirrors = [result['url'] for ranking in mirror_ranking.values() for result in ranking['mirrors']]
+	if type(regions := archinstall.arguments.get('mirror-region', None)) is dict:
+		mirrors += [mirror for region in regions.values() if type(region) is dict for mirror in region]
+	if not mirrors and os.path.isfile('/etc/pacman.d/mirrorlist'):
+		with open('/etc/pacman.d/mirrorlist', 'r') as mirrorlist:
+			mirrors = re.findall(r'^\s*Server\s*=\s*(\S+)', mirrorlist.read(), re.MULTILINE)
+	return list(dict.fromkeys(mirrors))
+
+def package_urls(repo: str, filename: str, url: str = None):
+	"""
+	Returns the URLs a package can be downloaded from: the given one first, then the best ranked mirrors.
+	"""
+	urls = [url] if url else []
+	for mirror in mirror_templates():
+		if (candidate := f"{mirror.replace('$repo', repo).replace('$arch', os.uname().machine).rstrip('/')}/{urllib.parse.quote(filename)}") not in urls:
+			urls.append(candidate)
+	return urls[:int(archinstall.arguments.get('download-mirrors', download_mirrors))]
+
+def verify_signature(path: str, signature: str):
+	"""
+	Checks a package against the base64 encoded signature from the sync database, with pacman's keyring.
+	The signature is written next to the package under a name of its own, as the installs of a fleet share the cache.
+	"""
+	signature_path = f'{path}.{os.getpid()}-{threading.get_ident()}.sig'
+	with open(signature_path, 'wb') as signature_file:
+		signature_file.write(base64.b64decode(signature))
+	try:
+		return run_command(f'/usr/bin/pacman-key --verify {signature_path} {path}', peak_output=False).exit_code == 0
+	except (archinstall.RequirementError, archinstall.SysCallError) as err:
+		archinstall.log(f'Could not verify the signature of {path}: {err}', level=logging.DEBUG)
+		return False
+	finally:
+		os.remove(signature_path)
+
+def segmented_download(urls, destination: str, size: int, sha256: str = None, signature: str = None):
+	"""
+	Downloads a file in ranged segments from several mirrors at once. Every mirror picks up the next
+	segment as soon as it is done with one, so the faster mirrors end up with more of the file.
+	A mirror that falls far behind the fastest one hands the rest of its segment back and drops out.
+	The file is only moved into place once its checksum and signature check out.
+	"""
+	# Smaller files get smaller segments, so that every mirror gets several and the last ones don't hold up the download.
+	segment_size = min(int(archinstall.arguments.get('download-segment-size', download_segment_size)), max(1024 ** 2, size // (len(urls) * 4)))
+	slow_factor = float(archinstall.arguments.get('download-slow-factor', download_slow_factor))
+	segments = collections.deque((start, min(start + segment_size, size)) for start in range(0, size, segment_size))
+	rates = {}
+	lock = threading.Lock()
+
+	part = f'{destination}.part'
+	with open(part, 'wb') as part_file:
+		part_file.truncate(size)
+	descriptor = os.open(part, os.O_WRONLY)
+
+	def fetch(url, mirrors):
+		"""
+		Downloads segments from one mirror until there are none left. Returns False if the mirror dropped out.
+		"""
+		started = time.perf_counter()
+		received = 0
+		while True:
+			with lock:
+				if not segments:
+					return True
+				start, end = segments.popleft()
+			try:
+				with urllib.request.urlopen(urllib.request.Request(url, headers={'Range': f'bytes={start}-{end - 1}'}), timeout=30) as response:
+					if response.status != 206:
+						raise OSError('ranged requests are not supported')
+					while start < end:
+						if not (chunk := response.read(min(256 * 1024, end - start))):
+							raise OSError('the transfer ended early')
+						os.pwrite(descriptor, chunk, start)
+						start += len(chunk)
+						received += len(chunk)
+						elapsed = time.perf_counter() - started
+						with lock:
+							rates[url] = received / max(elapsed, 0.000001)
+							if start < end and mirrors > 1 and elapsed > 1 and rates[url] * slow_factor < max(rates.values()):
+								segments.appendleft((start, end))
+								archinstall.log(f"Dropping mirror {url} for {os.path.basename(destination)}, {rates[url] / 1024:.0f} KiB/s against {max(rates.values()) / 1024:.0f} KiB/s", level=logging.DEBUG)
+								return False
+			except (OSError, ValueError) as err:
+				with lock:
+					segments.appendleft((start, end))
+				archinstall.log(f'Dropping mirror {url} for {os.path.basename(destination)}: {err}', level=logging.DEBUG)
+				return False
+
+	try:
+		# A segment handed back after the other mirrors finished is picked up by another round with the mirrors that are left.
+		while segments:
+			if not urls:
+				raise OSError(f'No mirror could serve {os.path.basename(destination)}')
+			with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+				kept = list(pool.map(lambda url: fetch(url, len(urls)), urls))
+			urls = [url for url, keep in zip(urls, kept) if keep]
+	finally:
+		os.close(descriptor)
+
+	if sha256 and file_sha256(part) != sha256:
+		os.remove(part)
+		raise archinstall.RequirementError(f'Checksum mismatch for {os.path.basename(destination)}')
+	if signature and not verify_signature(part, signature):
+		os.remove(part)
+		raise archinstall.RequirementError(f'Signature mismatch for {os.path.basename(destination)}')
+	os.replace(part, destination)
+	mirrors = ', '.join(f'{urllib.parse.urlsplit(url).netloc} {rate / 1024 ** 2:.1f} MiB/s' for url, rate in rates.items())
+	archinstall.log(f'Downloaded {os.path.basename(destination)} ({size / 1024 ** 2:.0f} MiB) from {len(rates)} mirrors: {mirrors}', level=logging.DEBUG)
+
+def fetch_package(package, cache: str):
+	"""
+	Downloads a package into the cache. Returns whether it worked.
+	"""
+	try:
+		download_package(package, f"{cache}/{package['filename']}")
+	except (OSError, archinstall.RequirementError) as err:
+		archinstall.log(f"Could not download {package['filename']}: {err}", level=logging.INFO, fg='red')
+		return False
+	return True
+
+def download_package(package, destination: str):
+	"""
+	Downloads a package, in segments from several mirrors when it is large enough to be worth it.
+	"""
+	if package['size'] < int(archinstall.arguments.get('segmented-download-minimum', segmented_download_minimum)):
+		download_file(package['url'], destination, package['sha256'])
+		return
+	try:
+		segmented_download(package_urls(package['repo'], package['filename'], package['url']), destination, package['size'], package['sha256'], package.get('signature', None))
+	except OSError as err:
+		archinstall.log(f"Could not download {package['filename']} in segments, downloading it in one piece: {err}", level=logging.DEBUG)
+		download_file(package['url'], destination, package['sha256'])
+
+@traced
+def download_locked_packages(cache: str):
+	"""
+	Downloads every repository package pinned by the lockfile straight into the package cache,
+	in parallel and without any resolution, verifying each against its pinned checksum.
+	Returns whether all of them are in the cache.
+	"""
+	os.makedirs(cache, exist_ok=True)
+	prefetch['plan'] = plan_transactions()
+
+	missing = [package for package in lockfile['repo'] if not os.path.isfile(f"{cache}/{package['filename']}") or (package['sha256'] and file_sha256(f"{cache}/{package['filename']}") != package['sha256'])]
+
+	def download(package):
+		with admitted('download', package['filename']):
+			return fetch_package(package, cache)
+
+	started = time.time()
+	with ThreadPoolExecutor(max_workers=int(archinstall.arguments.get('download-workers', 8))) as pool:
+		downloaded = sum(pool.map(download, missing))
+	archinstall.log(f"Downloaded {downloaded} of {len(missing)} missing locked packages in {time.time() - started:.1f}s ({len(lockfile['repo']) - len(missing)} already cached)", level=logging.INFO)
+	return downloaded == len(missing)
+
+prefetch = {}
+
+def private_pacman_config():
+	"""
+	Sets up a pacman configuration and database path of our own on the host, next to the package cache,
+	so that syncing and downloading leaves the live medium's own pacman database alone. The installs of a fleet
+	share both, so the configuration is only written when it changes, and then replaced in one go.
+	Returns the paths of the configuration and of the database.
+	"""
+	root = os.path.dirname(host_cache('package-cache') or package_cache_path)
+	database = f'{root}/prefetch/db'
+	config = f'{root}/prefetch/pacman.conf'
+	os.makedirs(f'{database}/local', exist_ok=True)
+
+	# Multilib gets enabled in the installation, so the profiles may ask for packages from it.
+	with open('/etc/pacman.conf', 'r') as host_config:
+		config_data = host_config.read()
+	for path, before, after in configuration_edits:
+		if path == '/etc/pacman.conf':
+			config_data = config_data.replace(before, after)
+	if os.path.isfile(config):
+		with open(config, 'r') as config_file:
+			if config_file.read() == config_data:
+				return config, database
+	with open(f'{config}.{os.getpid()}', 'w') as config_file:
+		config_file.write(config_data)
+	os.replace(f'{config}.{os.getpid()}', config)
+
+	return config, database
+
+sync_databases = {'fresh': False}
+sync_databases_lock = threading.Lock()
+
+def pacman_repositories(config: str):
+	with open(config, 'r') as config_file:
+		return [repository for repository in re.findall(r'^\[([^\]\s]+)\]', config_file.read(), re.MULTILINE) if repository != 'options']
+
+def mirror_lastsync(mirror: str):
+	"""
+	Returns when a mirror last synced with the Arch Linux master, or None if it doesn't tell.
+	"""
+	try:
+		with urllib.request.urlopen(f"{mirror.split('$repo', 1)[0].rstrip('/')}/lastsync", timeout=10) as response:
+			return int(response.read().decode().strip())
+	except (OSError, ValueError):
+		return None
+
+def fetch_sync_database(url: str, path: str):
+	"""
+	Downloads a sync database, unless the copy at the path is as new as the mirror's. Returns whether it was downloaded.
+	The copy gets the modification time the mirror gives it, which is what pacman's own -Sy goes by as well.
+	"""
+	request = urllib.request.Request(url)
+	if os.path.isfile(path):
+		request.add_header('If-Modified-Since', email.utils.formatdate(os.path.getmtime(path), usegmt=True))
+	try:
+		with urllib.request.urlopen(request, timeout=60) as response, open(f'{path}.part', 'wb') as part:
+			shutil.copyfileobj(response, part, 1024 * 1024)
+			modified = response.headers.get('Last-Modified', None)
+	except urllib.error.HTTPError as err:
+		if err.code == 304:
+			return False
+		raise
+	os.replace(f'{path}.part', path)
+	if modified:
+		modified = email.utils.parsedate_to_datetime(modified).timestamp()
+		os.utime(path, (modified, modified))
+	return True
+
+@contextlib.contextmanager
+def sync_databases_locked(database: str):
+	"""
+	Holds the shared sync databases while inside the block, against the other installs of a fleet as well.
+	"""
+	with open(f'{database}/sync.lock', 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+
+@traced
+def refresh_sync_databases():
+	"""
+	Keeps one copy of the sync database of every repository (multilib included) in our own database path,
+	for the prefetch, the package index and the installation to share. The databases are only asked for again
+	when the best ranked mirror synced since they were fetched, and then conditionally, so unchanged ones
+	aren't downloaded. The installs of a fleet refresh them one at a time. Returns whether the copies are up to date.
+	"""
+	with sync_databases_lock:
+		if sync_databases['fresh']:
+			return True
+
+		config, database = private_pacman_config()
+		with sync_databases_locked(database):
+			os.makedirs(sync := f'{database}/sync', exist_ok=True)
+			repositories = pacman_repositories(config)
+			state = {}
+			if os.path.isfile(f'{database}/sync.json'):
+				with open(f'{database}/sync.json', 'r') as state_file:
+					state = json.load(state_file)
+
+			if mirrors := mirror_templates():
+				lastsync = mirror_lastsync(mirrors[0])
+				if lastsync and lastsync <= (state.get('lastsync', None) or 0) and all(os.path.isfile(f'{sync}/{repository}.db') for repository in repositories):
+					archinstall.log(f'The sync databases are up to date, the mirror last synced {time.time() - lastsync:.0f}s ago', level=logging.DEBUG)
+				else:
+					def fetch(repository):
+						return fetch_sync_database(f"{mirrors[0].replace('$repo', repository).replace('$arch', os.uname().machine).rstrip('/')}/{repository}.db", f'{sync}/{repository}.db')
+
+					try:
+						with ThreadPoolExecutor(max_workers=max(1, len(repositories))) as pool:
+							downloaded = [repository for repository, fetched in zip(repositories, pool.map(fetch, repositories)) if fetched]
+					except (OSError, ValueError) as err:
+						archinstall.log(f'Could not refresh the sync databases from {mirrors[0]}: {err}', level=logging.DEBUG)
+						mirrors = []
+					else:
+						archinstall.log(f"Sync databases: {', '.join(downloaded) or 'none'} downloaded, {len(repositories) - len(downloaded)} unchanged", level=logging.INFO)
+						with open(f'{database}/sync.json', 'w') as state_file:
+							json.dump({'lastsync': lastsync, 'mirror': mirrors[0], 'time': time.time()}, state_file, indent=4)
+
+			if not mirrors:
+				# Without a mirror of our own to ask, pacman refreshes the databases, which it also does conditionally.
+				try:
+					if run_command(f'/usr/bin/pacman -Sy --config {config} --dbpath {database}').exit_code != 0:
+						return False
+				except archinstall.SysCallError as err:
+					archinstall.log(f'Could not refresh the sync databases: {err}', level=logging.DEBUG)
+					return False
+
+			sync_databases['fresh'] = True
+			return True
+
+def seed_sync_databases(target: str):
+	"""
+	Copies the shared sync databases into the target, so that pacstrap and the installation's pacman
+	find them up to date instead of downloading them again.
+	"""
+	if not refresh_sync_databases():
+		return False
+	_, database = private_pacman_config()
+	os.makedirs(f'{target}/var/lib/pacman/sync', exist_ok=True)
+	for path in glob.glob(f'{database}/sync/*.db'):
+		destination = f'{target}/var/lib/pacman/sync/{os.path.basename(path)}'
+		if not os.path.isfile(destination) or os.path.getmtime(destination) < os.path.getmtime(path):
+			shutil.copy2(path, destination)
+	return True
+
+def pacstrap_from_shared_databases(installation: Installer):
+	"""
+	Makes the Installer's pacstrap start out from the shared sync databases, instead of forcing a refresh
+	of the live medium's databases (pacman -Syy) and then downloading them all over again into the target.
+	pacstrap uses our own pacman configuration, which has multilib enabled like the installation will.
+	"""
+	pacstrap = installation.pacstrap
+
+	def pacstrap_seeded(*packages, **kwargs):
+		if len(packages) == 1 and type(packages[0]) in (list, tuple):
+			packages = packages[0]
+		if not seed_sync_databases(installation.target):
+			return pacstrap(packages, **kwargs)
+
+		config, _ = private_pacman_config()
+		installation.log(f'Installing packages: {packages}', level=logging.INFO)
+		if (strap := run_command(f'/usr/bin/pacstrap -C {config} {installation.target} {" ".join(packages)} --noconfirm', peak_output=True)).exit_code == 0:
+			return True
+		installation.log(f'Could not strap in packages: {strap.exit_code}', level=logging.INFO, fg='red')
+		return False
+
+	installation.pacstrap = pacstrap_seeded
+
+def pacstrap_from_lockfile(installation: Installer):
+	"""
+	Makes the Installer's pacstrap install the package files pinned by the lockfile from the package cache,
+	rather than whatever the sync databases have now. The first transaction lays down the whole pinned closure
+	(with the expensive hooks deferred) and later ones skip what it installed. A pinned file missing from the
+	cache ends the installation. The few packages the Installer adds on its own aren't pinned, those are installed
+	from the repositories with our own pacman configuration and the shared sync databases, refreshed only for them.
+	"""
+	pacstrap_from_shared_databases(installation)
+	pacstrap = installation.pacstrap
+	cache = host_cache('package-cache') or f'{installation.target}/var/cache/pacman/pkg'
+
+	def pacstrap_locked(*packages, **kwargs):
+		if len(packages) == 1 and type(packages[0]) in (list, tuple):
+			packages = packages[0]
+		installed = installed_names(installation)
+		if pending := [package for package in lockfile['repo'] if package['name'] not in installed]:
+			# Whatever wasn't prefetched is downloaded now.
+			if any(not os.path.isfile(f"{cache}/{package['filename']}") for package in pending):
+				download_locked_packages(cache)
+			if missing := [package['filename'] for package in pending if not os.path.isfile(f"{cache}/{package['filename']}")]:
+				installation.log(f"Packages pinned by the lockfile are missing from the package cache: {' '.join(missing)}", level=logging.INFO, fg='red')
+				exit(1)
+			config, _ = private_pacman_config()
+			defer_expensive_hooks(installation)
+			installation.log(f'Installing {len(pending)} packages pinned by the lockfile', level=logging.INFO)
+			if (strap := run_command(f"/usr/bin/pacstrap -C {config} -U {installation.target} {' '.join(cache + '/' + package['filename'] for package in pending)} --noconfirm", peak_output=True)).exit_code != 0:
+				installation.log(f'Could not strap in the pinned packages: {strap.exit_code}', level=logging.INFO, fg='red')
+				exit(1)
+			installed = installed_names(installation)
+
+		if unpinned := [package for package in packages if package not in installed]:
+			installation.log(f"Not pinned by the lockfile, installing the current versions from the repositories: {' '.join(unpinned)}", level=logging.INFO, fg='yellow')
+			return pacstrap(unpinned, **kwargs)
+		return True
+
+	installation.pacstrap = pacstrap_locked
+
+sync_db_list_fields = ('GROUPS', 'LICENSE', 'REPLACES', 'CONFLICTS', 'PROVIDES', 'DEPENDS', 'OPTDEPENDS', 'MAKEDEPENDS', 'CHECKDEPENDS')
+
+def read_sync_db(path: str, names=None):
+	"""
+	Reads a pacman sync database and yields the description of every package in it,
+	as a dictionary of the %FIELD% entries (single values as strings, multiple values as lists).
+	Given a set of name-version entries, only those are read.
+	"""
+	with tarfile.open(path, 'r:*') as database:
+		for member in database:
+			if not member.isfile() or not member.name.endswith('/desc'):
+				continue
+			if names is not None and member.name.split('/', 1)[0] not in names:
+				continue
+			yield parse_description(database.extractfile(member).read().decode('utf-8'))
+
+def parse_description(text: str):
+	description = {}
+	field = None
+	for line in text.splitlines():
+		if line.startswith('%') and line.endswith('%'):
+			field = line.strip('%')
+			description[field] = []
+		elif line and field:
+			description[field].append(line)
+	return {field: values if field in sync_db_list_fields else values[0] if values else '' for field, values in description.items()}
+
+def local_packages(target: str):
+	"""
+	Yields the description of every package installed in the target, from its local pacman database.
+	"""
+	for path in glob.glob(f'{target}/var/lib/pacman/local/*/desc'):
+		with open(path, 'r') as desc:
+			yield parse_description(desc.read())
+
+def installed_names(installation: Installer):
+	"""
+	Returns the names of the packages installed in the target, according to its local pacman database,
+	together with the names they provide and the groups they belong to.
+	"""
+	names = set()
+	for description in local_packages(installation.target):
+		names.add(description['NAME'])
+		names.update(strip_version(provided) for provided in description.get('PROVIDES', []))
+		names.update(description.get('GROUPS', []))
+	return names
+
+def sync_db_files():
+	"""
+	Returns the sync databases to read package information from. Our own database
+	has multilib enabled, so it is preferred over the live medium's.
+	"""
+	_, database = private_pacman_config()
+	if databases := sorted(glob.glob(f'{database}/sync/*.db')):
+		return databases
+	return sorted(glob.glob('/var/lib/pacman/sync/*.db'))
+
+@traced
+def build_package_index():
+	"""
+	Builds the package name index from the sync databases and the AUR's package list.
+	Repository names include provided names and groups, since those are valid pacman targets too.
+	"""
+	if not refresh_sync_databases():
+		archinstall.log('Could not refresh the sync databases, indexing the existing ones', level=logging.DEBUG)
+
+	repo = set()
+	for path in sync_db_files():
+		for description in read_sync_db(path):
+			repo.add(description['NAME'])
+			repo.update(strip_version(provided) for provided in description.get('PROVIDES', []))
+			repo.update(description.get('GROUPS', []))
+
+	with urllib.request.urlopen('https://aur.archlinux.org/packages.gz', timeout=30) as response:
+		aur = {line for line in gzip.decompress(response.read()).decode('utf-8').splitlines() if line and not line.startswith('#')}
+
+	index = {'time': time.time(), 'repo': sorted(repo), 'aur': sorted(aur)}
+	path = archinstall.arguments.get('package-index', package_index_path)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, 'w') as index_file:
+		json.dump(index, index_file)
+	return index
+
+def load_package_index(refresh: bool = False):
+	"""
+	Returns the package name index as sets for constant time lookups,
+	rebuilding it when asked to or when it's older than the TTL.
+	"""
+	path = archinstall.arguments.get('package-index', package_index_path)
+	ttl = int(archinstall.arguments.get('package-index-ttl', package_index_ttl))
+	index = None
+	if not refresh and os.path.isfile(path):
+		with open(path, 'r') as index_file:
+			index = json.load(index_file)
+		if time.time() - index['time'] > ttl:
+			index = None
+	if index is None:
+		index = build_package_index()
+	return {'repo': set(index['repo']), 'aur': set(index['aur'])}
+
+def validate_packages(index, packages, source: str):
+	"""
+	Checks package names against one side of the index ('repo' or 'aur')
+	and raises a RequirementError naming the unknown ones, with suggestions for near misses.
+	"""
+	if not (unknown := [package for package in packages if package not in index[source]]):
+		return
+
+	problems = []
+	for package in unknown:
+		if suggestions := difflib.get_close_matches(package, index[source], n=3, cutoff=0.8):
+			problems.append(f"{package} (did you mean {', '.join(suggestions)}?)")
+		else:
+			problems.append(package)
+	where = 'in the repositories' if source == 'repo' else 'in the AUR'
+	raise archinstall.RequirementError(f"Could not find these packages {where}: {', '.join(problems)}")
+
+mirror_ranking = {}
+
+def probe_mirror(url: str, timeout: float = 5):
+	"""
+	Measures a mirror by its time to first byte for `lastsync` and the time it
+	takes to download the (small) core database. Returns None if the mirror did not respond in time.
+	"""
+	base = url.split('$repo', 1)[0].rstrip('/')
+	sample = url.replace('$repo', 'core').replace('$arch', os.uname().machine).rstrip('/') + '/core.db'
+	try:
+		started = time.perf_counter()
+		with urllib.request.urlopen(f'{base}/lastsync', timeout=timeout) as response:
+			response.read(1)
+			latency = time.perf_counter() - started
+			response.read()
+
+		started = time.perf_counter()
+		with urllib.request.urlopen(sample, timeout=timeout) as response:
+			size = len(response.read())
+		duration = time.perf_counter() - started
+	except (OSError, ValueError) as err:
+		archinstall.log(f'Mirror {base} did not respond: {err}', level=logging.DEBUG)
+		return None
+
+	throughput = size / max(duration, 0.000001)
+	return {'url': url, 'latency': latency, 'throughput': throughput, 'score': latency + duration}
+
+def rank_mirrors(urls, workers: int = 16, timeout: float = 5):
+	"""
+	Probes all given mirrors concurrently and returns the ones that responded, best first.
+	"""
+	with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as pool:
+		results = [result for result in pool.map(lambda url: probe_mirror(url, timeout), urls) if result]
+	return sorted(results, key=lambda result: result['score'])
+
+def load_mirror_ranking(region: str):
+	"""
+	Returns the cached ranking of a region, if there is one that is younger than the TTL.
+	"""
+	ttl = int(archinstall.arguments.get('mirror-cache-ttl', mirror_cache_ttl))
+	if os.path.isfile(path := archinstall.arguments.get('mirror-cache', mirror_cache_path)):
+		with open(path, 'r') as cache:
+			ranking = json.load(cache).get(region)
+		if ranking and time.time() - ranking['time'] < ttl:
+			return ranking
+	return None
+
+@traced
+def ranked_mirrors(region: str, mirrors):
+	"""
+	Orders the mirrors of a region from fastest to slowest, probing them unless
+	a fresh ranking is cached. Returns the mirrors in the form archinstall.use_mirrors() expects.
+	"""
+	if archinstall.arguments.get('no-mirror-rank', False):
+		return mirrors
+
+	if not (ranking := load_mirror_ranking(region)):
+		archinstall.log(f'Ranking {len(mirrors)} mirrors in {region}', level=logging.INFO)
+		ranking = {'time': time.time(), 'mirrors': rank_mirrors(list(mirrors))}
+		if not ranking['mirrors']:
+			return mirrors
+
+		path = archinstall.arguments.get('mirror-cache', mirror_cache_path)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		cache = {}
+		if os.path.isfile(path):
+			with open(path, 'r') as cache_file:
+				cache = json.load(cache_file)
+		cache[region] = ranking
+		with open(path, 'w') as cache_file:
+			json.dump(cache, cache_file, indent=4)
+
+	mirror_ranking[region] = ranking
+	for result in ranking['mirrors'][:5]:
+		archinstall.log(f"Mirror {result['url']}: {result['latency'] * 1000:.0f} ms, {result['throughput'] / 1024:.0f} KiB/s", level=logging.DEBUG)
+	return {result['url']: True for result in ranking['mirrors'][:int(archinstall.arguments.get('mirror-count', 10))]}
+
+@traced
+def wait_for_reflector():
+	"""
+	Waits for reflector to finish rewriting the mirrorlist. When we ranked the mirrors
+	ourselves there is nothing to wait for, so reflector is stopped instead.
+	"""
+	if mirror_ranking:
+		archinstall.log('Using our own mirror ranking, stopping automatic mirror selection (reflector).', level=logging.INFO)
+		try:
+			run_command('/usr/bin/systemctl stop reflector.service')
+		except archinstall.SysCallError as err:
+			archinstall.log(f'Could not stop reflector: {err}', level=logging.DEBUG)
+		return
+
+	archinstall.log('Waiting for automatic mirror selection (reflector) to complete.', level=logging.INFO)
+	try:
+		pid = int(run_command('/usr/bin/systemctl show --property MainPID --value reflector.service').decode().strip() or 0)
+	except (archinstall.SysCallError, ValueError):
+		pid = 0
+
+	# Rather than polling the service, block until its main process exits.
+	if pid and hasattr(os, 'pidfd_open'):
+		try:
+			pidfd = os.pidfd_open(pid)
+		except OSError:
+			pass
+		else:
+			try:
+				poller = select.poll()
+				poller.register(pidfd, select.POLLIN)
+				poller.poll()
+			finally:
+				os.close(pidfd)
+
+	while archinstall.service_state('reflector') not in ('dead', 'failed'):
+		time.sleep(1)
+
+expensive_hooks = ['90-mkinitcpio-install.hook', '70-dkms-install.hook']
+
+def plan_transactions(resolve_aur: bool = True):
+	"""
+	Collects every package the configuration asks for into as few pacman transactions
+	as correctness allows: the base system that pacstrap has to lay down first, one transaction
+	for everything else from the repositories, the repository dependencies of the AUR packages,
+	and the AUR packages which have to be built inside the installation.
+	Every package is listed once, together with what asked for it.
+	"""
+	base = {}
+	system = {}
+	aur_dependencies = {}
+
+	def request(transaction, reason, *packages):
+		for package in packages:
+			if package and package not in base:
+				transaction.setdefault(package, []).append(reason)
+
+	request(base, 'base', 'base', 'base-devel', 'linux-firmware')
+	request(base, 'kernels', *archinstall.arguments.get('kernels', ['linux']))
+	if archinstall.arguments.get('bootloader') == 'grub-install':
+		request(system, 'bootloader', *(['grub', 'efibootmgr'] if uefi() else ['grub']))
+	if type(nic := archinstall.arguments.get('nic', {})) is dict and nic.get('NetworkManager', False):
+		request(system, 'nic', 'networkmanager')
+	request(system, 'audio', *audio_packages.get(archinstall.arguments.get('audio', None), []))
+	request(system, 'packages', *(archinstall.arguments.get('packages', None) or []))
+	if archinstall.arguments.get('profile', None) and (profile_packages := archinstall.arguments['profile'].packages):
+		request(system, f"profile {archinstall.arguments['profile'].namespace}", *profile_packages)
+
+	aur = {}
+	resolution = None
+	if helper := archinstall.arguments.get('aur-helper', None):
+		request(system, 'aur-helper', 'git')
+		if not archinstall.arguments.get('no-build-env', False):
+			request(system, 'aur build environment', 'ccache')
+		aur_packages = archinstall.arguments.get('aur-packages', None) or []
+		for package in aur_packages:
+			aur[package] = ['aur-packages']
+		if lockfile:
+			resolved = {package['Name']: package for base in lockfile['aur'] for package in base['packages']}
+			request(aur_dependencies, 'aur dependencies', *lockfile['aur-repo-dependencies'])
+			resolution = ({name: info for name, info in resolved.items() if name != helper or helper in aur_packages}, set(lockfile['aur-repo-dependencies']))
+		elif resolve_aur:
+			# The build dependencies of the AUR packages (and of the helper itself) come from the repositories.
+			# Any name that isn't in the AUR is taken for one of them, so they get a transaction of their own:
+			# a name that turns out not to be in the repositories either only fails the AUR packages.
+			try:
+				resolved, repo_dependencies = resolve_aur_dependencies([helper] + aur_packages)
+			except OSError as err:
+				archinstall.log(f'Could not resolve AUR dependencies while planning: {err}', level=logging.DEBUG)
+			else:
+				request(aur_dependencies, 'aur dependencies', *sorted(repo_dependencies))
+				resolution = ({name: info for name, info in resolved.items() if name != helper or helper in aur_packages}, repo_dependencies)
+
+	return [
+		{'name': 'base', 'via': 'pacstrap (minimal installation)', 'packages': base},
+		{'name': 'system', 'via': 'pacstrap', 'packages': system},
+		{'name': 'aur-dependencies', 'via': 'pacman -S --asdeps, before the AUR builds', 'packages': {package: reasons for package, reasons in aur_dependencies.items() if package not in system}},
+		{'name': 'aur', 'via': 'makepkg, then pacman -U', 'packages': aur, 'resolution': resolution}
+	]
+
+def planned_packages(plan=None):
+	"""
+	Lists the repository packages the installation is going to ask for.
+	"""
+	plan = plan or plan_transactions()
+	return [package for transaction in plan if transaction['name'] != 'aur' for package in transaction['packages']]
+
+def print_plan(plan):
+	print('Package transactions:')
+	for number, transaction in enumerate(plan, start=1):
+		if not transaction['packages']:
+			continue
+		print(f" {number}. {transaction['name']} via {transaction['via']} ({len(transaction['packages'])} packages)")
+		for package, reasons in transaction['packages'].items():
+			print(f"      {package:<40} {', '.join(reasons)}")
+	print(f"Deferred to the end of the installation: {', '.join(expensive_hooks)}")
+
+def dedupe_package_requests(installation: Installer, installed):
+	"""
+	Makes later add_additional_packages() calls (from the profile, or the AUR helper setup)
+	skip packages that the planned transactions already installed.
+	"""
+	add_additional_packages = installation.add_additional_packages
+
+	def add_missing_packages(*packages, **kwargs):
+		if len(packages) == 1 and type(packages[0]) in (list, tuple):
+			packages = packages[0]
+		if missing := [package for package in packages if package not in installed]:
+			return add_additional_packages(missing, **kwargs)
+		return True
+
+	installation.add_additional_packages = add_missing_packages
+
+def defer_expensive_hooks(installation: Installer):
+	"""
+	Masks the mkinitcpio and DKMS install hooks, so that the transactions of the
+	installation don't regenerate the initramfs or rebuild modules over and over.
+	run_deferred_hooks() removes the masks and runs them once.
+	"""
+	os.makedirs(f'{installation.target}/etc/pacman.d/hooks', exist_ok=True)
+	for hook in expensive_hooks:
+		if not os.path.lexists(f'{installation.target}/etc/pacman.d/hooks/{hook}'):
+			os.symlink('/dev/null', f'{installation.target}/etc/pacman.d/hooks/{hook}')
+
+@traced
+def run_deferred_hooks(installation: Installer):
+	for hook in expensive_hooks:
+		if os.path.islink(path := f'{installation.target}/etc/pacman.d/hooks/{hook}') and os.readlink(path) == '/dev/null':
+			os.remove(path)
+
+	if os.path.isfile(f'{installation.target}/usr/bin/dkms'):
+		for kernel in sorted(os.listdir(f'{installation.target}/usr/lib/modules')):
+			if os.path.isdir(f'{installation.target}/usr/lib/modules/{kernel}/build'):
+				arch_chroot(installation, f'/usr/bin/dkms autoinstall -k {kernel}')
+	# Installer.mkinitcpio() would write its HOOKS, MODULES and BINARIES to /etc/mkinitcpio.conf first, but it only
+	# knows them (the encrypt hook, btrfs) after its own minimal_installation(), which resumed and restored installs skip.
+	# minimal_installation() already wrote them to the installation's config, so it is used as it is.
+	arch_chroot(installation, '/usr/bin/mkinitcpio -P')
+
+@traced
+def prefetch_packages(cache: str):
+	"""
+	Downloads the given packages into the package cache using a throw-away sync database,
+	so that the live medium's own pacman database is left alone.
+	"""
+	prefetch['plan'] = plan_transactions()
+	packages = planned_packages(prefetch['plan'])
+	config, database = private_pacman_config()
+	os.makedirs(cache, exist_ok=True)
+
+	wait_for_reflector()
+	if archinstall.arguments.get('mirror-region', None):
+		archinstall.use_mirrors(archinstall.arguments['mirror-region'])
+
+	started = time.time()
+	try:
+		with fleet_slot('download'), admitted('download', 'prefetch'):
+			if not refresh_sync_databases():
+				archinstall.log('Could not prefetch packages, the sync databases could not be refreshed', level=logging.INFO)
+				return
+			# The large packages are downloaded in segments from several mirrors, while pacman downloads the rest.
+			# pacman is handed the resolved closure, so it doesn't pull the large packages in again as dependencies.
+			closure = resolve_closure(config, database, packages)
+			minimum = int(archinstall.arguments.get('segmented-download-minimum', segmented_download_minimum))
+			large = [package for package in closure if package['size'] >= minimum and not os.path.isfile(f"{cache}/{package['filename']}")]
+			describe_packages(large)
+			rest = [f"{package['repo']}/{package['name']}" for package in closure if package not in large] if closure else packages
+			with ThreadPoolExecutor(max_workers=2) as pool:
+				segmented = pool.map(lambda package: fetch_package(package, cache), large)
+				download = run_command(f'/usr/bin/pacman -Sw{"dd" if closure else ""} --noconfirm --config {config} --dbpath {database} --cachedir {cache} {" ".join(rest)}') if rest else None
+				segmented = sum(segmented)
+		if segmented < len(large):
+			archinstall.log(f'Could not prefetch {len(large) - segmented} of {len(large)} large packages, pacman will download them', level=logging.INFO)
+		if download and download.exit_code != 0:
+			archinstall.log(f'Could not prefetch packages: {download.exit_code}', level=logging.INFO)
+			return
+	except archinstall.SysCallError as err:
+		archinstall.log(f'Could not prefetch packages, they will be downloaded during the installation: {err}', level=logging.DEBUG)
+		return
+	archinstall.log(f'Prefetched {len(packages)} packages in {time.time() - started:.1f}s', level=logging.INFO)
+
+def start_prefetch():
+	"""
+	Starts downloading the planned packages in the background, while the disk is being prepared.
+	"""
+	# There is nowhere to download them to before the installation is mounted without a package cache on the host.
+	if archinstall.arguments.get('no-prefetch', False) or (cache := host_cache('package-cache')) is None:
+		return
+
+	os.makedirs(cache, exist_ok=True)
+	prefetch['cached'] = {filename: os.path.getsize(f'{cache}/{filename}') for _, _, filename in package_files(cache)}
+	prefetch['thread'] = threading.Thread(target=download_locked_packages if lockfile else prefetch_packages, args=(cache,), daemon=True)
+	prefetch['thread'].start()
+
+@traced
+def finish_prefetch():
+	if (thread := prefetch.get('thread')) and thread.is_alive():
+		archinstall.log('Waiting for the package prefetch to complete.', level=logging.INFO)
+		thread.join()
+
+def vercmp(a: str, b: str):
+	"""
+	Compares two package versions the way pacman's vercmp does,
+	returning -1, 0 or 1. Versions are of the form [epoch:]version[-release].
+	"""
+	def parse(version):
+		epoch, _, version = version.partition(':') if ':' in version else ('0', '', version)
+		version, _, release = version.rpartition('-') if '-' in version else (version, '', None)
+		return epoch or '0', version, release
+
+	def rpmvercmp(one: str, two: str):
+		if one == two:
+			return 0
+		i = j = previous_i = previous_j = 0
+		while i < len(one) and j < len(two):
+			while i < len(one) and not one[i].isalnum():
+				i += 1
+			while j < len(two) and not two[j].isalnum():
+				j += 1
+			if i >= len(one) or j >= len(two):
+				break
+			# If the separator lengths were different, we are also finished
+			if i - previous_i != j - previous_j:
+				return -1 if i - previous_i < j - previous_j else 1
+
+			matches = str.isdigit if one[i].isdigit() else str.isalpha
+			end_i, end_j = i, j
+			while end_i < len(one) and matches(one[end_i]):
+				end_i += 1
+			while end_j < len(two) and matches(two[end_j]):
+				end_j += 1
+
+			segment_one, segment_two = one[i:end_i], two[j:end_j]
+			if not segment_two:
+				return 1 if matches is str.isdigit else -1
+			if matches is str.isdigit:
+				segment_one, segment_two = segment_one.lstrip('0'), segment_two.lstrip('0')
+				if len(segment_one) != len(segment_two):
+					return 1 if len(segment_one) > len(segment_two) else -1
+			if segment_one != segment_two:
+				return 1 if segment_one > segment_two else -1
+
+			i = previous_i = end_i
+			j = previous_j = end_j
+
+		if i >= len(one) and j >= len(two):
+			return 0
+		if (i >= len(one) and not two[j].isalpha()) or (i < len(one) and one[i].isalpha()):
+			return -1
+		return 1
+
+	epoch_a, version_a, release_a = parse(a)
+	epoch_b, version_b, release_b = parse(b)
+	if result := rpmvercmp(epoch_a, epoch_b):
+		return result
+	if result := rpmvercmp(version_a, version_b):
+		return result
+	if release_a is not None and release_b is not None:
+		return rpmvercmp(release_a, release_b)
+	return 0
+
+host_cache_defaults = {
+	'package-cache': (package_cache_path, 8 * 1024 ** 3),
+	'aur-cache': (aur_cache_path, 4 * 1024 ** 3),
+	'image-cache': (image_cache_path, 8 * 1024 ** 3),
+	'ccache': (ccache_path, 2 * 1024 ** 3)
+}
+host_caches = {}
+
+def free_space(path: str):
+	"""
+	Returns the space available on the filesystem a path is on, or would be on once it's created.
+	"""
+	while not os.path.exists(path):
+		path = os.path.dirname(path)
+	stat = os.statvfs(path)
+	return stat.f_bavail * stat.f_frsize
+
+def host_cache(option: str):
+	"""
+	Returns the directory on the host one of the caches ('package-cache', 'aur-cache', 'image-cache' or 'ccache')
+	is kept in, or None when there is none: with --no-<cache>, or when no directory was given and the default
+	one's filesystem doesn't have room for it. On the live medium that is the RAM-backed overlay, so there
+	everything is downloaded into and built in the installation, as it is without the caches.
+	"""
+	if option not in host_caches:
+		default, minimum = host_cache_defaults[option]
+		if archinstall.arguments.get(f'no-{option}', False):
+			host_caches[option] = None
+		elif type(path := archinstall.arguments.get(option, None)) is str:
+			host_caches[option] = path
+		elif (free := free_space(default)) >= minimum:
+			host_caches[option] = default
+		else:
+			archinstall.log(f'Not keeping a {option} on the host, {os.path.dirname(default)} has only {free / 1024 ** 2:.0f} MiB available', level=logging.INFO, fg='yellow')
+			host_caches[option] = None
+	return host_caches[option]
+
+def package_files(cache: str):
+	"""
+	Lists the package archives in a package cache as (name, version, filename) tuples.
+	"""
+	for filename in sorted(os.listdir(cache)):
+		if '.pkg.tar' not in filename or filename.endswith('.sig') or filename.endswith('.part'):
+			continue
+		name, version, release, _ = filename.rsplit('-', 3)
+		yield name, f'{version}-{release}', filename
+
+def verify_package_cache(cache: str):
+	"""
+	Checks the signature of every package added to the cache since the last run against the one in the sync
+	databases (pacman 6 doesn't download detached signatures), and drops packages that fail verification as well
+	as partial downloads that were left behind. The packages that passed are recorded in verified.json (with their
+	size and modification time), so they aren't checked again. Versions the sync databases no longer have can't
+	be installed from the repositories anyway, they are left to pacman.
+	"""
+	def verify(filename):
+		return filename, verify_signature(f'{cache}/{filename}', signatures[filename])
+
+	def stamp(filename):
+		stat = os.stat(f'{cache}/{filename}')
+		return [stat.st_size, stat.st_mtime_ns]
+
+	# The other installs of a fleet download into the same cache, so only partial downloads nobody has written to for a while are left behind.
+	for filename in os.listdir(cache):
+		if filename.endswith('.part'):
+			try:
+				if time.time() - os.path.getmtime(f'{cache}/{filename}') > partial_download_age:
+					os.remove(f'{cache}/{filename}')
+			except FileNotFoundError:
+				pass
+
+	verified = {}
+	if os.path.isfile(f'{cache}/verified.json'):
+		with open(f'{cache}/verified.json', 'r') as verified_file:
+			verified = json.load(verified_file)
+	files = {f'{name}-{version}': filename for name, version, filename in package_files(cache)}
+	verified = {filename: verified[filename] for filename in files.values() if verified.get(filename, None) == stamp(filename)}
+	signatures = {}
+	if unverified := {entry for entry, filename in files.items() if filename not in verified}:
+		for sync_db in sync_db_files():
+			for description in read_sync_db(sync_db, unverified):
+				if description.get('PGPSIG', None) and description.get('FILENAME', None) in files.values():
+					signatures[description['FILENAME']] = description['PGPSIG']
+	with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+		for filename, valid in pool.map(verify, sorted(signatures)):
+			if valid:
+				verified[filename] = stamp(filename)
+			else:
+				archinstall.log(f'Removing {filename} from the package cache, its signature could not be verified', level=logging.INFO, fg='yellow')
+				os.remove(f'{cache}/{filename}')
+
+	with open(f'{cache}/verified.json.{os.getpid()}', 'w') as verified_file:
+		json.dump(verified, verified_file, indent=4, sort_keys=True)
+	os.replace(f'{cache}/verified.json.{os.getpid()}', f'{cache}/verified.json')
+
+def prune_package_cache(cache: str, keep: int):
+	"""
+	Removes all but the newest `keep` versions of every package, much like `paccache -rk <keep>`.
+	"""
+	versions = {}
+	for name, version, filename in package_files(cache):
+		versions.setdefault(name, []).append((version, filename))
+
+	removed = 0
+	for name, files in versions.items():
+		files.sort(key=functools.cmp_to_key(lambda x, y: vercmp(x[0], y[0])), reverse=True)
+		for version, filename in files[keep:]:
+			removed += os.path.getsize(f'{cache}/{filename}')
+			os.remove(f'{cache}/{filename}')
+			if os.path.isfile(f'{cache}/{filename}.sig'):
+				os.remove(f'{cache}/{filename}.sig')
+
+	if removed:
+		archinstall.log(f'Pruned {removed / 1024 ** 2:.1f} MiB of old package versions from {cache}', level=logging.INFO)
+
+def installed_from_log(installation: Installer):
+	"""
+	Returns the name-version of every package pacman installed into the target, according to its log.
+	"""
+	installed = set()
+	if os.path.isfile(f'{installation.target}/var/log/pacman.log'):
+		with open(f'{installation.target}/var/log/pacman.log', 'r') as log:
+			for line in log:
+				if match := re.search(r'\[ALPM\] (?:installed|reinstalled) (\S+) \((\S+)\)', line):
+					installed.add(f'{match.group(1)}-{match.group(2)}')
+				elif match := re.search(r'\[ALPM\] (?:upgraded|downgraded) (\S+) \(\S+ -> (\S+)\)', line):
+					installed.add(f'{match.group(1)}-{match.group(2)}')
+	return installed
+
+@contextlib.contextmanager
+def package_cache(installation: Installer):
+	"""
+	Bind mounts a persistent package cache on the host over the installation's
+	/var/cache/pacman/pkg, so that pacstrap and pacman inside the installation share it.
+	The mount is released before the Installer generates the fstab. Without a package cache on the host,
+	the packages are downloaded into the installation's own cache.
+	"""
+	cache_mount = f'{installation.target}/var/cache/pacman/pkg'
+	os.makedirs(cache_mount, exist_ok=True)
+	if (cache := host_cache('package-cache')) is None:
+		yield cache_mount
+		return
+	os.makedirs(cache, exist_ok=True)
+
+	verify_package_cache(cache)
+	# Packages prefetched during this run count as downloaded, not as served from the cache.
+	if (cached := prefetch.get('cached')) is None:
+		cached = {filename: os.path.getsize(f'{cache}/{filename}') for _, _, filename in package_files(cache)}
+	run_command(f'/usr/bin/mount --bind {cache} {cache_mount}')
+	try:
+		yield cache
+	finally:
+		run_command(f'/usr/bin/umount {cache_mount}')
+
+		installed = installed_from_log(installation)
+		served = downloaded = 0
+		for name, version, filename in package_files(cache):
+			if f'{name}-{version}' in installed:
+				if filename in cached:
+					served += cached[filename]
+				else:
+					downloaded += os.path.getsize(f'{cache}/{filename}')
+		archinstall.log(f'Package cache: {served / 1024 ** 2:.1f} MiB served from {cache}, {downloaded / 1024 ** 2:.1f} MiB downloaded', level=logging.INFO)
+
+		prune_package_cache(cache, int(archinstall.arguments.get('package-cache-keep', package_cache_keep)))
+
+@traced
+def install_aur_helper(helper_name: str, installation: Installer, user: str, environment=None):
+	"""
+	Builds (or takes from the AUR build cache) and installs the AUR helper as the given user. Returns whether it was installed.
+	"""
 	archinstall.log(f"Installing {helper_name}...")
-	user = list(archinstall.arguments.get('superusers', {}).keys())[0]
 	installation.add_additional_packages(['git'])
-	arch_chroot(installation, f'git clone https://aur.archlinux.org/{helper_name}.git /home/{user}/{helper_name}', runas=user)
-	arch_chroot(installation, f'cd /home/{user}/{helper_name} && makepkg -si --noconfirm', runas=user)
+	build_dir = f'/home/{user}/{helper_name}'
+	try:
+		if not clone_aur_package(installation, user, helper_name, build_dir):
+			archinstall.log(f'Could not install {helper_name}: it could not be cloned', level=logging.INFO, fg='red')
+			return False
+		config = makepkg_overlay(installation, user, os.cpu_count() or 1, environment or {})
+		key = aur_cache_key(installation, build_dir, config)
+		if not (files := aur_cache_lookup(installation, key, f'{build_dir}/pkg')):
+			build = arch_chroot(installation, f'cd {build_dir} && PKGDEST={build_dir}/pkg makepkg -s --noconfirm --config {config}', runas=user)
+			files = sorted(path[len(installation.target):] for path in glob.glob(f'{installation.target}{build_dir}/pkg/*.pkg.tar*') if not path.endswith('.sig'))
+			if build.exit_code != 0 or not files:
+				archinstall.log(f'Could not install {helper_name}: it failed to build ({build.exit_code})', level=logging.INFO, fg='red')
+				return False
+			aur_cache_store(installation, key, helper_name, files)
+		if (install := arch_chroot(installation, f'/usr/bin/pacman -U --noconfirm --needed {" ".join(files)}')).exit_code != 0:
+			archinstall.log(f'Could not install {helper_name}: {install.exit_code}', level=logging.INFO, fg='red')
+			return False
+	except archinstall.SysCallError as err:
+		archinstall.log(f'Could not install {helper_name}: {err}', level=logging.INFO, fg='red')
+		return False
 	# installation.arch_chroot(f'rm -rf /home/{user}/{helper_name}', runas=user)
-	arch_chroot(installation, f'/usr/bin/{helper_name} --save --nocleanmenu --nodiffmenu --noeditmenu --removemake', runas=user)
+	return True
+
+def save_aur_helper_settings(installation: Installer, user: str):
+	"""
+	Saves the AUR helper's defaults to the config of the user who is going to use it.
+	"""
+	arch_chroot(installation, f"/usr/bin/{archinstall.arguments['aur-helper']} --save --nocleanmenu --nodiffmenu --noeditmenu --removemake", runas=user)
+
+def clone_aur_package(installation: Installer, user: str, base: str, build_dir: str):
+	"""
+	Clones an AUR package base, checking out the commit pinned by the lockfile if there is one.
+	"""
+	if not (commit := aur_pins().get(base)):
+		return arch_chroot(installation, f'git clone --depth 1 https://aur.archlinux.org/{base}.git {build_dir}', runas=user).exit_code == 0
+
+	if arch_chroot(installation, f'git clone https://aur.archlinux.org/{base}.git {build_dir}', runas=user).exit_code != 0:
+		return False
+	return arch_chroot(installation, f'git -C {build_dir} checkout --quiet {commit}', runas=user).exit_code == 0
 
 def arch_chroot(installation, cmd, *args, **kwargs):
+	name = command_log_name(cmd)
 	if 'runas' in kwargs:
 		cmd = f"su - {kwargs['runas']} -c \"{cmd}\""
 
-	return SysCommand(f'/usr/bin/arch-chroot {installation.target} {cmd}', peak_output=True)
+	with trace_step('arch-chroot', category='command', cmd=cmd):
+		return stream_command(f'/usr/bin/arch-chroot {installation.target} {cmd}', name)
+
+command_log_counter = itertools.count(1)
+command_progress = {'running': {}, 'thread': None}
+command_progress_lock = threading.Lock()
+
+class StreamedCommand:
+	"""
+	The outcome of stream_command(). Only the last lines of the output are kept,
+	the complete output is in the command's log file.
+	"""
+	def __init__(self, exit_code: int, tail, log_file: str):
+		self.exit_code = exit_code
+		self.tail = tail
+		self.log_file = log_file
+
+	def decode(self, encoding: str = 'utf-8'):
+		return b'\n'.join(self.tail).decode(encoding, errors='replace')
+
+	def contains(self, text: str):
+		"""
+		Searches the complete output in the log file, not just the lines kept in memory.
+		"""
+		needle = text.encode()
+		previous = b''
+		with gzip.open(self.log_file, 'rb') as log:
+			while chunk := log.read(1024 * 1024):
+				if needle in previous[-len(needle):] + chunk:
+					return True
+				previous = chunk
+		return False
+
+def command_log_name(cmd: str):
+	if match := re.match(r'^cd (\S+) && .*\bmakepkg\b', cmd):
+		return f'makepkg-{os.path.basename(match.group(1))}'
+	return re.sub(r'[^\w.+-]+', '-', cmd)[:60].strip('-')
+
+def stream_command(cmd: str, name: str):
+	"""
+	Runs a command with its output streamed into a gzip compressed log file of its own.
+	Only the last lines are kept in memory (in a ring buffer), so memory use doesn't grow
+	with the amount of output. When the command fails, those lines are shown.
+	"""
+	# The installs of a fleet share the log directory, and each of them counts its commands from 1.
+	log_path = f"{archinstall.storage.get('LOG_PATH', '/var/log/archinstall')}/commands/{archinstall.arguments.get('hostname', None) or os.getpid()}"
+	os.makedirs(log_path, exist_ok=True)
+	log_file = f'{log_path}/{next(command_log_counter):04d}-{name}.log.gz'
+	tail = collections.deque(maxlen=int(archinstall.arguments.get('command-log-tail', command_log_tail)))
+	partial = b''
+	progress = {'name': name, 'bytes': 0, 'started': time.perf_counter()}
+
+	try:
+		process = subprocess.Popen(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	except (OSError, ValueError) as err:
+		raise archinstall.SysCallError(f'Could not run {cmd}: {err}')
+
+	with gzip.open(log_file, 'wb', compresslevel=3) as log, process:
+		log.write(f'$ {cmd}\n'.encode())
+		with command_progress_lock:
+			command_progress['running'][log_file] = progress
+		start_command_progress()
+		try:
+			while chunk := os.read(process.stdout.fileno(), 64 * 1024):
+				log.write(chunk)
+				progress['bytes'] += len(chunk)
+				# Progress bars redraw their line with a carriage return, those count as lines too.
+				lines = re.split(rb'[\r\n]', partial + chunk)
+				partial = lines.pop()[-4096:]
+				tail.extend(line[:4096] for line in lines[-tail.maxlen:] if line.strip())
+			exit_code = process.wait()
+		finally:
+			with command_progress_lock:
+				del command_progress['running'][log_file]
+
+	if partial.strip():
+		tail.append(partial)
+	if exit_code != 0:
+		archinstall.log(f'{name} failed with exit code {exit_code}, the last {len(tail)} lines of its output follow (complete log: {log_file})', level=logging.INFO, fg='red')
+		for line in tail:
+			archinstall.log(f"  {line.decode('utf-8', errors='replace')}", level=logging.INFO)
+	return StreamedCommand(exit_code, tail, log_file)
+
+def start_command_progress():
+	with command_progress_lock:
+		if command_progress['thread'] is None and sys.stdout.isatty():
+			command_progress['thread'] = threading.Thread(target=print_command_progress, name='command-progress', daemon=True)
+			command_progress['thread'].start()
+
+def print_command_progress():
+	"""
+	Keeps a single status line with the output throughput of the running commands up to date.
+	It's drawn from its own thread, so a slow terminal only ever holds up the status line, never a command.
+	"""
+	shown = False
+	while True:
+		time.sleep(0.5)
+		now = time.perf_counter()
+		with command_progress_lock:
+			running = list(command_progress['running'].values())
+		if not running:
+			if shown:
+				print('\r\033[K', end='', flush=True)
+				shown = False
+			continue
+
+		status = ', '.join(f"{progress['name']} {progress['bytes'] / 1024 ** 2:.1f} MiB ({progress['bytes'] / 1024 / max(now - progress['started'], 0.001):.0f} KiB/s)" for progress in running)
+		print(f'\r\033[K{status[:shutil.get_terminal_size().columns - 1]}', end='', flush=True)
+		shown = True
+
+def aur_info(*packages):
+	"""
+	Queries the AUR RPC interface for the given package names.
+	Returns the metadata of every package found, indexed by package name.
+	"""
+	info = {}
+	packages = sorted(packages)
+	# The RPC interface limits the length of the request, so we query in chunks.
+	for index in range(0, len(packages), 100):
+		query = urllib.parse.urlencode([('v', 5), ('type', 'info')] + [('arg[]', package) for package in packages[index:index + 100]])
+		with urllib.request.urlopen(f'https://aur.archlinux.org/rpc/?{query}', timeout=30) as response:
+			for result in json.loads(response.read())['results']:
+				info[result['Name']] = result
+	return info
+
+def strip_version(dependency: str):
+	return re.split('[<>=]', dependency, 1)[0]
+
+@traced
+def resolve_aur_dependencies(packages):
+	"""
+	Walks the AUR dependency graph of the given packages.
+	Returns the AUR metadata of every package in the closure, together with
+	the dependencies that are not in the AUR and have to come from the repositories.
+	"""
+	resolved = {}
+	repo_dependencies = set()
+	pending = set(packages)
+	while pending:
+		info = aur_info(*pending)
+		for name in pending - set(info):
+			if name in packages:
+				archinstall.log(f'Could not find package {name} in the AUR', level=logging.INFO, fg='red')
+			else:
+				repo_dependencies.add(name)
+		resolved.update(info)
+
+		pending = set()
+		for result in info.values():
+			for dependency in result.get('Depends', []) + result.get('MakeDepends', []) + result.get('CheckDepends', []):
+				dependency = strip_version(dependency)
+				if dependency not in resolved and dependency not in repo_dependencies:
+					pending.add(dependency)
+
+	return resolved, repo_dependencies
+
+def aur_build_levels(resolved):
+	"""
+	Groups the package bases of the resolved AUR packages into levels.
+	Every package base only depends on package bases from earlier levels,
+	so all package bases within one level can be built at the same time.
+	"""
+	dependencies = {}
+	for result in resolved.values():
+		base = dependencies.setdefault(result['PackageBase'], set())
+		for dependency in result.get('Depends', []) + result.get('MakeDepends', []) + result.get('CheckDepends', []):
+			if (dependency := strip_version(dependency)) in resolved and resolved[dependency]['PackageBase'] != result['PackageBase']:
+				base.add(resolved[dependency]['PackageBase'])
+
+	levels = []
+	done = set()
+	while len(done) < len(dependencies):
+		level = sorted(base for base, needs in dependencies.items() if base not in done and needs <= done)
+		if not level:
+			# Circular dependencies, we hand the rest over in one go and let makepkg report the problem.
+			level = sorted(set(dependencies) - done)
+		levels.append(level)
+		done.update(level)
+
+	return levels, dependencies
+
+@contextlib.contextmanager
+def build_user(installation: Installer):
+	"""
+	Yields a throwaway user to build the AUR packages as, allowed to run pacman through sudo for makepkg.
+	The user and its home directory (with the build trees) are removed again afterwards.
+	"""
+	if aur_build_user not in existing_users(installation.target) and (useradd := arch_chroot(installation, f'/usr/bin/useradd -m -r -s /bin/bash {aur_build_user}')).exit_code != 0:
+		raise archinstall.RequirementError(f'Could not create the AUR build user: {useradd.exit_code}')
+	add_sudoer(installation, aur_build_user)
+	try:
+		yield aur_build_user
+	finally:
+		remove_sudoer(installation, aur_build_user)
+		arch_chroot(installation, f'/usr/bin/userdel -r {aur_build_user}')
+
+@contextlib.contextmanager
+def build_environment(installation: Installer, user: str):
+	"""
+	Sets up where and how AUR packages are built for the duration of the AUR stage: BUILDDIR on a tmpfs
+	sized from the available memory, a compiler cache that persists across installs, and fast package compression.
+	All of it goes into the makepkg.conf overlays of the builds, the installation's /etc/makepkg.conf is left as it is.
+	Yields the environment for makepkg_overlay(). Afterwards the build times are compared with the previous install's.
+	"""
+	environment = {'tmpfs': None, 'settings': [], 'label': 'disk', 'builds': {}, 'lock': threading.Lock()}
+	mounts = []
+	arch_chroot(installation, f'mkdir -p /home/{user}/.cache/archinstall', runas=user)
+	if archinstall.arguments.get('no-build-env', False):
+		yield environment
+		return
+
+	labels = []
+	try:
+		size = int(meminfo('MemAvailable') * float(archinstall.arguments.get('build-tmpfs-share', build_tmpfs_share)))
+		if size >= build_tmpfs_minimum:
+			tmpfs = '/var/tmp/archinstall-build'
+			os.makedirs(f'{installation.target}{tmpfs}', exist_ok=True)
+			run_command(f'/usr/bin/mount -t tmpfs -o size={size},mode=1777 archinstall-build {installation.target}{tmpfs}')
+			mounts.append(f'{installation.target}{tmpfs}')
+			environment['tmpfs'] = tmpfs
+			labels.append(f'tmpfs {size / 1024 ** 3:.0f}G')
+		else:
+			archinstall.log(f'Not enough memory available for a build tmpfs ({size / 1024 ** 3:.1f} GiB), building on disk', level=logging.INFO)
+
+		if os.path.isfile(f'{installation.target}/usr/bin/ccache') and (cache := host_cache('ccache')):
+			os.makedirs(cache, exist_ok=True)
+			os.chmod(cache, 0o1777)
+			os.makedirs(f'{installation.target}/var/cache/ccache', exist_ok=True)
+			run_command(f'/usr/bin/mount --bind {cache} {installation.target}/var/cache/ccache')
+			mounts.append(f'{installation.target}/var/cache/ccache')
+			buildenv = makepkg_settings(installation, 'BUILDENV').get('BUILDENV', '(!distcc color !ccache check !sign)')
+			environment['settings'] += [f"BUILDENV={buildenv.replace('!ccache', 'ccache')}", 'export CCACHE_DIR=/var/cache/ccache', 'export CCACHE_UMASK=000']
+			labels.append('ccache')
+
+		# The packages are installed right away (and kept in the AUR build cache), so they're compressed fast rather than small.
+		if archinstall.arguments.get('aur-package-compression', 'zstd') == 'none':
+			environment['settings'].append("PKGEXT='.pkg.tar'")
+			labels.append('uncompressed')
+		else:
+			environment['settings'] += ["PKGEXT='.pkg.tar.zst'", 'COMPRESSZST=(zstd -c -T0 -1 -)']
+			labels.append('zstd -T0 -1')
+		environment['label'] = ', '.join(labels)
+
+		yield environment
+	finally:
+		for mount in reversed(mounts):
+			run_command(f'/usr/bin/umount {mount}')
+		for overlay in glob.glob(f'{installation.target}/home/{user}/.cache/archinstall/makepkg-*.conf'):
+			os.remove(overlay)
+		report_build_times(environment)
+
+def makepkg_overlay(installation: Installer, user: str, jobs: int, environment, tmpfs: bool = True):
+	"""
+	Writes the makepkg.conf overlay a build runs with and returns its path inside the installation.
+	"""
+	build_tmpfs = tmpfs and environment.get('tmpfs', None)
+	config = f"/home/{user}/.cache/archinstall/makepkg-j{jobs}{'-tmpfs' if build_tmpfs else ''}.conf"
+	with open(f'{installation.target}{config}', 'w') as config_file:
+		config_file.write('\n'.join(['source /etc/makepkg.conf', f'MAKEFLAGS="-j{jobs}"'] + environment.get('settings', []) + ([f'BUILDDIR={build_tmpfs}'] if build_tmpfs else [])) + '\n')
+	return config
+
+def record_build_time(environment, base: str, duration: float):
+	if 'lock' in environment:
+		with environment['lock']:
+			environment['builds'][base] = duration
+
+def report_build_times(environment):
+	"""
+	Compares the build times of this install with the ones of the previous install that built the same
+	package bases, and keeps them for the next one.
+	"""
+	if not environment['builds'] or (cache := host_cache('aur-cache')) is None:
+		return
+	path = f'{cache}/build-times.json'
+	previous = {}
+	if os.path.isfile(path):
+		with open(path, 'r') as times_file:
+			previous = json.load(times_file)
+
+	archinstall.log(f"AUR build times ({environment['label']}), compared to the previous install:", level=logging.INFO)
+	for base, duration in sorted(environment['builds'].items(), key=lambda item: -item[1]):
+		if before := previous.get(base, None):
+			archinstall.log(f"  {base:<50} {duration:>7.0f}s  before: {before['seconds']:>7.0f}s ({before['environment']}), {(duration - before['seconds']) / max(before['seconds'], 0.001) * 100:+.0f}%", level=logging.INFO)
+		else:
+			archinstall.log(f"  {base:<50} {duration:>7.0f}s", level=logging.INFO)
+		previous[base] = {'seconds': round(duration, 1), 'environment': environment['label'], 'time': time.time()}
+
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(f'{path}.tmp', 'w') as times_file:
+		json.dump(previous, times_file, indent=4, sort_keys=True)
+	os.replace(f'{path}.tmp', path)
 
+def build_aur_package(installation: Installer, user: str, base: str, jobs: int, environment=None):
+	"""
+	Clones and builds a single AUR package base as the given user, unless the
+	package cache already holds a build of the same PKGBUILD with the same settings.
+	The build runs with its own share of the cores, in the build environment, through a makepkg.conf overlay.
+	Returns the paths (inside the installation) of the built packages, or None on failure.
+	"""
+	environment = environment or {}
+	build_dir = f'/home/{user}/.cache/archinstall/aur/{base}'
+	config = makepkg_overlay(installation, user, jobs, environment)
+
+	try:
+		arch_chroot(installation, f'rm -rf {build_dir}', runas=user)
+		if not clone_aur_package(installation, user, base, build_dir):
+			return None
+		key = aur_cache_key(installation, build_dir, config)
+		# Concurrent installs building the same package wait for each other and share the result through the cache.
+		with aur_cache_build_lock(key):
+			if files := aur_cache_lookup(installation, key, f'{build_dir}/pkg'):
+				return files
+			with fleet_slot('build'), admitted('build', base):
+				started = time.perf_counter()
+				build = arch_chroot(installation, f'cd {build_dir} && PKGDEST={build_dir}/pkg makepkg --noconfirm --config {config}', runas=user)
+				if tmpfs := environment.get('tmpfs', None):
+					arch_chroot(installation, f'rm -rf {tmpfs}/{base}', runas=user)
+					# Builds that outgrow the tmpfs get another go on disk.
+					if build.exit_code != 0 and build.contains('No space left on device'):
+						archinstall.log(f'{base} does not fit into the build tmpfs, building it on disk', level=logging.INFO, fg='yellow')
+						started = time.perf_counter()
+						build = arch_chroot(installation, f'cd {build_dir} && PKGDEST={build_dir}/pkg makepkg --noconfirm --config {makepkg_overlay(installation, user, jobs, environment, tmpfs=False)}', runas=user)
+				if build.exit_code != 0:
+					return None
+				record_build_time(environment, base, time.perf_counter() - started)
+
+			files = sorted(path[len(installation.target):] for path in glob.glob(f'{installation.target}{build_dir}/pkg/*.pkg.tar*') if not path.endswith('.sig'))
+			aur_cache_store(installation, key, base, files)
+			return files
+	except archinstall.SysCallError as err:
+		archinstall.log(f'Could not build {base}: {err}', level=logging.DEBUG)
+		return None
+
+aur_cache_lock = threading.Lock()
+
+@contextlib.contextmanager
+def aur_cache_locked():
+	"""
+	Holds the AUR cache index while inside the block. The installs of a fleet are separate
+	processes sharing the cache, so besides the threads of this one they are locked out too.
+	"""
+	cache = host_cache('aur-cache')
+	os.makedirs(cache, exist_ok=True)
+	with aur_cache_lock, open(f'{cache}/index.lock', 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+
+def git_head(path: str):
+	"""
+	Returns the commit checked out in a git repository without requiring git on the host.
+	"""
+	with open(f'{path}/.git/HEAD', 'r') as head:
+		ref = head.read().strip()
+	if not ref.startswith('ref: '):
+		return ref
+
+	ref = ref[len('ref: '):]
+	if os.path.isfile(f'{path}/.git/{ref}'):
+		with open(f'{path}/.git/{ref}', 'r') as ref_file:
+			return ref_file.read().strip()
+	with open(f'{path}/.git/packed-refs', 'r') as packed_refs:
+		for line in packed_refs:
+			if line.strip().endswith(f' {ref}'):
+				return line.split(' ', 1)[0]
+	return None
+
+def makepkg_settings(installation: Installer, *names):
+	"""
+	Reads simple assignments such as CARCH or CFLAGS from the installation's makepkg.conf.
+	"""
+	settings = {}
+	with open(f'{installation.target}/etc/makepkg.conf', 'r') as config:
+		for line in config:
+			if (match := re.match(r'^([A-Z_]+)=(.*)$', line.strip())) and match.group(1) in names:
+				settings[match.group(1)] = match.group(2).strip('"\'')
+	return settings
+
+def aur_cache_key(installation: Installer, build_dir: str, config: str):
+	"""
+	Content address of a package build: the PKGBUILD commit, the architecture and compiler flags of the
+	installation's makepkg.conf, and the settings the build's makepkg.conf overlay puts on top of them
+	(MAKEFLAGS, BUILDENV, PKGEXT). Where the build runs (BUILDDIR) doesn't change what it builds, so it's left out.
+	"""
+	settings = makepkg_settings(installation, 'CARCH', 'CFLAGS', 'CXXFLAGS')
+	with open(f'{installation.target}{config}', 'r') as overlay:
+		settings['overlay'] = [line.strip() for line in overlay if line.strip() and not line.startswith(('source ', 'BUILDDIR='))]
+	settings['commit'] = git_head(f'{installation.target}{build_dir}')
+	return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+@contextlib.contextmanager
+def aur_cache_build_lock(key: str):
+	if (cache := host_cache('aur-cache')) is None:
+		yield
+		return
+	os.makedirs(cache, exist_ok=True)
+	with open(f'{cache}/{key}.lock', 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+
+def aur_cache_index():
+	cache = host_cache('aur-cache')
+	if cache is not None and os.path.isfile(f'{cache}/index.json'):
+		with open(f'{cache}/index.json', 'r') as index:
+			return json.load(index)
+	return {'entries': {}, 'hits': 0, 'misses': 0}
+
+def save_aur_cache_index(index):
+	cache = host_cache('aur-cache')
+	os.makedirs(cache, exist_ok=True)
+	with open(f'{cache}/index.json.{os.getpid()}', 'w') as index_file:
+		json.dump(index, index_file, indent=4, sort_keys=True)
+	os.replace(f'{cache}/index.json.{os.getpid()}', f'{cache}/index.json')
+
+def aur_cache_lookup(installation: Installer, key: str, destination: str):
+	"""
+	Copies a cached build into the given directory (inside the installation).
+	Returns the paths of the copied packages, or None on a cache miss.
+	"""
+	if (cache := host_cache('aur-cache')) is None:
+		return None
+	with aur_cache_locked():
+		index = aur_cache_index()
+		entry = index['entries'].get(key)
+		if entry is None or not all(os.path.isfile(f'{cache}/{key}/{name}') for name in entry['files']):
+			index['misses'] += 1
+			save_aur_cache_index(index)
+			return None
+
+		entry['last_used'] = time.time()
+		index['hits'] += 1
+		save_aur_cache_index(index)
+
+	archinstall.log(f"Using cached build of {entry['package']} ({key[:12]})", level=logging.INFO)
+	os.makedirs(f'{installation.target}{destination}', exist_ok=True)
+	for name in entry['files']:
+		shutil.copy2(f'{cache}/{key}/{name}', f'{installation.target}{destination}/{name}')
+	return [f'{destination}/{name}' for name in entry['files']]
+
+def aur_cache_store(installation: Installer, key: str, package: str, files):
+	"""
+	Adds freshly built packages to the cache and evicts the least recently used
+	builds until the cache fits within its size limit again.
+	"""
+	cache = host_cache('aur-cache')
+	limit = int(archinstall.arguments.get('aur-cache-size', aur_cache_size))
+	if not files or cache is None:
+		return
+
+	os.makedirs(f'{cache}/{key}', exist_ok=True)
+	# Another install of the fleet may be storing the same build, so each file is copied under a name of its own first.
+	for path in files:
+		shutil.copy2(f'{installation.target}{path}', f'{cache}/{key}/{os.path.basename(path)}.{os.getpid()}')
+		os.replace(f'{cache}/{key}/{os.path.basename(path)}.{os.getpid()}', f'{cache}/{key}/{os.path.basename(path)}')
+
+	with aur_cache_locked():
+		index = aur_cache_index()
+		index['entries'][key] = {
+			'package': package,
+			'files': [os.path.basename(path) for path in files],
+			'size': sum(os.path.getsize(f'{installation.target}{path}') for path in files),
+			'last_used': time.time()
+		}
+
+		total = sum(entry['size'] for entry in index['entries'].values())
+		for old_key, entry in sorted(index['entries'].items(), key=lambda item: item[1]['last_used']):
+			if total <= limit or old_key == key:
+				break
+			archinstall.log(f"Evicting cached build of {entry['package']} ({old_key[:12]})", level=logging.DEBUG)
+			shutil.rmtree(f'{cache}/{old_key}', ignore_errors=True)
+			del index['entries'][old_key]
+			total -= entry['size']
+
+		save_aur_cache_index(index)
+
+def print_aur_cache_stats():
+	if (cache := host_cache('aur-cache')) is None:
+		print('There is no AUR package cache')
+		return
+	index = aur_cache_index()
+	lookups = index['hits'] + index['misses']
+	print(f'AUR package cache: {cache}')
+	print(f"  Builds cached: {len(index['entries'])} ({sum(entry['size'] for entry in index['entries'].values()) / 1024 ** 2:.1f} MiB)")
+	print(f"  Hits: {index['hits']}, misses: {index['misses']} ({index['hits'] / lookups * 100 if lookups else 0:.1f}% hit rate)")
+	for key, entry in sorted(index['entries'].items(), key=lambda item: item[1]['package']):
+		print(f"  {entry['package']:<50} {key[:12]} {entry['size'] / 1024 ** 2:>8.1f} MiB")
+
+def package_file_name(path: str):
+	return os.path.basename(path).rsplit('-', 3)[0]
+
+@traced
 def install_aur_packages(installation: Installer, *packages, **kwargs):
+	"""
+	Builds the given AUR packages and their AUR dependencies as the `user` given.
+	The dependency graph is resolved up front, independent package bases are built
+	concurrently by several makepkg workers and the results are installed in one transaction.
+	"""
 	if type(packages[0]) in (list, tuple):
 		packages = packages[0]
 	archinstall.log(f'Installing packages: {packages}', level=logging.INFO)
 
-	user = list(archinstall.arguments.get('superusers', {}).keys())[0]
+	user = kwargs['user']
+
+	if not (resolution := kwargs.get('resolution', None)):
+		resolution = resolve_aur_dependencies(packages)
+	resolved, repo_dependencies = resolution
+	levels, dependencies = aur_build_levels(resolved)
+
+	# When resuming, the package bases that were installed before are left out.
+	if not (pending := {base for level in levels for base in level if step_pending(installation, f'aur {base}', independent=True)}):
+		return
+
+	# Repository dependencies are installed in one go, so that makepkg never has to call pacman itself.
+	# This keeps concurrent builds from fighting over the pacman database lock.
+	# The ones only needed to build are removed again at the end, like yay's --removemake.
+	runtime = {strip_version(dependency) for info in resolved.values() for dependency in info.get('Depends', [])}
+	missing = sorted(set(repo_dependencies) - installed_names(installation))
+	make_dependencies = [dependency for dependency in missing if dependency not in runtime]
+	failed = set()
+	if missing:
+		# They are installed by the installation's pacman, from the shared sync databases.
+		if not seed_sync_databases(installation.target) and (sync_mirrors := arch_chroot(installation, '/usr/bin/pacman -Sy')).exit_code != 0:
+			archinstall.log(f'Could not sync mirrors: {sync_mirrors.exit_code}', level=logging.INFO)
+			return
+		if (transaction := arch_chroot(installation, f'/usr/bin/pacman -S --needed --asdeps --noconfirm {" ".join(missing)}')).exit_code != 0:
+			# Fall back to one transaction per package base, so that a dependency which cannot be installed
+			# only fails the package bases that need it, and the rest are still built.
+			archinstall.log(f'Could not install the repository dependencies of the AUR packages ({transaction.exit_code}): {" ".join(missing)}', level=logging.INFO, fg='red')
+			for base in sorted(pending):
+				needs = {strip_version(dependency) for info in resolved.values() if info['PackageBase'] == base for dependency in info.get('Depends', []) + info.get('MakeDepends', []) + info.get('CheckDepends', [])}
+				if (needs := sorted(needs & set(missing))) and (transaction := arch_chroot(installation, f'/usr/bin/pacman -S --needed --asdeps --noconfirm {" ".join(needs)}')).exit_code != 0:
+					archinstall.log(f'Could not install packages: the repository dependencies of {base} could not be installed ({transaction.exit_code}): {" ".join(needs)}', level=logging.INFO)
+					failed.add(base)
+			# Only what actually got installed can be removed again at the end.
+			installed = installed_names(installation)
+			make_dependencies = [dependency for dependency in make_dependencies if dependency in installed]
+	arch_chroot(installation, f'mkdir -p /home/{user}/.cache/archinstall/aur', runas=user)
+
+	cores = os.cpu_count() or 1
+	# The governor holds builds back when memory runs short, so with it more of them can be started at once.
+	workers = int(archinstall.arguments.get('aur-build-workers', max(1, cores // (4 if archinstall.arguments.get('no-governor', False) else 2))))
+	needed_by_others = set().union(*dependencies.values()) if dependencies else set()
+	built = {}
+
+	for level in levels:
+		pool_size = max(1, min(workers, len(level)))
+		jobs = max(1, cores // pool_size)
+		with ThreadPoolExecutor(max_workers=pool_size) as pool:
+			builds = {}
+			for base in level:
+				if base not in pending or base in failed:
+					continue
+				if dependencies[base] & failed:
+					archinstall.log(f'Could not install packages: a dependency of {base} failed to build', level=logging.INFO)
+					failed.add(base)
+					continue
+				archinstall.log(f'Installing package: {base}', level=logging.INFO)
+				builds[base] = pool.submit(trace_step(f'build {base}', category='aur', jobs=jobs)(build_aur_package), installation, user, base, jobs, kwargs.get('environment', None))
 
-	if (sync_mirrors := SysCommand('/usr/bin/pacman -Syy')).exit_code == 0:
-		for package in packages:
-			archinstall.log(f'Installing package: {package}', level=logging.INFO)
-			if (pacstrap := arch_chroot(installation, f'/usr/bin/{archinstall.arguments["aur-helper"]} -S --noconfirm {package}', runas=user)).exit_code == 0:
-				archinstall.log(f'Installed {package}', level=logging.INFO)
+			for base, build in builds.items():
+				if (files := build.result()) is None:
+					archinstall.log(f'Could not install packages: {base} failed to build', level=logging.INFO)
+					failed.add(base)
+				else:
+					built[base] = [path for path in files if package_file_name(path) in resolved]
+
+		# Anything a later level depends on has to be installed before that level is built.
+		if intermediate := {base: built.pop(base) for base in level if base in needed_by_others and base in built}:
+			paths = [path for paths in intermediate.values() for path in paths]
+			if arch_chroot(installation, f'/usr/bin/pacman -U --noconfirm --needed --asdeps {" ".join(paths)}').exit_code != 0:
+				archinstall.log(f'Could not install build dependencies: {paths}', level=logging.INFO)
 			else:
-				archinstall.log(f'Could not install packages: {pacstrap.exit_code}', level=logging.INFO)
+				for base, paths in intermediate.items():
+					step_done(installation, f'aur {base}', packages=[package_file_name(path) for path in paths])
+
+	if not built:
+		remove_make_dependencies(installation, make_dependencies)
+		return
+
+	files = [path for paths in built.values() for path in paths]
+	if (transaction := arch_chroot(installation, f'/usr/bin/pacman -U --noconfirm --needed {" ".join(files)}')).exit_code == 0:
+		for base, paths in built.items():
+			archinstall.log(f'Installed {base}', level=logging.INFO)
+			step_done(installation, f'aur {base}', packages=[package_file_name(path) for path in paths])
 	else:
-		archinstall.log(f'Could not sync mirrors: {sync_mirrors.exit_code}', level=logging.INFO)
-
-
-if not check_mirror_reachable():
-	log_file = os.path.join(archinstall.storage.get('LOG_PATH', None), archinstall.storage.get('LOG_FILE', None))
-	archinstall.log(f"Arch Linux mirrors are not reachable. Please check your internet connection and the log file '{log_file}'.", level=logging.INFO, fg="red")
-	exit(1)
-
-if archinstall.arguments.get('silent', None) is None:
-	ask_user_questions()
-# else:
-# 	# Workarounds if config is loaded from a file
-# 	# The harddrive section should be moved to perform_installation_steps, where it's actually being performed
-# 	# Blockdevice object should be created in perform_installation_steps
-# 	# This needs to be done until then
-# 	archinstall.arguments['harddrive'] = archinstall.BlockDevice(path=archinstall.arguments['harddrive']['path'])
-# 	# Temporarily disabling keep_partitions if config file is loaded
-# 	archinstall.arguments['harddrive'].keep_partitions = False
-# 	# Temporary workaround to make Desktop Environments work
-# 	if archinstall.arguments.get('profile', None) is not None:
-# 		if type(archinstall.arguments.get('profile', None)) is dict:
-# 			archinstall.arguments['profile'] = archinstall.Profile(None, archinstall.arguments.get('profile', None)['path'])
-# 		else:
-# 			archinstall.arguments['profile'] = archinstall.Profile(None, archinstall.arguments.get('profile', None))
-# 	else:
-# 		archinstall.arguments['profile'] = None
-# 	if archinstall.arguments.get('mirror-region', None) is not None:
-# 		if type(archinstall.arguments.get('mirror-region', None)) is dict:
-# 			archinstall.arguments['mirror-region'] = archinstall.arguments.get('mirror-region', None)
-# 		else:
-# 			selected_region = archinstall.arguments.get('mirror-region', None)
-# 			archinstall.arguments['mirror-region'] = {selected_region: archinstall.list_mirrors()[selected_region]}
-# 	archinstall.arguments['sys-language'] = archinstall.arguments.get('sys-language', 'en_US')
-# 	archinstall.arguments['sys-encoding'] = archinstall.arguments.get('sys-encoding', 'utf-8')
-# 	if archinstall.arguments.get('gfx_driver', None) is not None:
-# 		archinstall.storage['gfx_driver_packages'] = AVAILABLE_GFX_DRIVERS.get(archinstall.arguments.get('gfx_driver', None), None)
-
-ask_user_questions()
-perform_installation_steps()
+		# Fall back to one transaction per package base, so that we can tell which package is at fault.
+		archinstall.log(f'Could not install packages: {transaction.exit_code}', level=logging.INFO)
+		for base, paths in built.items():
+			if (pacstrap := arch_chroot(installation, f'/usr/bin/pacman -U --noconfirm --needed {" ".join(paths)}')).exit_code == 0:
+				archinstall.log(f'Installed {base}', level=logging.INFO)
+				step_done(installation, f'aur {base}', packages=[package_file_name(path) for path in paths])
+			else:
+				archinstall.log(f'Could not install packages: {pacstrap.exit_code}', level=logging.INFO)
+
+	# Requested packages that also served as a dependency were installed with --asdeps above.
+	if explicit := [package for package in packages if package in resolved and resolved[package]['PackageBase'] in needed_by_others]:
+		arch_chroot(installation, f'/usr/bin/pacman -D --asexplicit {" ".join(explicit)}')
+	remove_make_dependencies(installation, make_dependencies)
+
+def remove_make_dependencies(installation: Installer, packages):
+	"""
+	Removes the repository packages that were only installed to build the AUR packages.
+	Any of them that something installed since depends on is left in place.
+	"""
+	if packages and (removal := arch_chroot(installation, f'/usr/bin/pacman -Rnsu --noconfirm {" ".join(packages)}')).exit_code != 0:
+		archinstall.log(f'Could not remove the build dependencies of the AUR packages: {removal.exit_code}', level=logging.INFO)
+
+
+preflight_futures = {}
+preflight_results = {}
+
+def preflight_probes():
+	"""
+	The independent startup probes, with how long (in seconds) each of them may take.
+	"""
+	return {
+		'mirror_reachable': (check_mirror_reachable, 10),
+		'disk_layouts': (archinstall.disk_layouts, 10),
+		'mirrors': (archinstall.list_mirrors, 15),
+		'uefi': (has_uefi, 5),
+		'disks': (archinstall.all_disks, 10),
+		'package_index': (load_package_index, 60)
+	}
+
+def run_preflight():
+	"""
+	Starts all startup probes at once. Their results are collected
+	(and cached for the rest of the run) by preflight() when they're first needed.
+	"""
+	pool = ThreadPoolExecutor(max_workers=len(probes := preflight_probes()), thread_name_prefix='preflight')
+	started = time.perf_counter()
+	for name, (probe, timeout) in probes.items():
+		preflight_futures[name] = (pool.submit(trace_step(f'preflight {name}', category='preflight')(probe)), started + timeout)
+	# Don't wait for probes that outlive their timeout.
+	pool.shutdown(wait=False)
+
+def preflight(name: str):
+	"""
+	Returns the result of a startup probe, or None if it failed or timed out.
+	"""
+	if name in preflight_results:
+		return preflight_results[name]
+	if name not in preflight_futures:
+		return None
+
+	future, deadline = preflight_futures[name]
+	try:
+		preflight_results[name] = future.result(timeout=max(0, deadline - time.perf_counter()))
+	except concurrent.futures.TimeoutError:
+		archinstall.log(f'Startup probe {name} timed out', level=logging.INFO, fg='yellow')
+		preflight_results[name] = None
+	except Exception as err:
+		archinstall.log(f'Startup probe {name} failed: {err}', level=logging.DEBUG)
+		preflight_results[name] = None
+	return preflight_results[name]
+
+def uefi():
+	if (result := preflight('uefi')) is None:
+		result = preflight_results['uefi'] = has_uefi()
+	return result
+
+def available_mirrors():
+	if (mirrors := preflight('mirrors')) is None:
+		archinstall.log('Could not list the mirrors in time.', level=logging.INFO, fg='red')
+		exit(1)
+	return mirrors
+
+def interactive():
+	"""
+	Runs driven by a configuration file (or --silent) never prompt, missing answers fall back to defaults.
+	archinstall merges the configuration into its arguments without keeping --config itself, so that is looked for on the command line.
+	"""
+	config = any(argument == '--config' or argument.startswith('--config=') for argument in sys.argv[1:])
+	return not (archinstall.arguments.get('silent', False) or config)
+
+def mark_first_disk_write():
+	if 'first_disk_write' not in preflight_results:
+		preflight_results['first_disk_write'] = time.perf_counter() - trace_started
+		archinstall.log(f"Time from launch to the first disk write: {preflight_results['first_disk_write']:.1f}s", level=logging.INFO)
+		with trace_lock:
+			trace_events.append({'name': 'first disk write', 'cat': 'step', 'ph': 'i', 's': 'g', 'ts': int(preflight_results['first_disk_write'] * 1000000), 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': {'thread': threading.current_thread().name}})
+
+def main():
+	if archinstall.arguments.get('help'):
+		print("See `man archinstall` for help.")
+		exit(0)
+	if os.getuid() != 0:
+		print("Archinstall requires root privileges to run. See --help for more.")
+		exit(1)
+
+	if archinstall.arguments.get('aur-cache-stats'):
+		print_aur_cache_stats()
+		exit(0)
+
+	if archinstall.arguments.get('fleet', None):
+		exit(0 if run_fleet(archinstall.arguments['fleet']) else 1)
+
+	if archinstall.arguments.get('mount-point', None):
+		archinstall.storage['MOUNT_POINT'] = archinstall.arguments['mount-point']
+
+	run_preflight()
+
+	# For support reasons, we'll log the disk layout pre installation to match against post-installation layout
+	archinstall.log(f"Disk states before installing: {preflight('disk_layouts')}", level=logging.DEBUG)
+
+	if not preflight('mirror_reachable'):
+		log_file = os.path.join(archinstall.storage.get('LOG_PATH', None), archinstall.storage.get('LOG_FILE', None))
+		archinstall.log(f"Arch Linux mirrors are not reachable. Please check your internet connection and the log file '{log_file}'.", level=logging.INFO, fg="red")
+		exit(1)
+
+	if archinstall.arguments.get('lockfile', None):
+		load_lockfile(archinstall.arguments['lockfile'])
+
+	with trace_step('ask_user_questions'):
+		ask_user_questions()
+
+	# Reconciling applies the configuration to an existing installation, instead of installing from scratch.
+	if archinstall.arguments.get('reconcile', False):
+		try:
+			reconcile_installation()
+		finally:
+			write_trace(int(archinstall.arguments.get('trace-top', 20)))
+		exit(0)
+
+	if archinstall.arguments.get('plan', False):
+		print_plan(plan_transactions())
+		exit(0)
+
+	if archinstall.arguments.get('lock', None):
+		lock_profile(archinstall.arguments['lock'])
+		exit(0)
+
+	if archinstall.arguments.get('prefetch-only', False):
+		if (cache := host_cache('package-cache')) is None:
+			exit(1)
+		if lockfile:
+			exit(0 if download_locked_packages(cache) else 1)
+		prefetch_packages(cache)
+		exit(0)
+
+	start_prefetch()
+	try:
+		with zram_swap():
+			perform_installation_steps()
+	finally:
+		write_trace(int(archinstall.arguments.get('trace-top', 20)))
+
+
+if __name__ == '__main__':
+	main()